@@ -7,10 +7,10 @@ import nacl.secret
 import nacl.utils
 import voluptuous as vol  # type: ignore
 from flask import Blueprint, current_app
-from sqlalchemy.orm import joinedload  # type: ignore
+from sqlalchemy.orm import selectinload  # type: ignore
 
 from aoiportal import cms_bridge
-from aoiportal.auth_util import admin_required, hash_password
+from aoiportal.auth_util import admin_required, hash_password, invalidate_user_sessions
 from aoiportal.cmsmirror.db import Contest as CMSContest  # type: ignore
 from aoiportal.cmsmirror.db import session as cms_session  # type: ignore
 from aoiportal.const import (
@@ -59,7 +59,7 @@ from aoiportal.models import (  # type: ignore
     db,
 )
 from aoiportal.newsletter import gen_unsubscribe_link
-from aoiportal.web_utils import json_api
+from aoiportal.web_utils import json_api, stream_json_list
 
 admin_bp = Blueprint("admin", __name__)
 
@@ -100,12 +100,13 @@ def _conv_user(user: User) -> dict:
 @admin_required
 @json_api()
 def get_users():
+    # joined loading of collections does not work with yield_per
     q = (
         db.session.query(User)
         .order_by(User.created_at.asc())
-        .options(joinedload(User.groups))
+        .options(selectinload(User.groups))
     )
-    return [_conv_user(u) for u in q]
+    return stream_json_list(q, _conv_user)
 
 
 @admin_bp.route("/api/admin/users/<int:user_id>")
@@ -195,6 +196,7 @@ def delete_user(user_id: int):
         raise AOINotFound("User not found")
     db.session.delete(u)
     db.session.commit()
+    invalidate_user_sessions(user_id)
     return {"success": True}
 
 
@@ -267,6 +269,8 @@ def update_user(data, user_id: int):
         u.cms_username = data[KEY_CMS_USERNAME]
 
     db.session.commit()
+    if KEY_IS_ADMIN in data or KEY_CMS_ID in data or KEY_CMS_USERNAME in data:
+        invalidate_user_sessions(user_id)
     return {"success": True}
 
 
@@ -875,13 +879,13 @@ def send_user_email(data):
 @admin_required
 @json_api()
 def get_newsletter_subscribers():
-    return [
-        {
+    return stream_json_list(
+        db.session.query(NewsletterSubscription),
+        lambda sub: {
             "email": sub.email,
             "created_at": sub.created_at,
-        }
-        for sub in db.session.query(NewsletterSubscription)
-    ]
+        },
+    )
 
 
 @admin_bp.route("/api/admin/newsletter/<email>/delete", methods=["DELETE"])
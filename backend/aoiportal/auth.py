@@ -9,9 +9,11 @@ import voluptuous as vol  # type: ignore
 from flask import Blueprint, render_template
 from sqlalchemy.exc import IntegrityError  # type: ignore
 
+from aoiportal import ratelimit
 from aoiportal.auth_util import (
     check_password,
     create_session,
+    get_current_auth_user,
     get_current_session,
     get_current_user,
     get_proxy_contest,
@@ -75,7 +77,7 @@ SET_PASSWORD_SCHEMA = vol.All(str, vol.Length(min=8))
 def login(data):
     if has_proxy_header():
         raise AOIForbidden("Login is disabled in proxy auth mode")
-    if get_current_user() is not None:
+    if get_current_auth_user() is not None:
         raise AOIConflict("Already logged in", error_code=ERROR_ALREADY_LOGGED_IN)
 
     user: Optional[User] = User.query.filter_by(email=data[KEY_EMAIL]).first()
@@ -197,13 +199,14 @@ def register(data):
         )
 
     now = utcnow()
+    limit = ratelimit.get_limit(ratelimit.LIMIT_REGISTER)
     recent_req_count = (
         db.session.query(UserRegisterRequest)
         .filter(UserRegisterRequest.email == data[KEY_EMAIL])
-        .filter(UserRegisterRequest.created_at > now - timedelta(hours=12))
+        .filter(UserRegisterRequest.created_at > now - timedelta(seconds=limit.period))
         .count()
     )
-    if recent_req_count >= 3:
+    if recent_req_count >= limit.limit:
         raise AOITooManyRequests("Register rate limited.", error_code=ERROR_RATE_LIMIT)
 
     verification_code = "".join(secrets.choice("0123456789") for i in range(6))
@@ -317,19 +320,21 @@ def request_password_reset(data):
         )
 
     now = utcnow()
+    limit = ratelimit.get_limit(ratelimit.LIMIT_PASSWORD_RESET)
     recent_req_count = (
         db.session.query(UserPasswordResetRequest)
         .filter(UserPasswordResetRequest.user == user)
-        .filter(UserPasswordResetRequest.created_at > now - timedelta(hours=12))
+        .filter(
+            UserPasswordResetRequest.created_at > now - timedelta(seconds=limit.period)
+        )
         .count()
     )
-    if recent_req_count >= 3:
+    if recent_req_count >= limit.limit:
         raise AOITooManyRequests(
             "Password reset rate limited.", error_code=ERROR_RATE_LIMIT
         )
 
     verification_code = "".join(secrets.choice("0123456789") for i in range(6))
-    now = utcnow()
     password_request = UserPasswordResetRequest(
         uuid=str(uuid4()),
         user=user,
@@ -423,13 +428,16 @@ def change_email(data):
         )
 
     now = utcnow()
+    limit = ratelimit.get_limit(ratelimit.LIMIT_EMAIL_CHANGE)
     recent_req_count = (
         db.session.query(UserEmailChangeRequest)
         .filter(UserEmailChangeRequest.user == current_user)
-        .filter(UserEmailChangeRequest.created_at > now - timedelta(hours=12))
+        .filter(
+            UserEmailChangeRequest.created_at > now - timedelta(seconds=limit.period)
+        )
         .count()
     )
-    if recent_req_count >= 3:
+    if recent_req_count >= limit.limit:
         raise AOIBadRequest("Password reset rate limited.", error_code=ERROR_RATE_LIMIT)
 
     verification_code = "".join(secrets.choice("0123456789") for i in range(6))
@@ -1,30 +1,40 @@
 import base64
+import collections
 import functools
+import hashlib
 import logging
 import secrets
-from datetime import timedelta
-from typing import Optional, Tuple
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Set, Tuple, Union
 
 import bcrypt
 import jwt
 import nacl.exceptions
 import nacl.secret
 from flask import current_app, g, request
+from sqlalchemy import lambda_stmt, select  # type: ignore
 from sqlalchemy.orm import joinedload  # type: ignore
 
+from aoiportal import timing
 from aoiportal.error import (
     ERROR_ADMIN_REQUIRED,
     ERROR_LOGIN_REQUIRED,
     AOIForbidden,
     AOIUnauthorized,
 )
+from aoiportal.metrics import record_cache, register_cache
 from aoiportal.models import Contest, Participation, User, UserSession, db  # type: ignore
 from aoiportal.utils import as_utc, utcnow
 
 _G_CURRENT_SESSION_KEY = "_aoi_auth_current_session"
+_G_CURRENT_AUTH_KEY = "_aoi_auth_current_auth"
 _G_PROXY_AUTH_KEY = "_aoi_proxy_auth"
 _G_PROXY_AUTH_ERROR_KEY = "_aoi_proxy_auth_error"
 _G_PROXY_USER_KEY = "_aoi_proxy_user"
+_G_PROXY_AUTH_USER_KEY = "_aoi_proxy_auth_user"
 _G_PROXY_CONTEST_KEY = "_aoi_proxy_contest"
 
 _logger = logging.getLogger(__name__)
@@ -67,38 +77,246 @@ def token_get_private_part(public: str) -> Optional[str]:
         return None
 
 
-def _load_session() -> Optional[UserSession]:
+@dataclass(frozen=True)
+class AuthUser:
+    """Detached, read-only view of the logged in user.
+
+    Enough for access checks and id lookups without touching the portal DB;
+    use get_current_user() for everything else.
+    """
+
+    id: int
+    is_admin: bool
+    cms_id: Optional[int]
+
+    @classmethod
+    def from_user(cls, user: User) -> "AuthUser":
+        return cls(id=user.id, is_admin=user.is_admin, cms_id=user.cms_id)
+
+
+@dataclass(frozen=True)
+class ProxyContest:
+    """Detached view of the contest a proxy auth token is bound to."""
+
+    id: int
+    uuid: str
+    name: str
+    cms_name: str
+
+    @classmethod
+    def from_contest(cls, contest: Contest) -> "ProxyContest":
+        return cls(
+            id=contest.id,
+            uuid=contest.uuid,
+            name=contest.name,
+            cms_name=contest.cms_name,
+        )
+
+
+@dataclass(frozen=True)
+class _CachedSession:
+    session_id: int
+    user: AuthUser
+    created_at: datetime
+    valid_until: datetime
+    # time.monotonic() deadline
+    expires: float
+
+
+@dataclass(frozen=True)
+class _CachedProxyAuth:
+    user: AuthUser
+    contest: ProxyContest
+    expires: float
+
+
+_CachedAuth = Union[_CachedSession, _CachedProxyAuth]
+
+
+class AuthCache:
+    """Bounded LRU cache of resolved auth tokens.
+
+    Invalidation only reaches the cache of the current worker process, so
+    the expiry of the entries also bounds how long a revoked token keeps
+    working in other workers.
+    """
+
+    def __init__(self, name: str, max_size: int = 4096) -> None:
+        self.name = name
+        self.max_size = max_size
+        self._entries: "collections.OrderedDict[str, _CachedAuth]" = (
+            collections.OrderedDict()
+        )
+        self._by_session: Dict[int, Set[str]] = collections.defaultdict(set)
+        self._by_user: Dict[int, Set[str]] = collections.defaultdict(set)
+        self._lock = threading.Lock()
+        register_cache(name, self)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[_CachedAuth]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                record_cache(self.name, False)
+                return None
+            if time.monotonic() > entry.expires:
+                self._remove(key)
+                record_cache(self.name, False)
+                return None
+            self._entries.move_to_end(key)
+            record_cache(self.name, True)
+            return entry
+
+    def put(self, key: str, entry: _CachedAuth) -> None:
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            while len(self._entries) >= self.max_size:
+                self._remove(next(iter(self._entries)))
+            self._entries[key] = entry
+            if isinstance(entry, _CachedSession):
+                self._by_session[entry.session_id].add(key)
+            self._by_user[entry.user.id].add(key)
+
+    def invalidate_session(self, session_id: int) -> None:
+        with self._lock:
+            for key in list(self._by_session.get(session_id, ())):
+                self._remove(key)
+
+    def invalidate_user(self, user_id: int) -> None:
+        with self._lock:
+            for key in list(self._by_user.get(user_id, ())):
+                self._remove(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._by_session.clear()
+            self._by_user.clear()
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key)
+        indexes = [(self._by_user, entry.user.id)]
+        if isinstance(entry, _CachedSession):
+            indexes.append((self._by_session, entry.session_id))
+        for index, index_key in indexes:
+            keys = index[index_key]
+            keys.discard(key)
+            if not keys:
+                del index[index_key]
+
+
+# Session tokens are cached for a short time only, since they can be revoked
+# at any time. Proxy auth tokens are cached until they expire (but for at
+# most PROXY_AUTH_CACHE_MAX_TTL, so that admin edits become visible).
+SESSION_CACHE_TTL = 30
+PROXY_AUTH_CACHE_MAX_TTL = 10 * 60
+SESSION_CACHE = AuthCache("session")
+PROXY_AUTH_CACHE = AuthCache("proxy_auth")
+
+
+def _get_bearer_token() -> Optional[str]:
     auth_header = request.headers.get("Authorization")
     if auth_header is None:
         return None
     parts = auth_header.split(" ", 1)
     if len(parts) != 2 or parts[0].lower() != "bearer":
         return None
-    plaintext = token_get_private_part(parts[1])
+    return parts[1]
+
+
+def _token_cache_key(token: str) -> str:
+    # don't keep the bearer tokens themselves in memory
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def _is_in_validity_window(created_at: datetime, valid_until: datetime) -> bool:
+    now = utcnow()
+    return as_utc(created_at) <= now <= as_utc(valid_until)
+
+
+def session_by_token_stmt(plaintext: str):
+    # a lambda statement is built and cache-keyed once, later calls only
+    # bind the new token (see bench_statements.py)
+    return lambda_stmt(
+        lambda: select(UserSession)
+        .where(UserSession.token == plaintext)
+        .options(joinedload(UserSession.user))
+        .limit(1)
+    )
+
+
+def _query_session(token: str) -> Optional[UserSession]:
+    plaintext = token_get_private_part(token)
     if plaintext is None:
         return None
 
     sess: Optional[UserSession] = (
-        db.session.query(UserSession)
-        .filter(UserSession.token == plaintext)
-        .options(joinedload(UserSession.user))
-        .first()
+        db.session.execute(session_by_token_stmt(plaintext)).scalars().first()
     )
     if sess is None:
         return None
+    if not _is_in_validity_window(sess.created_at, sess.valid_until):
+        return None
+    return sess
 
-    now = utcnow()
-    if now < as_utc(sess.created_at):
+
+def _load_auth() -> Optional[_CachedSession]:
+    token = _get_bearer_token()
+    if token is None:
         return None
-    if now > as_utc(sess.valid_until):
+    key = _token_cache_key(token)
+    entry = SESSION_CACHE.get(key)
+    if isinstance(entry, _CachedSession):
+        if not _is_in_validity_window(entry.created_at, entry.valid_until):
+            return None
+        return entry
+
+    sess = _query_session(token)
+    if sess is None:
         return None
+    # The full session was loaded anyway, keep it for get_current_session()
+    setattr(g, _G_CURRENT_SESSION_KEY, sess)
+    entry = _CachedSession(
+        session_id=sess.id,
+        user=AuthUser.from_user(sess.user),
+        created_at=sess.created_at,
+        valid_until=sess.valid_until,
+        expires=time.monotonic() + SESSION_CACHE_TTL,
+    )
+    SESSION_CACHE.put(key, entry)
+    return entry
 
-    return sess
+
+def _get_current_auth() -> Optional[_CachedSession]:
+    if _G_CURRENT_AUTH_KEY not in g:
+        with timing.phase(timing.PHASE_AUTH):
+            setattr(g, _G_CURRENT_AUTH_KEY, _load_auth())
+    return getattr(g, _G_CURRENT_AUTH_KEY)
 
 
 def get_current_session() -> Optional[UserSession]:
     if _G_CURRENT_SESSION_KEY not in g:
-        setattr(g, _G_CURRENT_SESSION_KEY, _load_session())
+        # on a cache miss this already stores the loaded session in g
+        auth = _get_current_auth()
+        if _G_CURRENT_SESSION_KEY not in g:
+            sess = None
+            if auth is not None:
+                sess = (
+                    db.session.query(UserSession)
+                    .filter(UserSession.id == auth.session_id)
+                    .options(joinedload(UserSession.user))
+                    .first()
+                )
+                if sess is None:
+                    # revoked in another worker after it was cached here
+                    SESSION_CACHE.invalidate_session(auth.session_id)
+                    raise AOIUnauthorized(
+                        "Need to log in first", error_code=ERROR_LOGIN_REQUIRED
+                    )
+            setattr(g, _G_CURRENT_SESSION_KEY, sess)
 
     return getattr(g, _G_CURRENT_SESSION_KEY)
 
@@ -125,13 +343,29 @@ def _load_proxy_auth() -> None:
 
     setattr(g, _G_PROXY_AUTH_KEY, False)
     setattr(g, _G_PROXY_AUTH_ERROR_KEY, False)
-    setattr(g, _G_PROXY_USER_KEY, None)
+    setattr(g, _G_PROXY_AUTH_USER_KEY, None)
     setattr(g, _G_PROXY_CONTEST_KEY, None)
 
     token_str = _get_proxy_auth_header()
     if token_str is None:
         return
 
+    with timing.phase(timing.PHASE_AUTH):
+        key = _token_cache_key(token_str)
+        entry = PROXY_AUTH_CACHE.get(key)
+        if not isinstance(entry, _CachedProxyAuth):
+            entry = _verify_proxy_auth(token_str)
+            if entry is None:
+                setattr(g, _G_PROXY_AUTH_ERROR_KEY, True)
+                return
+            PROXY_AUTH_CACHE.put(key, entry)
+
+    setattr(g, _G_PROXY_AUTH_KEY, True)
+    setattr(g, _G_PROXY_AUTH_USER_KEY, entry.user)
+    setattr(g, _G_PROXY_CONTEST_KEY, entry.contest)
+
+
+def _verify_proxy_auth(token_str: str) -> Optional[_CachedProxyAuth]:
     public_key_pem = current_app.config["PROXY_AUTH_JWT_PUBLIC_KEY"]
 
     try:
@@ -144,27 +378,23 @@ def _load_proxy_auth() -> None:
         )
     except jwt.PyJWTError as e:
         _logger.warning("Proxy auth JWT validation failed: %s", e)
-        setattr(g, _G_PROXY_AUTH_ERROR_KEY, True)
-        return
+        return None
 
     cms_username = payload.get("sub")
     cms_name = payload.get("contest")
     if not cms_username or not cms_name:
         _logger.warning("Proxy auth JWT missing sub or contest claim")
-        setattr(g, _G_PROXY_AUTH_ERROR_KEY, True)
-        return
+        return None
 
     user: Optional[User] = User.query.filter_by(cms_username=cms_username).first()
     if user is None:
         _logger.warning("Proxy auth: user with cms_username=%r not found", cms_username)
-        setattr(g, _G_PROXY_AUTH_ERROR_KEY, True)
-        return
+        return None
 
     contest: Optional[Contest] = Contest.query.filter_by(cms_name=cms_name).first()
     if contest is None or contest.deleted:
         _logger.warning("Proxy auth: contest with cms_name=%r not found", cms_name)
-        setattr(g, _G_PROXY_AUTH_ERROR_KEY, True)
-        return
+        return None
 
     # Auto-join: create participation if missing
     part: Optional[Participation] = (
@@ -177,9 +407,14 @@ def _load_proxy_auth() -> None:
         from aoiportal.helpers import create_participation
         create_participation(user, contest)
 
-    setattr(g, _G_PROXY_AUTH_KEY, True)
+    # The user was loaded anyway, keep it for get_current_user()
     setattr(g, _G_PROXY_USER_KEY, user)
-    setattr(g, _G_PROXY_CONTEST_KEY, contest)
+    ttl = min(payload["exp"] - time.time(), PROXY_AUTH_CACHE_MAX_TTL)
+    return _CachedProxyAuth(
+        user=AuthUser.from_user(user),
+        contest=ProxyContest.from_contest(contest),
+        expires=time.monotonic() + ttl,
+    )
 
 
 def is_proxy_auth() -> bool:
@@ -192,7 +427,7 @@ def has_proxy_auth_error() -> bool:
     return getattr(g, _G_PROXY_AUTH_ERROR_KEY, False)
 
 
-def get_proxy_contest() -> Optional[Contest]:
+def get_proxy_contest() -> Optional[ProxyContest]:
     _load_proxy_auth()
     return getattr(g, _G_PROXY_CONTEST_KEY, None)
 
@@ -200,7 +435,10 @@ def get_proxy_contest() -> Optional[Contest]:
 def get_current_user() -> Optional[User]:
     # Proxy auth takes full precedence over session auth
     if is_proxy_auth():
-        return getattr(g, _G_PROXY_USER_KEY, None)
+        if _G_PROXY_USER_KEY not in g:
+            auth_user: AuthUser = getattr(g, _G_PROXY_AUTH_USER_KEY)
+            setattr(g, _G_PROXY_USER_KEY, db.session.get(User, auth_user.id))
+        return getattr(g, _G_PROXY_USER_KEY)
     if has_proxy_auth_error():
         return None
     sess = get_current_session()
@@ -209,6 +447,18 @@ def get_current_user() -> Optional[User]:
     return sess.user
 
 
+def get_current_auth_user() -> Optional[AuthUser]:
+    """Like get_current_user(), but served from the session cache."""
+    if is_proxy_auth():
+        return getattr(g, _G_PROXY_AUTH_USER_KEY)
+    if has_proxy_auth_error():
+        return None
+    auth = _get_current_auth()
+    if auth is None:
+        return None
+    return auth.user
+
+
 def create_session(user: User) -> Tuple[UserSession, str]:
     public, private = gen_token_public_private()
     now = utcnow()
@@ -223,15 +473,24 @@ def create_session(user: User) -> Tuple[UserSession, str]:
     return (sess, public)
 
 
-def invalidate_session(session: Optional[UserSession] = None):
+def invalidate_session(session: UserSession):
+    session_id = session.id
     db.session.delete(session)
     db.session.commit()
+    SESSION_CACHE.invalidate_session(session_id)
+
+
+def invalidate_user_sessions(user_id: int):
+    """Drop cached sessions of a user after it was deleted or its access
+    rights changed."""
+    SESSION_CACHE.invalidate_user(user_id)
+    PROXY_AUTH_CACHE.invalidate_user(user_id)
 
 
 def login_required(fn):
     @functools.wraps(fn)
     def decorated(*args, **kwargs):
-        if request.method != "OPTIONS" and get_current_user() is None:
+        if request.method != "OPTIONS" and get_current_auth_user() is None:
             raise AOIUnauthorized(
                 "Need to log in first",
                 error_code=ERROR_LOGIN_REQUIRED,
@@ -245,7 +504,7 @@ def admin_required(fn):
     @login_required
     @functools.wraps(fn)
     def wrapped(*args, **kwargs):
-        if not get_current_user().is_admin:
+        if not get_current_auth_user().is_admin:
             raise AOIForbidden(
                 "This API needs admin access.", error_code=ERROR_ADMIN_REQUIRED
             )
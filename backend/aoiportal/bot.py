@@ -5,7 +5,7 @@ from typing import Optional
 import voluptuous as vol  # type: ignore
 from flask import Blueprint, current_app
 
-from aoiportal.auth_util import get_current_user
+from aoiportal.auth_util import get_current_auth_user
 from aoiportal.const import KEY_SECRET
 from aoiportal.error import AOIConflict, AOIUnauthorized
 from aoiportal.models import Group, UserDiscordOAuth  # type: ignore
@@ -21,7 +21,7 @@ bot_bp = Blueprint("bot", __name__)
     }
 )
 def getData(data):
-    if get_current_user() is not None:
+    if get_current_auth_user() is not None:
         raise AOIConflict("This is for bots. Are you a bot?")
 
     if data[KEY_SECRET] != current_app.config["DISCORD_BOT_SECRET"]:
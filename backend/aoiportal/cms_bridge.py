@@ -9,6 +9,7 @@ from aoiportal.cmsmirror.db import Contest as CMSContest  # type: ignore
 from aoiportal.cmsmirror.db import Participation as CMSParticipation  # type: ignore
 from aoiportal.cmsmirror.db import User as CMSUser  # type: ignore
 from aoiportal.cmsmirror.db import session as cms_session
+from aoiportal.cmsmirror.identity import invalidate_identity_cache
 
 
 @dataclass
@@ -65,6 +66,7 @@ def update_contest(
     contest.sso_secret_key = sso_secret_key
     contest.sso_redirect_url = sso_redirect_url
     cms_session.commit()  # type: ignore
+    invalidate_identity_cache()
 
 
 def set_participation_password(
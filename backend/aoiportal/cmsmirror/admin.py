@@ -1,8 +1,9 @@
-from typing import List, Optional, Tuple
+from typing import Dict, Iterable, List, Optional, Tuple
 
 import voluptuous as vol  # type: ignore
-from flask import Blueprint, g, jsonify, request, send_file
-from sqlalchemy.orm import Load, joinedload, selectinload  # type: ignore
+from flask import Blueprint, g, jsonify, request
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload, selectinload  # type: ignore
 from werkzeug.local import LocalProxy
 
 from aoiportal.auth_util import admin_required
@@ -13,9 +14,11 @@ from aoiportal.cmsmirror.db import (  # type: ignore
     Dataset,
     Participation,
     Task,
+    Testcase,
     User,
     UserEval,
     UserEvalResult,
+    replica_read,
     session,
 )
 from aoiportal.cmsmirror.db.contest import Announcement  # type: ignore
@@ -25,11 +28,12 @@ from aoiportal.cmsmirror.db.submission import (  # type: ignore
     SubmissionResult,
 )
 from aoiportal.cmsmirror.db.user import Message, Question  # type: ignore
-from aoiportal.cmsmirror.util import open_digest, paginate
+from aoiportal.cmsmirror.identity import invalidate_identity_cache
+from aoiportal.cmsmirror.util import paginate_keyset, send_digest
 from aoiportal.error import AOIBadRequest, AOINotFound
 from aoiportal.models import Contest as PortalContest, db  # type: ignore
 from aoiportal.utils import as_utc
-from aoiportal.web_utils import json_api
+from aoiportal.web_utils import json_api, stream_json_list
 
 cmsadmin_bp = Blueprint("cmsadmin", __name__)
 
@@ -209,12 +213,46 @@ def get_contest_messages(contest_id: int):
     return [_dump_message(msg) for msg in messages]
 
 
+def _max_score(score_type: str, score_type_parameters, num_testcases: int) -> float:
+    if score_type == "Sum":
+        return score_type_parameters * num_testcases
+    return sum(p for p, _ in score_type_parameters)
+
+
+def dataset_max_scores(dataset_ids: Iterable[int]) -> Dict[int, float]:
+    """Max score of several datasets, without loading their testcases."""
+    dataset_ids = set(dataset_ids)
+    if not dataset_ids:
+        return {}
+    rows = (
+        session.query(  # type: ignore
+            Dataset.id,
+            Dataset.score_type,
+            Dataset.score_type_parameters,
+            func.count(Testcase.id),
+        )
+        .outerjoin(Dataset.testcases)
+        .filter(Dataset.id.in_(dataset_ids))
+        .group_by(Dataset.id)
+    )
+    return {
+        id_: _max_score(score_type, params, num_testcases)
+        for id_, score_type, params, num_testcases in rows
+    }
+
+
 def dump_submission(
     sub: Submission,
     res: Optional[SubmissionResult],
     *,
     detailed: bool = False,
+    max_scores: Optional[Dict[int, float]] = None,
 ):
+    """Dump a single submission for the admin views.
+
+    Lists use _dump_submission_row, which produces the same output as
+    detailed=False from plain column tuples.
+    """
     base = {
         "id": sub.id,
         "uuid": sub.uuid,
@@ -235,12 +273,9 @@ def dump_submission(
         status = res.get_status()
         meme_digest = res.meme.digest if res.meme is not None else None
 
-        ds = res.dataset
-        if ds.score_type == "Sum":
-            max_score = ds.score_type_parameters * len(ds.testcases)
-        else:
-            max_score = sum(p for p, _ in ds.score_type_parameters)
-        base["max_score"] = max_score
+        if max_scores is None:
+            max_scores = dataset_max_scores([res.dataset_id])
+        base["max_score"] = max_scores[res.dataset_id]
     res_dct = base["result"] = {
         "status": {
             SubmissionResult.COMPILING: "compiling",
@@ -455,13 +490,149 @@ def dump_user_eval(
     return base
 
 
+def _dump_participation_row(
+    part_id: int,
+    hidden: bool,
+    user_id: int,
+    first_name: str,
+    last_name: str,
+    username: str,
+):
+    # Same as _dump_participation_short
+    return {
+        "id": part_id,
+        "user": {
+            "id": user_id,
+            "first_name": first_name,
+            "last_name": last_name,
+            "username": username,
+        },
+        "hidden": hidden,
+    }
+
+
+# Columns of the list endpoints, selected as plain tuples instead of
+# hydrating ORM objects
+_PARTICIPATION_ROW_COLUMNS = (
+    Participation.id,
+    Participation.hidden,
+    User.id,
+    User.first_name,
+    User.last_name,
+    User.username,
+)
+_CONTEST_ROW_COLUMNS = (Contest.id, Contest.name, Contest.description)
+_TASK_ROW_COLUMNS = (Task.id, Task.name, Task.title)
+_SUBMISSION_ROW_COLUMNS = (
+    Submission.id,
+    Submission.uuid,
+    Submission.timestamp,
+    Submission.language,
+    Submission.official,
+    Submission.comment,
+    *_PARTICIPATION_ROW_COLUMNS,
+    *_CONTEST_ROW_COLUMNS,
+    *_TASK_ROW_COLUMNS,
+    Task.score_precision,
+    SubmissionResult.dataset_id,
+    SubmissionResult.compilation_outcome,
+    SubmissionResult.evaluation_outcome,
+    SubmissionResult.score,
+    SubmissionResult.score_details,
+    Meme.digest,
+)
+
+
+def _dump_submission_row(row, max_scores: Dict[int, float]):
+    """Same as dump_submission(detailed=False) for a _SUBMISSION_ROW_COLUMNS row."""
+    (
+        sub_id,
+        uuid,
+        timestamp,
+        language,
+        official,
+        comment,
+        part_id,
+        hidden,
+        user_id,
+        first_name,
+        last_name,
+        username,
+        contest_id,
+        contest_name,
+        contest_description,
+        task_id,
+        task_name,
+        task_title,
+        score_precision,
+        dataset_id,
+        compilation_outcome,
+        evaluation_outcome,
+        score,
+        score_details,
+        meme_digest,
+    ) = row
+    base = {
+        "id": sub_id,
+        "uuid": uuid,
+        "timestamp": as_utc(timestamp).isoformat(),
+        "language": language,
+        "official": official,
+        "comment": comment,
+        "participation": _dump_participation_row(
+            part_id, hidden, user_id, first_name, last_name, username
+        ),
+        "contest": {
+            "id": contest_id,
+            "name": contest_name,
+            "description": contest_description,
+        },
+        "task": {
+            "id": task_id,
+            "name": task_name,
+            "title": task_title,
+        },
+    }
+    # Same as SubmissionResult.get_status, compilation_outcome is NULL
+    # if there is no result yet
+    if compilation_outcome is None:
+        status = "compiling"
+    elif compilation_outcome == "fail":
+        status = "compilation_failed"
+    elif evaluation_outcome is None:
+        status = "evaluating"
+    elif score is None:
+        status = "scoring"
+    else:
+        status = "scored"
+    if dataset_id is not None:
+        base["max_score"] = max_scores[dataset_id]
+    res_dct = base["result"] = {
+        "status": status,
+        "meme_digest": meme_digest,
+    }
+    if status == "scored":
+        res_dct["score"] = score
+        res_dct["score_precision"] = score_precision
+        if score_details and "max_score" in score_details[0]:
+            res_dct["subtasks"] = [
+                {
+                    "max_score": st["max_score"],
+                    "fraction": st["score_fraction"],
+                }
+                for st in score_details
+            ]
+    return base
+
+
 def _get_submissions(
     contest_id: Optional[int] = None,
     task_id: Optional[int] = None,
     user_id: Optional[int] = None,
 ):
     q = (
-        session.query(Submission, SubmissionResult, Participation, Meme, Task, Dataset, Contest, User)  # type: ignore
+        session.query(*_SUBMISSION_ROW_COLUMNS)  # type: ignore
+        .select_from(Submission)
         .join(Submission.task)
         .join(Submission.participation)
         .outerjoin(
@@ -470,97 +641,49 @@ def _get_submissions(
             )
         )
         .outerjoin(SubmissionResult.meme)
-        .join(Task.active_dataset)
         .join(Participation.user)
         .join(Participation.contest)
-        .options(
-            Load(Submission).load_only(
-                Submission.id,
-                Submission.uuid,
-                Submission.timestamp,
-                Submission.language,
-                Submission.official,
-            ),
-            Load(SubmissionResult).load_only(
-                SubmissionResult.submission_id,
-                SubmissionResult.dataset_id,
-                SubmissionResult.compilation_outcome,
-                SubmissionResult.score,
-                SubmissionResult.score_details,
-                SubmissionResult.compilation_outcome,
-                SubmissionResult.evaluation_outcome,
-            ),
-            joinedload(SubmissionResult.meme),
-            Load(Meme).load_only(
-                Meme.id,
-                Meme.filename,
-                Meme.digest,
-            ),
-            selectinload(Submission.task),
-            Load(Task).load_only(
-                Task.id,
-                Task.name,
-                Task.title,
-                Task.score_precision,
-                Task.score_mode,
-            ),
-            selectinload(SubmissionResult.dataset),
-            Load(Dataset).load_only(Dataset.score_type_parameters),
-            Load(Participation).load_only(
-                Participation.id,
-                Participation.user_id,
-            ),
-            selectinload(Participation.contest),
-            Load(Contest).load_only(
-                Contest.id,
-                Contest.name,
-            ),
-            joinedload(Participation.user),
-            Load(User).load_only(
-                User.id,
-                User.first_name,
-                User.last_name,
-                User.username,
-            ),
-        )
-        .order_by(Submission.timestamp.desc())
+        .filter(Task.active_dataset_id.isnot(None))
+    )
+    # Same rows as q: results and memes are outer joined at most once per
+    # submission, users and contests are required
+    count_q = (
+        session.query(func.count(Submission.id))  # type: ignore
+        .join(Submission.task)
+        .join(Submission.participation)
+        .filter(Task.active_dataset_id.isnot(None))
     )
 
+    filters = []
     if contest_id is not None:
-        q = q.filter(Task.contest_id == contest_id)
+        filters.append(Task.contest_id == contest_id)
 
     if task_id is not None:
-        q = q.filter(Task.id == task_id)
+        filters.append(Task.id == task_id)
 
     if user_id is not None:
-        q = q.filter(Participation.user_id == user_id)
-
-    page = paginate(q)
-    submissions: List[
-        Tuple[
-            Submission,
-            Optional[SubmissionResult],
-            Participation,
-            Optional[Meme],
-            Task,
-            Dataset,
-            Contest,
-            User,
-        ]
-    ] = page.items
+        filters.append(Participation.user_id == user_id)
+
+    page = paginate_keyset(
+        q.filter(*filters),
+        timestamp_col=Submission.timestamp,
+        id_col=Submission.id,
+        row_key=lambda row: (row.timestamp, row[0]),
+        count_query=count_q.filter(*filters),
+        count_key=("submissions", contest_id, task_id, user_id),
+    )
+    max_scores = dataset_max_scores(
+        row.dataset_id for row in page.items if row.dataset_id is not None
+    )
 
     return {
         "page": page.page,
         "per_page": page.per_page,
         "total": page.total,
-        "items": [
-            dump_submission(
-                sub,
-                res,
-                detailed=False,
-            )
-            for sub, res, _, _, _, _, _, _ in submissions
-        ],
+        "first_cursor": page.first_cursor,
+        "last_cursor": page.last_cursor,
+        "has_more": page.has_more,
+        "items": [_dump_submission_row(row, max_scores) for row in page.items],
     }
 
 
@@ -667,22 +790,22 @@ def get_task(task_id: int):
 @admin_required
 @json_api()
 def get_contest_participations(contest_id: int):
-    parts: List[Participation] = (
-        session.query(Participation)  # type: ignore
+    rows = (
+        session.query(*_PARTICIPATION_ROW_COLUMNS)  # type: ignore
+        .join(Participation.user)
         .filter(Participation.contest_id == current_contest.id)
         .order_by(Participation.id.asc())
-        .options(joinedload(Participation.user))
-        .all()
     )
-    return [_dump_participation_short(part) for part in parts]
+    return [_dump_participation_row(*row) for row in rows]
 
 
 @cmsadmin_bp.route("/api/cms/admin/contest/<int:contest_id>/ranking")
 @admin_required
 @json_api()
+@replica_read
 def get_contest_ranking(contest_id: int):
     contest_data = scores.get_contest_scores(current_contest.id)
-    return {
+    data = {
         "tasks": [
             {
                 "id": tid,
@@ -714,6 +837,10 @@ def get_contest_ranking(contest_id: int):
             for pid, part in contest_data.results.items()
         ],
     }
+    # The ETag lets clients revalidate and the compressed body be cached
+    resp = jsonify(data)
+    resp.add_etag()
+    return resp.make_conditional(request)
 
 
 @cmsadmin_bp.route("/api/cms/admin/participation/<int:participation_id>")
@@ -751,6 +878,7 @@ def update_participation(data, participation_id: int):
     if KEY_HIDDEN in data:
         part.hidden = data[KEY_HIDDEN]
     session.commit()  # type: ignore
+    invalidate_identity_cache()
     return {"success": True}
 
 
@@ -828,6 +956,7 @@ def get_participation_messages(participation_id: int):
 @cmsadmin_bp.route("/api/cms/admin/submissions")
 @admin_required
 @json_api()
+@replica_read
 def get_all_submissions():
     contest_id = None
     if "contest_id" in request.args:
@@ -869,9 +998,128 @@ def get_all_submissions():
     return resp.make_conditional(request)
 
 
+_USER_EVAL_ROW_COLUMNS = (
+    UserEval.id,
+    UserEval.uuid,
+    UserEval.timestamp,
+    UserEval.language,
+    *_PARTICIPATION_ROW_COLUMNS,
+    *_CONTEST_ROW_COLUMNS,
+    *_TASK_ROW_COLUMNS,
+    UserEvalResult.compilation_outcome,
+    UserEvalResult.evaluation_outcome,
+)
+
+
+def _dump_user_eval_row(row):
+    """Same as dump_user_eval(detailed=False) for a _USER_EVAL_ROW_COLUMNS row."""
+    (
+        eval_id,
+        uuid,
+        timestamp,
+        language,
+        part_id,
+        hidden,
+        user_id,
+        first_name,
+        last_name,
+        username,
+        contest_id,
+        contest_name,
+        contest_description,
+        task_id,
+        task_name,
+        task_title,
+        compilation_outcome,
+        evaluation_outcome,
+    ) = row
+    # Same as UserEvalResult.get_status
+    if compilation_outcome is None:
+        status = "compiling"
+    elif compilation_outcome == "fail":
+        status = "compilation_failed"
+    elif evaluation_outcome is None:
+        status = "evaluating"
+    else:
+        status = "evaluated"
+    return {
+        "id": eval_id,
+        "uuid": uuid,
+        "timestamp": as_utc(timestamp).isoformat(),
+        "language": language,
+        "participation": _dump_participation_row(
+            part_id, hidden, user_id, first_name, last_name, username
+        ),
+        "contest": {
+            "id": contest_id,
+            "name": contest_name,
+            "description": contest_description,
+        },
+        "task": {
+            "id": task_id,
+            "name": task_name,
+            "title": task_title,
+        },
+        "result": {"status": status},
+    }
+
+
+def _get_user_evals(
+    contest_id: Optional[int] = None,
+    task_id: Optional[int] = None,
+    user_id: Optional[int] = None,
+):
+    q = (
+        session.query(*_USER_EVAL_ROW_COLUMNS)  # type: ignore
+        .select_from(UserEval)
+        .join(UserEval.task)
+        .join(UserEval.participation)
+        .join(Participation.contest)
+        .join(Participation.user)
+        .outerjoin(
+            UserEval.results.and_(UserEvalResult.dataset_id == Task.active_dataset_id)
+        )
+    )
+    count_q = (
+        session.query(func.count(UserEval.id))  # type: ignore
+        .join(UserEval.task)
+        .join(UserEval.participation)
+    )
+
+    filters = []
+    if contest_id is not None:
+        filters.append(Task.contest_id == contest_id)
+
+    if task_id is not None:
+        filters.append(Task.id == task_id)
+
+    if user_id is not None:
+        filters.append(Participation.user_id == user_id)
+
+    page = paginate_keyset(
+        q.filter(*filters),
+        timestamp_col=UserEval.timestamp,
+        id_col=UserEval.id,
+        row_key=lambda row: (row.timestamp, row[0]),
+        count_query=count_q.filter(*filters),
+        count_key=("user_evals", contest_id, task_id, user_id),
+    )
+
+    return {
+        "page": page.page,
+        "per_page": page.per_page,
+        "total": page.total,
+        "first_cursor": page.first_cursor,
+        "last_cursor": page.last_cursor,
+        "has_more": page.has_more,
+        "items": [_dump_user_eval_row(row) for row in page.items],
+    }
+
+
 @cmsadmin_bp.route("/api/cms/admin/user-evals")
 @admin_required
 @json_api()
+@replica_read
 def get_all_user_evals():
     contest_id = None
     if "contest_id" in request.args:
@@ -903,85 +1151,12 @@ def get_all_user_evals():
         if user is None:
             raise AOINotFound("User not found")
 
-    q = (
-        session.query(UserEval, UserEvalResult, Participation, Task, Contest, User)
-        .join(UserEval.task)
-        .join(UserEval.participation)
-        .join(Participation.contest)
-        .join(Participation.user)
-        .outerjoin(
-            UserEval.results.and_(UserEvalResult.dataset_id == Task.active_dataset_id)
-        )
-        .options(
-            Load(UserEval).load_only(
-                UserEval.id,
-                UserEval.uuid,
-                UserEval.timestamp,
-                UserEval.language,
-            ),
-            Load(UserEvalResult).load_only(
-                UserEvalResult.user_eval_id,
-                UserEvalResult.dataset_id,
-                UserEvalResult.compilation_outcome,
-                UserEvalResult.compilation_outcome,
-                UserEvalResult.evaluation_outcome,
-            ),
-            selectinload(UserEval.task),
-            Load(Task).load_only(
-                Task.id,
-                Task.name,
-                Task.title,
-                Task.score_precision,
-                Task.score_mode,
-            ),
-            Load(Participation).load_only(
-                Participation.id,
-                Participation.user_id,
-            ),
-            selectinload(Participation.contest),
-            Load(Contest).load_only(
-                Contest.id,
-                Contest.name,
-            ),
-            joinedload(Participation.user),
-            Load(User).load_only(
-                User.id,
-                User.first_name,
-                User.last_name,
-                User.username,
-            ),
-        )
-        .order_by(UserEval.timestamp.desc())
+    data = _get_user_evals(
+        contest_id=contest_id,
+        task_id=task_id,
+        user_id=user_id,
     )
 
-    if contest_id is not None:
-        q = q.filter(Task.contest_id == contest_id)
-
-    if task_id is not None:
-        q = q.filter(Task.id == task_id)
-
-    if user_id is not None:
-        q = q.filter(Participation.user_id == user_id)
-
-    page = paginate(q)
-    user_evals: List[
-        Tuple[UserEval, Optional[UserEvalResult], Participation, Task, Contest, User]
-    ] = page.items
-
-    data = {
-        "page": page.page,
-        "per_page": page.per_page,
-        "total": page.total,
-        "items": [
-            dump_user_eval(
-                eva,
-                res,
-                detailed=False,
-            )
-            for eva, res, _, _, _, _ in user_evals
-        ],
-    }
-
     resp = jsonify(data)
     resp.add_etag()
     return resp.make_conditional(request)
@@ -1054,18 +1229,16 @@ def get_user_eval(user_eval_uuid):
 @admin_required
 @json_api()
 def get_digest(digest):
-    fh = open_digest(digest)
-    resp = send_file(fh, download_name="data.bin")
-    resp.headers["Cache-Control"] = "private, max-age=604800"
-    return resp
+    return send_digest(digest, download_name="data.bin")
 
 
 @cmsadmin_bp.route("/api/cms/admin/memes")
 @admin_required
 @json_api()
 def get_memes():
-    memes: List[Meme] = session.query(Meme).options(joinedload(Meme.task)).all()
-    return [_dump_meme(meme) for meme in memes]
+    return stream_json_list(
+        session.query(Meme).options(joinedload(Meme.task)), _dump_meme  # type: ignore
+    )
 
 
 @cmsadmin_bp.route("/api/cms/admin/meme/<int:meme_id>")
@@ -1087,28 +1260,49 @@ def get_meme(meme_id: int):
 @admin_required
 @json_api()
 def get_users():
-    users: List[User] = (
-        session.query(User)
-        .order_by(User.id.asc())
-        .options(selectinload(User.participations).selectinload(Participation.contest))
-        .all()
+    # Both ordered by user id, so the participations of each user can be
+    # taken from the front while streaming the users
+    participations = (
+        session.query(  # type: ignore
+            Participation.user_id, Participation.id, *_CONTEST_ROW_COLUMNS
+        )
+        .join(Participation.contest)
+        .order_by(Participation.user_id.asc(), Participation.id.asc())
+        .yield_per(500)
     )
-    return [
-        {
-            "id": user.id,
-            "first_name": user.first_name,
-            "last_name": user.last_name,
-            "username": user.username,
-            "participations": [
-                {
-                    "id": part.id,
-                    "contest": _dump_contest_short(part.contest),
-                }
-                for part in user.participations
-            ],
+    pending = iter(participations)
+    head = next(pending, None)
+
+    def dump_user(row):
+        nonlocal head
+        user_id, first_name, last_name, username = row
+        parts = []
+        while head is not None and head[0] <= user_id:
+            _, part_id, contest_id, contest_name, contest_description = head
+            if head[0] == user_id:
+                parts.append(
+                    {
+                        "id": part_id,
+                        "contest": {
+                            "id": contest_id,
+                            "name": contest_name,
+                            "description": contest_description,
+                        },
+                    }
+                )
+            head = next(pending, None)
+        return {
+            "id": user_id,
+            "first_name": first_name,
+            "last_name": last_name,
+            "username": username,
+            "participations": parts,
         }
-        for user in users
-    ]
+
+    users = session.query(  # type: ignore
+        User.id, User.first_name, User.last_name, User.username
+    ).order_by(User.id.asc())
+    return stream_json_list(users, dump_user)
 
 
 @cmsadmin_bp.route("/api/cms/admin/user/<int:user_id>")
@@ -1143,15 +1337,14 @@ def get_user(user_id: int):
 @admin_required
 @json_api()
 def get_tasks():
-    tasks: List[Task] = session.query(Task).options(joinedload(Task.contest)).all()
-    return [
-        {
+    return stream_json_list(
+        session.query(Task).options(joinedload(Task.contest)),  # type: ignore
+        lambda task: {
             "id": task.id,
             "name": task.name,
             "title": task.title,
             "contest": (
                 _dump_contest_short(task.contest) if task.contest is not None else None
             ),
-        }
-        for task in tasks
-    ]
+        },
+    )
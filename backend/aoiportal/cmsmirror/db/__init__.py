@@ -35,7 +35,7 @@ from .base import Base
 from .contest import Announcement, Contest
 from .fsobject import FSObject, LargeObject
 from .printjob import PrintJob
-from .session import custom_psycopg2_connection, init_app, session
+from .session import custom_psycopg2_connection, init_app, replica_read, session
 from .submission import (
     Evaluation,
     Executable,
@@ -83,6 +83,7 @@ __all__ = [
     # session
     "session",
     "init_app",
+    "replica_read",
     "custom_psycopg2_connection",
     # types
     "CastingArray",
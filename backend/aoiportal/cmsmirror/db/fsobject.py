@@ -31,6 +31,9 @@ from sqlalchemy.dialects.postgresql import OID
 from sqlalchemy.schema import Column
 from sqlalchemy.types import String, Unicode
 
+from aoiportal import timing
+from aoiportal.metrics import LO_READ_BYTES
+
 from .base import Base
 from .session import custom_psycopg2_connection
 
@@ -213,12 +216,14 @@ class LargeObject(io.RawIOBase):
                 "Large object hasn't been " "opened in 'read' mode."
             )
 
-        data = self._execute(
-            "SELECT loread(%(fd)s, %(len)s);",
-            {"fd": self._fd, "len": len(buf)},
-            "Couldn't write to large object.",
-        )
+        with timing.phase(timing.PHASE_LO_READ):
+            data = self._execute(
+                "SELECT loread(%(fd)s, %(len)s);",
+                {"fd": self._fd, "len": len(buf)},
+                "Couldn't write to large object.",
+            )
         buf[: len(data)] = data
+        LO_READ_BYTES.inc(amount=len(data))
         return len(data)
 
     def write(self, buf):
@@ -24,20 +24,92 @@
 Contains context managers and custom methods to create sessions to
 interact with SQLAlchemy objects.
 
+With a read replica configured (``replica`` in the ``cms`` config section),
+views decorated with `replica_read` get a session on the replica instead of
+the primary, as long as the replica lags at most ``max_lag`` seconds behind
+(checked at most once per `REPLICA_CHECK_INTERVAL` per worker). All other
+views, and the replica views of a client that committed to the primary in
+the last ``max_lag`` seconds (remembered in a cookie, so it sees its own
+submissions and questions), use the primary.
+
+The statements of read-only requests run in read-only transactions, see
+aoiportal.readonly. Both are decided per statement by `CMSSession.get_bind`,
+so after `aoiportal.readonly.writable` the request writes to the primary.
+
 """
 
 import logging
+import threading
+import time
 from dataclasses import dataclass
+from typing import Optional
 
 import psycopg2
-from flask import Flask, current_app, g
-from sqlalchemy import create_engine  # type: ignore
+from flask import Flask, Response, current_app, g, has_request_context, request
+from sqlalchemy import create_engine, event, text  # type: ignore
 from sqlalchemy.engine import Engine, make_url  # type: ignore
+from sqlalchemy.exc import SQLAlchemyError  # type: ignore
 from sqlalchemy.orm import Session, scoped_session, sessionmaker  # type: ignore
 from werkzeug.local import LocalProxy
 
+from aoiportal import readonly
+from aoiportal.metrics import CMS_SESSIONS
+
 logger = logging.getLogger(__name__)
 KEY_CMS_SESSION = "_cmsmirror_db_session"
+KEY_CMS_WROTE = "_cmsmirror_db_wrote"
+KEY_CMS_REPLICA = "_cmsmirror_db_replica"
+# Unix time until which the client reads from the primary
+PRIMARY_COOKIE = "aoi_cms_primary"
+REPLICA_CHECK_INTERVAL = 1.0
+
+_TARGET_PRIMARY = ("primary",)
+_TARGET_REPLICA = ("replica",)
+
+# 0 while the replica has replayed everything it received, it does not
+# advance while the primary is idle
+_REPLICA_LAG_QUERY = text(
+    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() "
+    "THEN 0 ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+)
+
+
+class Replica:
+    """A read replica of the CMS database and its last known lag."""
+
+    def __init__(self, engine: Engine, max_lag: float) -> None:
+        self.engine = engine
+        self.max_lag = max_lag
+        self._lock = threading.Lock()
+        self._checked = float("-inf")
+        self._usable = False
+
+    def lag(self) -> float:
+        if self.engine.dialect.name != "postgresql":
+            return 0.0
+        with self.engine.connect() as conn:
+            return float(conn.execute(_REPLICA_LAG_QUERY).scalar() or 0)
+
+    def usable(self) -> bool:
+        now = time.monotonic()
+        if now - self._checked < REPLICA_CHECK_INTERVAL:
+            return self._usable
+        with self._lock:
+            if now - self._checked < REPLICA_CHECK_INTERVAL:
+                return self._usable
+            try:
+                lag: Optional[float] = self.lag()
+            except SQLAlchemyError:
+                logger.exception("Could not query the lag of the CMS replica")
+                lag = None
+            usable = lag is not None and lag <= self.max_lag
+            if usable and not self._usable:
+                logger.info("Reading from the CMS replica (lag %s s)", lag)
+            elif not usable and self._usable:
+                logger.warning("Reading from the CMS primary (replica lag %s s)", lag)
+            self._usable = usable
+            self._checked = now
+            return usable
 
 
 @dataclass
@@ -45,17 +117,50 @@ class CMSExtData:
     engine: Engine
     session_factory: sessionmaker
     scoped_session_factory: scoped_session
+    replica: Optional[Replica] = None
+
+
+def replica_read(fn):
+    """Mark a view as read-only so it may run on the CMS read replica.
+
+    Only for views that do not write to the CMS database, decorate the view
+    function itself (below json_api)."""
+    fn.cms_replica_read = True
+    return readonly.read_only_view(fn)
+
+
+class CMSSession(Session):
+    def get_bind(self, mapper=None, **kw):
+        engine = super().get_bind(mapper, **kw)
+        if not isinstance(engine, Engine) or not has_request_context():
+            return engine
+        if _use_replica():
+            return readonly.read_only_engine(
+                current_app.extensions["cms"].replica.engine
+            )
+        return readonly.route(engine)
 
 
 def init_app(app: Flask) -> None:
     database_uri = app.config["CMS_DATABASE_URI"]
-    engine = create_engine(database_uri)  # , echo=True)
-    session_factory = sessionmaker(bind=engine)
+    options = app.config.get("CMS_ENGINE_OPTIONS", {})
+    engine = create_engine(database_uri, **options)  # , echo=True)
+    session_factory = sessionmaker(bind=engine, class_=CMSSession)
     scoped_session_factory = scoped_session(session_factory)
+    replica = None
+    if app.config.get("CMS_REPLICA_DATABASE_URI") is not None:
+        replica_engine = create_engine(
+            app.config["CMS_REPLICA_DATABASE_URI"],
+            **app.config.get("CMS_REPLICA_ENGINE_OPTIONS", {}),
+        )
+        replica = Replica(replica_engine, app.config["CMS_REPLICA_MAX_LAG"])
+        event.listen(session_factory, "after_commit", _after_primary_commit)
+        app.after_request(_set_primary_cookie)
     app.extensions["cms"] = CMSExtData(
         engine=engine,
         session_factory=session_factory,
         scoped_session_factory=scoped_session_factory,
+        replica=replica,
     )
 
     @app.teardown_appcontext
@@ -65,6 +170,50 @@ def init_app(app: Flask) -> None:
             sess.close()
 
 
+def _after_primary_commit(sess) -> None:
+    if has_request_context():
+        setattr(g, KEY_CMS_WROTE, True)
+
+
+def _set_primary_cookie(resp: Response) -> Response:
+    if g.pop(KEY_CMS_WROTE, False):
+        max_lag = current_app.config["CMS_REPLICA_MAX_LAG"]
+        resp.set_cookie(
+            PRIMARY_COOKIE,
+            str(int(time.time() + max_lag) + 1),
+            max_age=int(max_lag) + 1,
+            path="/api/cms",
+            httponly=True,
+            samesite="Strict",
+        )
+    return resp
+
+
+def _replica_allowed() -> bool:
+    if request.endpoint is None:
+        return False
+    view = current_app.view_functions.get(request.endpoint)
+    if not getattr(view, "cms_replica_read", False):
+        return False
+    try:
+        primary_until = float(request.cookies.get(PRIMARY_COOKIE, 0))
+    except ValueError:
+        primary_until = 0
+    return primary_until < time.time()
+
+
+def _use_replica() -> bool:
+    replica = current_app.extensions["cms"].replica
+    if replica is None or readonly.is_writable():
+        return False
+    use = g.get(KEY_CMS_REPLICA)
+    if use is None:
+        use = _replica_allowed() and replica.usable()
+        CMS_SESSIONS.inc(_TARGET_REPLICA if use else _TARGET_PRIMARY)
+        setattr(g, KEY_CMS_REPLICA, use)
+    return use
+
+
 def _get_session() -> Session:
     if not hasattr(g, KEY_CMS_SESSION):
         setattr(
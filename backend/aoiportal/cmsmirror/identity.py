@@ -0,0 +1,261 @@
+"""Per-worker cache of the CMS objects contestant URLs resolve to.
+
+Every contestant request resolves `contest_name` (and `task_name`) to a
+participation, contest and task. These rarely change, so the lookups are
+cached as detached, read-only snapshots for a short time. Views that need
+relationships (messages, statements, ...) load the ORM object by id.
+
+The static part of the task page (statements, attachments, limits,
+scoring) is cached per task id, active dataset id and files version (a hash
+of the statement and attachment digests) in the same way, so activating
+another dataset or replacing a statement or attachment in CMS replaces it
+as soon as the task snapshot is refreshed.
+
+The cache is per worker process. Edits made through the portal invalidate
+it explicitly, edits made directly in CMS become visible after IDENTITY_TTL
+(TASK_STATIC_TTL for the task page).
+
+The lookups on a cache miss are lambda statements, so SQLAlchemy builds and
+compiles them once per worker and only binds the new parameters afterwards.
+"""
+
+import datetime
+import hashlib
+from dataclasses import dataclass
+from typing import Callable, Optional, Tuple
+
+from sqlalchemy import lambda_stmt, select  # type: ignore
+from sqlalchemy.orm import joinedload, selectinload  # type: ignore
+
+from aoiportal.cmsmirror.db import Contest, Participation, Task, session  # type: ignore
+from aoiportal.cmsmirror.util import MaxAgeCache
+
+IDENTITY_TTL = datetime.timedelta(seconds=10)
+TASK_STATIC_TTL = datetime.timedelta(minutes=5)
+
+
+@dataclass(frozen=True)
+class ContestInfo:
+    id: int
+    name: str
+    description: str
+    start: datetime.datetime
+    stop: datetime.datetime
+    analysis_enabled: bool
+    analysis_start: datetime.datetime
+    analysis_stop: datetime.datetime
+    languages: Tuple[str, ...]
+    allow_frontendv2: bool
+    score_precision: int
+    show_global_rank: bool
+    show_points_to_next_rank: bool
+
+    @classmethod
+    def from_contest(cls, contest: Contest) -> "ContestInfo":
+        return cls(
+            id=contest.id,
+            name=contest.name,
+            description=contest.description,
+            start=contest.start,
+            stop=contest.stop,
+            analysis_enabled=contest.analysis_enabled,
+            analysis_start=contest.analysis_start,
+            analysis_stop=contest.analysis_stop,
+            languages=tuple(contest.languages),
+            allow_frontendv2=contest.allow_frontendv2,
+            score_precision=contest.score_precision,
+            show_global_rank=contest.show_global_rank,
+            show_points_to_next_rank=contest.show_points_to_next_rank,
+        )
+
+    def phase(self, timestamp: datetime.datetime) -> int:
+        # Same as Contest.phase
+        if timestamp < self.start:
+            return -1
+        if timestamp <= self.stop:
+            return 0
+        if self.analysis_enabled:
+            if timestamp < self.analysis_start:
+                return 1
+            elif timestamp <= self.analysis_stop:
+                return 2
+        return 3
+
+
+@dataclass(frozen=True)
+class ParticipationInfo:
+    id: int
+    user_id: int
+    username: str
+    extra_time: datetime.timedelta
+    unrestricted: bool
+    hidden: bool
+    contest: ContestInfo
+
+    @classmethod
+    def from_participation(cls, part: Participation) -> "ParticipationInfo":
+        return cls(
+            id=part.id,
+            user_id=part.user_id,
+            username=part.user.username,
+            extra_time=part.extra_time,
+            unrestricted=part.unrestricted,
+            hidden=part.hidden,
+            contest=ContestInfo.from_contest(part.contest),
+        )
+
+
+@dataclass(frozen=True)
+class TaskInfo:
+    id: int
+    name: str
+    contest_id: int
+    active_dataset_id: Optional[int]
+    task_type: Optional[str]
+    score_mode: str
+    score_precision: int
+    submission_format: Tuple[str, ...]
+    statement_html_digest: Optional[str]
+    default_input_digest: Optional[str]
+    # hash of the digests of the statement files and attachments
+    files_version: str
+
+    @classmethod
+    def from_task(cls, task: Task) -> "TaskInfo":
+        return cls(
+            id=task.id,
+            name=task.name,
+            contest_id=task.contest_id,
+            active_dataset_id=task.active_dataset_id,
+            task_type=(
+                task.active_dataset.task_type
+                if task.active_dataset is not None
+                else None
+            ),
+            score_mode=task.score_mode,
+            score_precision=task.score_precision,
+            submission_format=tuple(task.submission_format),
+            statement_html_digest=task.statement_html_digest,
+            default_input_digest=task.default_input_digest,
+            files_version=_files_version(task),
+        )
+
+
+def _files_version(task: Task) -> str:
+    files = [f"statement:{lang}:{s.digest}" for lang, s in task.statements.items()]
+    files += [f"attachment:{name}:{a.digest}" for name, a in task.attachments.items()]
+    files += [f"html:{task.statement_html_digest}"]
+    files += [f"input:{task.default_input_digest}"]
+    return hashlib.sha1("\n".join(sorted(files)).encode()).hexdigest()
+
+
+_PARTICIPATION_CACHE: MaxAgeCache[Tuple[str, int], ParticipationInfo] = MaxAgeCache(
+    IDENTITY_TTL, "participation_info"
+)
+_TASK_CACHE: MaxAgeCache[Tuple[int, str], TaskInfo] = MaxAgeCache(
+    IDENTITY_TTL, "task_info"
+)
+_TASK_STATIC_CACHE: MaxAgeCache[Tuple[int, Optional[int], str], "TaskStatic"] = (
+    MaxAgeCache(TASK_STATIC_TTL, "task_static")
+)
+# Prune expired entries every this many misses
+_PRUNE_INTERVAL = 256
+_misses = 0
+
+
+def _count_miss() -> None:
+    global _misses
+    _misses += 1
+    if _misses % _PRUNE_INTERVAL == 0:
+        _PARTICIPATION_CACHE.prune()
+        _TASK_CACHE.prune()
+        _TASK_STATIC_CACHE.prune()
+
+
+def participation_stmt(contest_name: str, cms_user_id: int):
+    return lambda_stmt(
+        lambda: select(Participation)
+        .join(Participation.contest)
+        .where(Contest.name == contest_name)
+        .where(Participation.user_id == cms_user_id)
+        .options(joinedload(Participation.contest))
+        .options(joinedload(Participation.user))
+        .limit(1)
+    )
+
+
+def task_stmt(contest_id: int, task_name: str):
+    return lambda_stmt(
+        lambda: select(Task)
+        .where(Task.contest_id == contest_id)
+        .where(Task.name == task_name)
+        .options(joinedload(Task.active_dataset))
+        .options(selectinload(Task.statements))
+        .options(selectinload(Task.attachments))
+        .limit(1)
+    )
+
+
+def get_participation_info(
+    contest_name: str, cms_user_id: int
+) -> Optional[ParticipationInfo]:
+    key = (contest_name, cms_user_id)
+    info = _PARTICIPATION_CACHE.get(key)
+    if info is not None:
+        return info
+    _count_miss()
+    part: Optional[Participation] = (
+        session.execute(participation_stmt(contest_name, cms_user_id))  # type: ignore
+        .scalars()
+        .first()
+    )
+    if part is None:
+        return None
+    info = ParticipationInfo.from_participation(part)
+    _PARTICIPATION_CACHE.put(key, info)
+    return info
+
+
+def get_task_info(contest_id: int, task_name: str) -> Optional[TaskInfo]:
+    key = (contest_id, task_name)
+    info = _TASK_CACHE.get(key)
+    if info is not None:
+        return info
+    _count_miss()
+    task: Optional[Task] = (
+        session.execute(task_stmt(contest_id, task_name))  # type: ignore
+        .scalars()
+        .first()
+    )
+    if task is None:
+        return None
+    info = TaskInfo.from_task(task)
+    _TASK_CACHE.put(key, info)
+    return info
+
+
+@dataclass(frozen=True)
+class TaskStatic:
+    # JSON fields of the task page that are the same for all participants
+    data: dict
+    # hash of data, the same in all workers
+    version: str
+
+
+def get_task_static(task: TaskInfo, build: Callable[[], TaskStatic]) -> TaskStatic:
+    key = (task.id, task.active_dataset_id, task.files_version)
+    static = _TASK_STATIC_CACHE.get(key)
+    if static is not None:
+        return static
+    _count_miss()
+    static = build()
+    _TASK_STATIC_CACHE.put(key, static)
+    return static
+
+
+def invalidate_identity_cache() -> None:
+    """Drop all cached snapshots, call after editing contests, tasks or
+    participations."""
+    _PARTICIPATION_CACHE.clear()
+    _TASK_CACHE.clear()
+    _TASK_STATIC_CACHE.clear()
@@ -5,14 +5,36 @@ import io
 import json
 import socket
 from dataclasses import dataclass, field
-from typing import Dict, Generic, List, Optional, Tuple, TypeVar
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Generic,
+    Hashable,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    TypeVar,
+)
 from uuid import uuid4
 
-from flask import current_app, request
+from flask import Response, current_app, request, send_file
+from sqlalchemy import tuple_
 from sqlalchemy.orm import Query  # type: ignore
 
-from aoiportal.cmsmirror.db import FSObject, LargeObject, session  # type: ignore
-from aoiportal.error import AOIBadRequest  # type: ignore
+from aoiportal.cmsmirror.db import (  # type: ignore
+    File,
+    FSObject,
+    LargeObject,
+    Submission,
+    UserEval,
+    UserEvalFile,
+    session,
+)
+from aoiportal.error import ERROR_UNKNOWN_DIGEST, AOIBadRequest  # type: ignore
+from aoiportal.metrics import record_cache, register_cache
 
 
 @dataclass
@@ -20,14 +42,23 @@ class Cache:
     data: Dict[str, bytes] = field(default_factory=dict)
     max_size: int = 128
     max_entry_len: int = 0
+    # for the cache metrics
+    name: str = ""
 
+    def __post_init__(self) -> None:
+        register_cache(self.name, self)
 
-STATIC_FILES_CACHE = Cache()
-USER_CACHE = Cache(max_entry_len=1 * 1024 * 1024)
+    def __len__(self) -> int:
+        return len(self.data)
+
+
+STATIC_FILES_CACHE = Cache(name="static_files")
+USER_CACHE = Cache(max_entry_len=1 * 1024 * 1024, name="user_files")
 
 
 def get_digest_cache(cache: Cache, digest: str) -> Optional[bytes]:
     val = cache.data.pop(digest, None)
+    record_cache(cache.name, val is not None)
     if val is None:
         return None
     # move to back
@@ -73,20 +104,130 @@ def open_digest(digest: str, cache: Optional[Cache] = None) -> io.BytesIO:
     return lo
 
 
-def create_file(content: bytes, description: str) -> str:
-    digest = calc_digest(content)
-    fso = session.query(FSObject).filter(FSObject.digest == digest).first()  # type: ignore
-    if fso is not None:
-        return digest
-    lo = LargeObject(0, mode="wb")
-    lo.write(content)
-    lo.close()
+def send_digest(
+    digest: str, download_name: str, cache: Optional[Cache] = None
+) -> Response:
+    """Send a stored file, with its digest as ETag.
+
+    Stored files never change, so clients that already have the digest get
+    a 304 without the file being read.
+    """
+    if request.if_none_match.contains_weak(digest):
+        resp = Response(status=304)
+        resp.set_etag(digest)
+    else:
+        resp = send_file(
+            open_digest(digest, cache=cache), download_name=download_name, etag=digest
+        )
+    resp.headers["Cache-Control"] = "private, max-age=604800"
+    return resp
+
+
+@dataclass(frozen=True)
+class NewFile:
+    # None if the client only sent the digest of a file that is already stored
+    content: Optional[bytes]
+    description: str
+    # If the digest was already computed while receiving the content
+    digest: Optional[str] = None
+
+
+def _existing_digests(digests: Iterable[str]) -> Set[str]:
+    digests = set(digests)
+    if not digests:
+        return set()
+    return {
+        digest
+        for digest, in session.query(FSObject.digest).filter(  # type: ignore
+            FSObject.digest.in_(digests)
+        )
+    }
+
+
+def _participation_digests(participation_id: int, digests: Iterable[str]) -> Set[str]:
+    """The digests among `digests` of files the participation uploaded itself
+    (submission files, user eval files and inputs).
+
+    Only these may be referenced by digest alone. Everything else in
+    fsobjects (testcases, other contestants' files) is treated as unknown,
+    so the digests cannot be used to probe for stored contents.
+    """
+    digests = set(digests)
+    if not digests:
+        return set()
+    submission_files = (
+        session.query(File.digest)  # type: ignore
+        .join(File.submission)
+        .filter(Submission.participation_id == participation_id)
+        .filter(File.digest.in_(digests))
+    )
+    user_eval_files = (
+        session.query(UserEvalFile.digest)  # type: ignore
+        .join(UserEvalFile.user_eval)
+        .filter(UserEval.participation_id == participation_id)
+        .filter(UserEvalFile.digest.in_(digests))
+    )
+    user_eval_inputs = (
+        session.query(UserEval.input)  # type: ignore
+        .filter(UserEval.participation_id == participation_id)
+        .filter(UserEval.input.in_(digests))
+    )
+    return {
+        digest for digest, in submission_files.union(user_eval_files, user_eval_inputs)
+    }
+
+
+def find_missing_digests(participation_id: int, digests: List[str]) -> List[str]:
+    known = _participation_digests(participation_id, digests)
+    return [d for d in dict.fromkeys(digests) if d not in known]
+
+
+def create_files(
+    files: List[NewFile], participation_id: Optional[int] = None
+) -> List[str]:
+    """Store several files, returning their digests in the same order.
+
+    Digests that already exist are looked up with a single query and not
+    written again. Files without content must reference the digest of a file
+    the participation `participation_id` uploaded before.
+    """
+    digests = []
+    for f in files:
+        if f.digest is not None:
+            digests.append(f.digest)
+        elif f.content is not None:
+            digests.append(calc_digest(f.content))
+        else:
+            raise ValueError("NewFile needs content or digest")
+    by_digest = [digest for f, digest in zip(files, digests) if f.content is None]
+    known: Set[str] = set()
+    if by_digest:
+        if participation_id is None:
+            raise ValueError("Files without content need a participation")
+        known = _participation_digests(participation_id, by_digest)
+    for f, digest in zip(files, digests):
+        if f.content is None and digest not in known:
+            raise AOIBadRequest(
+                f"Unknown digest {digest}", error_code=ERROR_UNKNOWN_DIGEST
+            )
+    existing = _existing_digests(digests)
+    for f, digest in zip(files, digests):
+        if digest in existing:
+            continue
+        lo = LargeObject(0, mode="wb")
+        lo.write(f.content)
+        lo.close()
+
+        fso = FSObject(description=f.description)
+        fso.digest = digest
+        fso.loid = lo.loid
+        session.add(fso)  # type: ignore
+        existing.add(digest)
+    return digests
+
 
-    fso = FSObject(description=description)
-    fso.digest = digest
-    fso.loid = lo.loid
-    session.add(fso)  # type: ignore
-    return digest
+def create_file(content: bytes, description: str) -> str:
+    return create_files([NewFile(content=content, description=description)])[0]
 
 
 def _send_rpc_evaluation_service(method: str, data):
@@ -195,17 +336,27 @@ class Pagination:
     per_page: int
     total: int
     items: list
+    # Cursors of the first and last item, None if there are no items
+    first_cursor: Optional[str] = None
+    last_cursor: Optional[str] = None
+    # If there are more items after this page (with `after`: more new items
+    # than fit on one page)
+    has_more: bool = False
 
 
-def paginate(q: Query) -> Pagination:
+def _int_arg(name: str, default: int) -> int:
     try:
-        page = int(request.args.get("page", 1))
+        value = int(request.args.get(name, default))
     except (TypeError, ValueError):
-        raise AOIBadRequest("Bad page number")
-    try:
-        per_page = int(request.args.get("per_page", 20))
-    except (TypeError, ValueError):
-        raise AOIBadRequest("Bad per page number")
+        raise AOIBadRequest(f"Bad {name.replace('_', ' ')} number")
+    if value < 1:
+        raise AOIBadRequest(f"Bad {name.replace('_', ' ')} number")
+    return value
+
+
+def paginate(q: Query) -> Pagination:
+    page = _int_arg("page", 1)
+    per_page = _int_arg("per_page", 20)
     items = q.limit(per_page).offset((page - 1) * per_page).all()
     total = q.order_by(None).count()
     return Pagination(
@@ -228,23 +379,124 @@ class _CachedEntry(Generic[T]):
 
 
 class MaxAgeCache(Generic[K, V]):
-    _cache: Dict[K, _CachedEntry[V]] = {}
-
-    def __init__(self, default_max_age: datetime.timedelta):
+    def __init__(self, default_max_age: datetime.timedelta, name: str):
         self._default_max_age = default_max_age
+        self._cache: Dict[K, _CachedEntry[V]] = {}
+        self.name = name
+        register_cache(name, self)
 
     def get(self, key: K, max_age: Optional[datetime.timedelta] = None) -> Optional[V]:
         if max_age is None:
             max_age = self._default_max_age
         entry = self._cache.get(key)
         if entry is None:
+            record_cache(self.name, False)
             return None
         if datetime.datetime.utcnow() - entry.timestamp > max_age:
-            del self._cache[key]
+            self._cache.pop(key, None)
+            record_cache(self.name, False)
             return None
+        record_cache(self.name, True)
         return entry.data
 
     def put(self, key: K, value: V):
         self._cache[key] = _CachedEntry(
             data=value, timestamp=datetime.datetime.utcnow()
         )
+
+    def invalidate(self, key: K):
+        self._cache.pop(key, None)
+
+    def clear(self):
+        self._cache.clear()
+
+    def prune(self):
+        now = datetime.datetime.utcnow()
+        for key, entry in list(self._cache.items()):
+            if now - entry.timestamp > self._default_max_age:
+                self._cache.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+
+def encode_cursor(timestamp: datetime.datetime, id_: int) -> str:
+    return f"{timestamp.isoformat()}_{id_}"
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime.datetime, int]:
+    try:
+        timestamp, id_ = cursor.rsplit("_", 1)
+        return datetime.datetime.fromisoformat(timestamp), int(id_)
+    except ValueError:
+        raise AOIBadRequest("Bad cursor")
+
+
+TOTAL_COUNT_TTL = datetime.timedelta(seconds=30)
+_TOTAL_COUNT_CACHE: MaxAgeCache[Hashable, int] = MaxAgeCache(
+    TOTAL_COUNT_TTL, "total_count"
+)
+
+
+def paginate_keyset(
+    q: Query,
+    *,
+    timestamp_col,
+    id_col,
+    row_key: Callable[[Any], Tuple[datetime.datetime, int]],
+    count_query: Query,
+    count_key: Hashable,
+) -> Pagination:
+    """Paginate q newest first by (timestamp_col, id_col).
+
+    Query arguments:
+     - `before=<cursor>`: the page after the item with that cursor
+     - `after=<cursor>`: the newest items up to the one with that cursor
+       (for live refresh)
+     - `page=<n>`: the n-th page with OFFSET, for jumping to arbitrary pages
+
+    Cursors are taken from `first_cursor`/`last_cursor` of a previous
+    result, `row_key` extracts the (timestamp, id) pair from a result row.
+
+    `count_query` should count the same rows as `q` with as few joins as
+    possible. Its result is cached per `count_key` for TOTAL_COUNT_TTL, so
+    the total may lag behind the items a bit.
+    """
+    page = _int_arg("page", 1)
+    per_page = _int_arg("per_page", 20)
+    before = request.args.get("before")
+    after = request.args.get("after")
+    key = tuple_(timestamp_col, id_col)
+
+    q = q.order_by(timestamp_col.desc(), id_col.desc())
+    if after is not None:
+        q = q.filter(key > tuple_(*decode_cursor(after)))
+    elif before is not None:
+        q = q.filter(key < tuple_(*decode_cursor(before)))
+    else:
+        q = q.offset((page - 1) * per_page)
+    # one extra row tells if there are more
+    items = q.limit(per_page + 1).all()
+    has_more = len(items) > per_page
+    items = items[:per_page]
+
+    if after is None and before is None and not has_more and (items or page == 1):
+        # last page by offset, the total is known
+        total = (page - 1) * per_page + len(items)
+    else:
+        cached = _TOTAL_COUNT_CACHE.get(count_key)
+        if cached is None:
+            _TOTAL_COUNT_CACHE.prune()
+            cached = count_query.scalar()
+            _TOTAL_COUNT_CACHE.put(count_key, cached)
+        total = cached
+
+    return Pagination(
+        page=page,
+        per_page=per_page,
+        total=total,
+        items=items,
+        first_cursor=encode_cursor(*row_key(items[0])) if items else None,
+        last_cursor=encode_cursor(*row_key(items[-1])) if items else None,
+        has_more=has_more,
+    )
@@ -1,18 +1,29 @@
 import base64
 import datetime
 import functools
+import hashlib
+import json
 import logging
+from dataclasses import dataclass
 from pathlib import Path
 from typing import Dict, List, Optional, Tuple
 from uuid import uuid4
 
 import dateutil.parser
 import voluptuous as vol  # type: ignore
-from flask import Blueprint, g, request, send_file
-from sqlalchemy.orm import Load, joinedload  # type: ignore
+from flask import Blueprint, current_app, g, request
+from sqlalchemy import and_, func, lambda_stmt, select  # type: ignore
+from sqlalchemy.orm import Load, joinedload, selectinload  # type: ignore
 from werkzeug.local import LocalProxy
 
-from aoiportal.auth_util import get_current_user, get_proxy_contest, is_proxy_auth, login_required
+from aoiportal import ratelimit, timing
+from aoiportal.auth_util import (
+    get_current_auth_user,
+    get_current_user,
+    get_proxy_contest,
+    is_proxy_auth,
+    login_required,
+)
 from aoiportal.cmsmirror import scores
 from aoiportal.cmsmirror.db import (  # type: ignore
     Announcement,
@@ -29,41 +40,67 @@ from aoiportal.cmsmirror.db import (  # type: ignore
     Submission,
     SubmissionResult,
     Task,
-    User,
+    Testcase,
     UserEval,
     UserEvalFile,
     UserEvalResult,
+    replica_read,
     session,
 )
+from aoiportal.cmsmirror.identity import (
+    ContestInfo,
+    ParticipationInfo,
+    TaskInfo,
+    TaskStatic,
+    get_participation_info,
+    get_task_info,
+    get_task_static,
+)
 from aoiportal.cmsmirror.util import (  # type: ignore
     STATIC_FILES_CACHE,
     USER_CACHE,
+    MaxAgeCache,
+    NewFile,
     ScoreInputSingle,
-    create_file,
+    create_files,
+    find_missing_digests,
     open_digest,
     score_calculation_single,
+    send_digest,
     send_sub_to_evaluation_service,
     send_user_eval_to_evaluation_service,
 )
 from aoiportal.const import (
     KEY_CONTENT,
+    KEY_DIGEST,
+    KEY_DIGESTS,
     KEY_FILENAME,
     KEY_FILES,
     KEY_INPUT,
+    KEY_INPUT_DIGEST,
     KEY_LANGUAGE,
     KEY_LAST_NOTIFICAITON,
+    KEY_MISSING,
     KEY_SUBJECT,
     KEY_TEXT,
+    KEY_UUIDS,
+    KEY_VERSION,
+)
+from aoiportal.error import (
+    ERROR_THROTTLED,
+    ERROR_VALIDATION_ERROR,
+    AOIBadRequest,
+    AOIForbidden,
+    AOINotFound,
 )
-from aoiportal.error import ERROR_THROTTLED, AOIBadRequest, AOIForbidden, AOINotFound
 from aoiportal.utils import as_utc
-from aoiportal.web_utils import json_api
+from aoiportal.web_utils import json_api, read_multipart_upload, versioned_json
 
 _LOGGER = logging.getLogger(__name__)
 cmsmirror_bp = Blueprint("cmsmirror", __name__)
 
 
-def _get_participation() -> Participation:
+def _get_participation() -> ParticipationInfo:
     key = "cms_participation"
     if hasattr(g, key):
         return getattr(g, key)
@@ -74,18 +111,18 @@ def _get_participation() -> Participation:
     if proxy_contest is not None and contest_name != proxy_contest.cms_name:
         raise AOINotFound("Contest not found")
 
-    cu = get_current_user()
+    cu = get_current_auth_user()
     assert cu is not None
-    part = (
-        session.query(Participation)  # type: ignore
-        .join(Participation.contest)
-        .filter(Contest.name == contest_name)
-        .join(Participation.user)
-        .filter(User.id == cu.cms_id)
-        .options(joinedload(Participation.contest))
-        .options(joinedload(Participation.user))
-        .first()
-    )
+    cms_id = cu.cms_id
+    if cms_id is None:
+        # the cached session may predate the CMS user (first contest joined
+        # through another worker), check the portal DB
+        user = get_current_user()
+        cms_id = user.cms_id if user is not None else None
+    part = None
+    if cms_id is not None:
+        with timing.phase(timing.PHASE_PARTICIPATION):
+            part = get_participation_info(contest_name, cms_id)
     if part is None:
         raise AOINotFound("Contest not found")
     if not part.contest.allow_frontendv2 and not part.unrestricted:
@@ -94,31 +131,37 @@ def _get_participation() -> Participation:
     return part
 
 
-def _get_task() -> Task:
+def _get_task() -> TaskInfo:
     key = "cms_task"
     if hasattr(g, key):
         return getattr(g, key)
     assert request.view_args is not None
     task_name = request.view_args["task_name"]
-    task: Optional[Task] = (
-        session.query(Task)  # type: ignore
-        .filter(Task.contest_id == current_contest.id)
-        .filter(Task.name == task_name)
-        .first()
-    )
+    with timing.phase(timing.PHASE_PARTICIPATION):
+        task = get_task_info(current_contest.id, task_name)
     if task is None:
         raise AOINotFound("Task not found")
     setattr(g, key, task)
     return task
 
 
-current_participation: Participation = LocalProxy(lambda: _get_participation())
-current_contest: Contest = LocalProxy(lambda: current_participation.contest)
-current_task: Task = LocalProxy(lambda: _get_task())
+# Cached snapshots, see identity.py. Use the _load_* functions below when the
+# full ORM objects are needed.
+current_participation: ParticipationInfo = LocalProxy(lambda: _get_participation())  # type: ignore
+current_contest: ContestInfo = LocalProxy(lambda: current_participation.contest)  # type: ignore
+current_task: TaskInfo = LocalProxy(lambda: _get_task())  # type: ignore
+
+
+def _load_participation() -> Participation:
+    return session.get(Participation, current_participation.id)  # type: ignore
+
+
+def _load_contest() -> Contest:
+    return session.get(Contest, current_contest.id)  # type: ignore
 
 
 def _user_effective_stop(
-    contest: Contest, part: Participation
+    contest: ContestInfo, part: ParticipationInfo
 ) -> datetime.datetime:
     """Return the effective contest stop time for this participation,
     accounting for any per-user extra time."""
@@ -180,12 +223,68 @@ def _conv_question(q: Question):
     }
 
 
+def _scalars(*queries) -> tuple:
+    """Run several single value aggregate queries in one round trip."""
+    return tuple(
+        session.query(*(q.scalar_subquery() for q in queries)).one()  # type: ignore
+    )
+
+
+def _notifications_version(task_id: Optional[int] = None) -> tuple:
+    ann_q = session.query(Announcement.id).filter(  # type: ignore
+        Announcement.contest_id == current_contest.id
+    )
+    msg_q = session.query(Message.id).filter(  # type: ignore
+        Message.participation_id == current_participation.id
+    )
+    question_q = session.query(Question.id).filter(  # type: ignore
+        Question.participation_id == current_participation.id
+    )
+    if task_id is not None:
+        ann_q = ann_q.filter(Announcement.task_id == task_id)
+        msg_q = msg_q.filter(Message.task_id == task_id)
+        question_q = question_q.filter(Question.task_id == task_id)
+    return _scalars(
+        ann_q.with_entities(func.count(Announcement.id)),
+        ann_q.with_entities(func.max(Announcement.id)),
+        msg_q.with_entities(func.count(Message.id)),
+        msg_q.with_entities(func.max(Message.id)),
+        question_q.with_entities(func.count(Question.id)),
+        question_q.with_entities(func.max(Question.id)),
+        question_q.with_entities(func.max(Question.reply_timestamp)),
+    )
+
+
 @cmsmirror_bp.route("/api/cms/contest/<contest_name>")
 @login_required
 @json_api()
+@replica_read
 def get_contest(contest_name: str):
-    part = current_participation
-    contest = current_contest
+    part_info = current_participation
+    now = datetime.datetime.utcnow()
+    phase = current_contest.phase(now)
+    in_extra_time = phase > 0 and now <= _user_effective_stop(
+        current_contest, part_info
+    )
+    is_active = 0 <= phase <= 2 or in_extra_time or part_info.unrestricted
+    tasks = (
+        session.query(Task.id, Task.name, Task.title)  # type: ignore
+        .filter(Task.contest_id == current_contest.id)
+        .order_by(Task.id)
+        .all()
+    )
+    version = (
+        part_info,
+        is_active,
+        _notifications_version(),
+        [tuple(t) for t in tasks],
+    )
+    return versioned_json(version, lambda: _render_contest(is_active))
+
+
+def _render_contest(is_active: bool) -> dict:
+    part = _load_participation()
+    contest = _load_contest()
     ret = {
         "name": contest.name,
         "description": contest.description,
@@ -205,10 +304,7 @@ def get_contest(contest_name: str):
         "messages": [_conv_message(msg) for msg in part.messages],
         "questions": [_conv_question(q) for q in part.questions],
     }
-    now = datetime.datetime.utcnow()
-    phase = contest.phase(now)
-    in_extra_time = phase > 0 and now <= _user_effective_stop(contest, part)
-    if 0 <= phase <= 2 or in_extra_time or part.unrestricted:
+    if is_active:
         ret.update(
             {
                 "tasks": [
@@ -225,11 +321,86 @@ def get_contest(contest_name: str):
     return ret
 
 
+# The scores version aggregates over all official submissions of the
+# contest, so it is shared by all participations for a few seconds instead
+# of being recomputed for every poll.
+SCORES_VERSION_TTL = datetime.timedelta(seconds=5)
+_SCORES_VERSION_CACHE: MaxAgeCache[int, tuple] = MaxAgeCache(
+    SCORES_VERSION_TTL, "scores_version"
+)
+
+
+def _contest_scores_version(contest_id: int) -> tuple:
+    version = _SCORES_VERSION_CACHE.get(contest_id)
+    if version is not None:
+        return version
+    _SCORES_VERSION_CACHE.prune()
+    tasks = (
+        session.query(  # type: ignore
+            Task.id,
+            Task.name,
+            Task.title,
+            Task.active_dataset_id,
+            Task.score_mode,
+            Task.score_precision,
+        )
+        .filter(Task.contest_id == contest_id)
+        .order_by(Task.id)
+        .all()
+    )
+    parts_q = session.query(Participation.id).filter(  # type: ignore
+        Participation.contest_id == contest_id
+    )
+    results = (
+        session.query(  # type: ignore
+            func.count(Submission.id),
+            func.max(Submission.id),
+            func.count(SubmissionResult.score),
+            func.sum(SubmissionResult.score),
+        )
+        .select_from(Submission)
+        .join(Task, Submission.task_id == Task.id)
+        .outerjoin(
+            SubmissionResult,
+            and_(
+                SubmissionResult.submission_id == Submission.id,
+                SubmissionResult.dataset_id == Task.active_dataset_id,
+            ),
+        )
+        .filter(Task.contest_id == contest_id)
+        .filter(Submission.official)
+        .one()
+    )
+    version = (
+        [tuple(t) for t in tasks],
+        _scalars(
+            parts_q.with_entities(func.count(Participation.id)),
+            parts_q.filter(Participation.hidden).with_entities(
+                func.count(Participation.id)
+            ),
+        ),
+        tuple(results),
+    )
+    _SCORES_VERSION_CACHE.put(contest_id, version)
+    return version
+
+
 @cmsmirror_bp.route("/api/cms/contest/<contest_name>/scores")
 @login_required
 @active_contest_required
 @json_api()
+@replica_read
 def get_contest_scores(contest_name: str):
+    contest = current_contest
+    version = (
+        current_participation.id,
+        contest,
+        _contest_scores_version(contest.id),
+    )
+    return versioned_json(version, _render_contest_scores)
+
+
+def _render_contest_scores() -> dict:
     part = current_participation
     contest = current_contest
 
@@ -379,52 +550,32 @@ def dump_submission(
     return base
 
 
-@cmsmirror_bp.route("/api/cms/contest/<contest_name>/task/<task_name>")
-@login_required
-@active_contest_required
-@json_api()
-def get_task(contest_name: str, task_name: str):
-    part = current_participation
-    task = current_task
-    ds: Dataset = task.active_dataset
-    submissions: List[Tuple[Submission, Optional[SubmissionResult]]] = (
-        session.query(Submission, SubmissionResult)  # type: ignore
-        .filter(Submission.participation_id == part.id)
-        .filter(Submission.task_id == task.id)
-        .outerjoin(
-            Submission.results.and_(
-                SubmissionResult.dataset_id == current_task.active_dataset_id
-            )
-        )
+def _build_task_static() -> TaskStatic:
+    task: Task = (
+        session.query(Task)  # type: ignore
+        .filter(Task.id == current_task.id)
         .options(
-            joinedload(SubmissionResult.meme),
-            Load(Submission).load_only(
-                Submission.id,
-                Submission.uuid,
-                Submission.timestamp,
-                Submission.language,
-                Submission.official,
-            ),
-            Load(SubmissionResult).load_only(
-                SubmissionResult.submission_id,
-                SubmissionResult.dataset_id,
-                SubmissionResult.compilation_outcome,
-                SubmissionResult.score,
-                SubmissionResult.score_details,
-                SubmissionResult.compilation_outcome,
-                SubmissionResult.evaluation_outcome,
-            ),
+            joinedload(Task.contest),
+            selectinload(Task.statements),
+            selectinload(Task.attachments),
+            joinedload(Task.active_dataset).selectinload(Dataset.language_templates),
         )
-        .all()
+        .one()
+    )
+    ds: Dataset = task.active_dataset
+    num_testcases = (
+        session.query(func.count(Testcase.id))  # type: ignore
+        .filter(Testcase.dataset_id == ds.id)
+        .scalar()
     )
 
     if ds.score_type == "Sum":
         scoring = {
             "type": "sum",
             "score_per_testcase": ds.score_type_parameters,
-            "num_testcases": len(ds.testcases),
+            "num_testcases": num_testcases,
         }
-        max_score = ds.score_type_parameters * len(ds.testcases)
+        max_score = ds.score_type_parameters * num_testcases
     else:
         scoring = {
             "type": {
@@ -436,36 +587,7 @@ def get_task(contest_name: str, task_name: str):
         }
         max_score = sum(p for p, _ in ds.score_type_parameters)
 
-    score = 0.0
-    score_subtasks = None
-
-    score_res = score_calculation_single(
-        [
-            ScoreInputSingle(
-                score=res.score,
-                score_details=res.score_details,
-            )
-            for sub, res in submissions
-            if res is not None
-            and sub.official
-            and res.score is not None
-            and res.score > 0
-        ],
-        task.score_mode,
-    )
-    score = score_res.score
-    score_subtasks = None
-    if score_res.subtasks is not None:
-        score_subtasks = [
-            {
-                "fraction": st.fraction,
-                "score": st.score,
-                "max_score": st.max_score,
-            }
-            for st in score_res.subtasks
-        ]
-
-    return {
+    data = {
         "name": task.name,
         "title": task.title,
         "contest": {
@@ -500,14 +622,9 @@ def get_task(contest_name: str, task_name: str):
             "TwoSteps": "two_steps",
         }[ds.task_type],
         "scoring": scoring,
-        "submissions": [
-            dump_submission(sub, res, detailed=False) for sub, res in submissions
-        ],
-        "score": round(score, task.score_precision),
         "max_score": max_score,
         "score_precision": task.score_precision,
         "score_mode": task.score_mode,
-        "score_subtasks": score_subtasks,
         "submission_format": task.submission_format,
         "language_templates": [
             {
@@ -516,16 +633,171 @@ def get_task(contest_name: str, task_name: str):
             }
             for lt in ds.language_templates.values()
         ],
-        "announcements": [_conv_announcement(ann) for ann in task.announcements],
-        "messages": [
-            _conv_message(msg) for msg in part.messages if msg.task_id == task.id
-        ],
-        "questions": [
-            _conv_question(q) for q in part.questions if q.task_id == task.id
+    }
+    version = hashlib.sha1(json.dumps(data, sort_keys=True).encode()).hexdigest()
+    return TaskStatic(data=data, version=version)
+
+
+@cmsmirror_bp.route("/api/cms/contest/<contest_name>/task/<task_name>")
+@login_required
+@active_contest_required
+@json_api()
+@replica_read
+def get_task(contest_name: str, task_name: str):
+    part = current_participation
+    task = current_task
+    static = get_task_static(task, _build_task_static)
+    with timing.phase(timing.PHASE_SUBMISSIONS):
+        submissions_version = (
+            session.query(  # type: ignore
+                func.count(Submission.id),
+                func.max(Submission.id),
+                func.count(SubmissionResult.compilation_outcome),
+                func.count(SubmissionResult.evaluation_outcome),
+                func.count(SubmissionResult.score),
+                func.sum(SubmissionResult.score),
+                func.sum(SubmissionResult.meme_id),
+            )
+            .select_from(Submission)
+            .outerjoin(
+                SubmissionResult,
+                and_(
+                    SubmissionResult.submission_id == Submission.id,
+                    SubmissionResult.dataset_id == task.active_dataset_id,
+                ),
+            )
+            .filter(Submission.participation_id == part.id)
+            .filter(Submission.task_id == task.id)
+            .one()
+        )
+    version = (
+        part.id,
+        task,
+        static.version,
+        tuple(submissions_version),
+        _notifications_version(task.id),
+    )
+    return versioned_json(version, lambda: _render_task(static))
+
+
+def _render_task(static: TaskStatic) -> dict:
+    part = current_participation
+    task = current_task
+    with timing.phase(timing.PHASE_SUBMISSIONS):
+        submissions: List[Tuple[Submission, Optional[SubmissionResult]]] = (
+            session.query(Submission, SubmissionResult)  # type: ignore
+            .filter(Submission.participation_id == part.id)
+            .filter(Submission.task_id == task.id)
+            .outerjoin(
+                Submission.results.and_(
+                    SubmissionResult.dataset_id == current_task.active_dataset_id
+                )
+            )
+            .options(
+                joinedload(SubmissionResult.meme),
+                Load(Submission).load_only(
+                    Submission.id,
+                    Submission.uuid,
+                    Submission.timestamp,
+                    Submission.language,
+                    Submission.official,
+                ),
+                Load(SubmissionResult).load_only(
+                    SubmissionResult.submission_id,
+                    SubmissionResult.dataset_id,
+                    SubmissionResult.compilation_outcome,
+                    SubmissionResult.score,
+                    SubmissionResult.score_details,
+                    SubmissionResult.compilation_outcome,
+                    SubmissionResult.evaluation_outcome,
+                ),
+            )
+            .all()
+        )
+    announcements: List[Announcement] = (
+        session.query(Announcement)  # type: ignore
+        .filter(Announcement.task_id == task.id)
+        .options(joinedload(Announcement.task))
+        .all()
+    )
+    messages: List[Message] = (
+        session.query(Message)  # type: ignore
+        .filter(Message.participation_id == part.id)
+        .filter(Message.task_id == task.id)
+        .options(joinedload(Message.task))
+        .order_by(Message.timestamp)
+        .all()
+    )
+    questions: List[Question] = (
+        session.query(Question)  # type: ignore
+        .filter(Question.participation_id == part.id)
+        .filter(Question.task_id == task.id)
+        .options(joinedload(Question.task))
+        .order_by(Question.question_timestamp, Question.reply_timestamp)
+        .all()
+    )
+
+    with timing.phase(timing.PHASE_SCORE):
+        score_res = score_calculation_single(
+            [
+                ScoreInputSingle(
+                    score=res.score,
+                    score_details=res.score_details,
+                )
+                for sub, res in submissions
+                if res is not None
+                and sub.official
+                and res.score is not None
+                and res.score > 0
+            ],
+            task.score_mode,
+        )
+    score_subtasks = None
+    if score_res.subtasks is not None:
+        score_subtasks = [
+            {
+                "fraction": st.fraction,
+                "score": st.score,
+                "max_score": st.max_score,
+            }
+            for st in score_res.subtasks
+        ]
+
+    return {
+        **static.data,
+        "submissions": [
+            dump_submission(sub, res, detailed=False) for sub, res in submissions
         ],
+        "score": round(score_res.score, task.score_precision),
+        "score_subtasks": score_subtasks,
+        "announcements": [_conv_announcement(ann) for ann in announcements],
+        "messages": [_conv_message(msg) for msg in messages],
+        "questions": [_conv_question(q) for q in questions],
     }
 
 
+def submission_stmt(
+    task: TaskInfo, participation_id: int, submission_uuid: str, detailed: bool
+):
+    """The submission with its result on the active dataset, as a lambda
+    statement (polled by every contestant while evaluating)."""
+    task_id = task.id
+    dataset_id = task.active_dataset_id
+    stmt = lambda_stmt(
+        lambda: select(Submission, SubmissionResult)
+        .where(Submission.task_id == task_id)
+        .where(Submission.uuid == submission_uuid)
+        .where(Submission.participation_id == participation_id)
+        .outerjoin(
+            Submission.results.and_(SubmissionResult.dataset_id == dataset_id)
+        )
+        .options(joinedload(Submission.files))
+    )
+    if detailed:
+        stmt += lambda s: s.options(joinedload(SubmissionResult.meme))
+    return stmt + (lambda s: s.limit(1))
+
+
 @cmsmirror_bp.route(
     "/api/cms/contest/<contest_name>/task/<task_name>/submission/<submission_uuid>"
 )
@@ -533,19 +805,11 @@ def get_task(contest_name: str, task_name: str):
 @active_contest_required
 @json_api()
 def get_submission(contest_name: str, task_name: str, submission_uuid: str):
+    stmt = submission_stmt(
+        current_task, current_participation.id, submission_uuid, detailed=True
+    )
     q: Optional[Tuple[Submission, Optional[SubmissionResult]]] = (
-        session.query(Submission, SubmissionResult)  # type: ignore
-        .filter(Submission.task_id == current_task.id)
-        .filter(Submission.uuid == submission_uuid)
-        .filter(Submission.participation_id == current_participation.id)
-        .outerjoin(
-            Submission.results.and_(
-                SubmissionResult.dataset_id == current_task.active_dataset_id
-            )
-        )
-        .options(joinedload(Submission.files))
-        .options(joinedload(SubmissionResult.meme))
-        .first()
+        session.execute(stmt).unique().first()  # type: ignore
     )
     if q is None:
         raise AOINotFound("Submission not found.")
@@ -560,23 +824,91 @@ def get_submission(contest_name: str, task_name: str, submission_uuid: str):
 @active_contest_required
 @json_api()
 def get_submission_short(contest_name: str, task_name: str, submission_uuid: str):
+    stmt = submission_stmt(
+        current_task, current_participation.id, submission_uuid, detailed=False
+    )
     q: Optional[Tuple[Submission, Optional[SubmissionResult]]] = (
+        session.execute(stmt).unique().first()  # type: ignore
+    )
+    if q is None:
+        raise AOINotFound("Submission not found.")
+
+    return dump_submission(q[0], q[1], detailed=False)
+
+
+def _submission_status_version(
+    rows: List[Tuple[Submission, Optional[SubmissionResult]]]
+) -> str:
+    h = hashlib.sha1()
+    for sub, res in rows:
+        if res is None:
+            h.update(f"{sub.uuid}:{SubmissionResult.COMPILING};".encode())
+            continue
+        meme_id = res.meme_id if res.meme_id is not None else ""
+        h.update(f"{sub.uuid}:{res.get_status()}:{res.score}:{meme_id};".encode())
+    return h.hexdigest()
+
+
+@cmsmirror_bp.route(
+    "/api/cms/contest/<contest_name>/submissions/status", methods=["POST"]
+)
+@login_required
+@active_contest_required
+@json_api(
+    {
+        vol.Required(KEY_UUIDS): vol.All([str], vol.Length(max=100)),
+        vol.Optional(KEY_VERSION): str,
+    }
+)
+def get_submissions_status(data, contest_name: str):
+    uuids: List[str] = data[KEY_UUIDS]
+    if not uuids:
+        return {
+            "version": _submission_status_version([]),
+            "changed": True,
+            "submissions": [],
+        }
+    q: List[Tuple[Submission, Optional[SubmissionResult]]] = (
         session.query(Submission, SubmissionResult)  # type: ignore
-        .filter(Submission.task_id == current_task.id)
-        .filter(Submission.uuid == submission_uuid)
+        .join(Submission.task)
         .filter(Submission.participation_id == current_participation.id)
+        .filter(Submission.uuid.in_(uuids))
         .outerjoin(
             Submission.results.and_(
-                SubmissionResult.dataset_id == current_task.active_dataset_id
+                SubmissionResult.dataset_id == Task.active_dataset_id
             )
         )
-        .options(joinedload(Submission.files))
-        .first()
+        .options(
+            joinedload(SubmissionResult.meme),
+            Load(Submission).load_only(
+                Submission.id,
+                Submission.uuid,
+                Submission.timestamp,
+                Submission.language,
+                Submission.official,
+            ),
+            Load(SubmissionResult).load_only(
+                SubmissionResult.submission_id,
+                SubmissionResult.dataset_id,
+                SubmissionResult.compilation_outcome,
+                SubmissionResult.score,
+                SubmissionResult.score_details,
+                SubmissionResult.evaluation_outcome,
+                SubmissionResult.meme_id,
+            ),
+        )
+        .order_by(Submission.id.asc())
+        .all()
     )
-    if q is None:
-        raise AOINotFound("Submission not found.")
 
-    return dump_submission(q[0], q[1], detailed=False)
+    version = _submission_status_version(q)
+    if data.get(KEY_VERSION) == version:
+        return {"version": version, "changed": False}
+    return {
+        "version": version,
+        "changed": True,
+        "submissions": [dump_submission(sub, res, detailed=False) for sub, res in q],
+    }
 
 
 @cmsmirror_bp.route(
@@ -598,10 +930,11 @@ def get_submission_meme(contest_name: str, task_name: str, submission_uuid: str)
     if q is None:
         raise AOINotFound("Meme not found.")
 
-    fh = open_digest(q.digest, cache=STATIC_FILES_CACHE)
-    resp = send_file(fh, download_name=f"meme{Path(q.filename).suffix}")
-    resp.headers["Cache-Control"] = "private, max-age=604800"
-    return resp
+    return send_digest(
+        q.digest,
+        download_name=f"meme{Path(q.filename).suffix}",
+        cache=STATIC_FILES_CACHE,
+    )
 
 
 @cmsmirror_bp.route(
@@ -618,10 +951,11 @@ def get_statement(contest_name: str, task_name: str, language: str):
     )
     if stmt is None:
         raise AOINotFound("Statement not found")
-    fh = open_digest(stmt.digest, cache=STATIC_FILES_CACHE)
-    resp = send_file(fh, download_name=f"{stmt.task.name} ({language}).pdf")
-    resp.headers["Cache-Control"] = "private, max-age=604800"
-    return resp
+    return send_digest(
+        stmt.digest,
+        download_name=f"{stmt.task.name} ({language}).pdf",
+        cache=STATIC_FILES_CACHE,
+    )
 
 
 @cmsmirror_bp.route("/api/cms/contest/<contest_name>/task/<task_name>/statement-html")
@@ -631,10 +965,9 @@ def get_statement_html(contest_name: str, task_name: str):
     dig = current_task.statement_html_digest
     if dig is None:
         raise AOINotFound("Statement HTML not found")
-    fh = open_digest(dig, cache=STATIC_FILES_CACHE)
-    resp = send_file(fh, download_name=f"{current_task.name}.html")
-    resp.headers["Cache-Control"] = "private, max-age=604800"
-    return resp
+    return send_digest(
+        dig, download_name=f"{current_task.name}.html", cache=STATIC_FILES_CACHE
+    )
 
 
 @cmsmirror_bp.route("/api/cms/contest/<contest_name>/task/<task_name>/default-input")
@@ -644,10 +977,9 @@ def get_default_input(contest_name: str, task_name: str):
     dig = current_task.default_input_digest
     if dig is None:
         raise AOINotFound("Default Input not found")
-    fh = open_digest(dig, cache=STATIC_FILES_CACHE)
-    resp = send_file(fh, download_name=f"{current_task.name}.in")
-    resp.headers["Cache-Control"] = "private, max-age=604800"
-    return resp
+    return send_digest(
+        dig, download_name=f"{current_task.name}.in", cache=STATIC_FILES_CACHE
+    )
 
 
 @cmsmirror_bp.route(
@@ -664,10 +996,7 @@ def get_attachment(contest_name: str, task_name: str, filename: str):
     )
     if att is None:
         raise AOINotFound("Attachment not found")
-    fh = open_digest(att.digest, cache=STATIC_FILES_CACHE)
-    resp = send_file(fh, download_name=att.filename)
-    resp.headers["Cache-Control"] = "private, max-age=604800"
-    return resp
+    return send_digest(att.digest, download_name=att.filename, cache=STATIC_FILES_CACHE)
 
 
 @cmsmirror_bp.route(
@@ -684,10 +1013,7 @@ def get_language_template(contest_name: str, task_name: str, filename: str):
     )
     if lt is None:
         raise AOINotFound("Language template not found")
-    fh = open_digest(lt.digest, cache=STATIC_FILES_CACHE)
-    resp = send_file(fh, download_name=lt.filename)
-    resp.headers["Cache-Control"] = "private, max-age=604800"
-    return resp
+    return send_digest(lt.digest, download_name=lt.filename, cache=STATIC_FILES_CACHE)
 
 
 @cmsmirror_bp.route(
@@ -715,10 +1041,7 @@ def get_submission_file(
     )
     if file is None:
         raise AOINotFound("File not found")
-    fh = open_digest(file.digest, cache=USER_CACHE)
-    resp = send_file(fh, download_name=file.filename)
-    resp.headers["Cache-Control"] = "private, max-age=604800"
-    return resp
+    return send_digest(file.digest, download_name=file.filename, cache=USER_CACHE)
 
 
 @cmsmirror_bp.route("/api/cms/contest/<contest_name>/question", methods=["POST"])
@@ -731,7 +1054,7 @@ def get_submission_file(
     }
 )
 def post_question(data, contest_name: str):
-    part: Participation = current_participation
+    part = current_participation
     q = Question(
         question_timestamp=datetime.datetime.utcnow(),
         subject=data[KEY_SUBJECT],
@@ -755,7 +1078,7 @@ def post_question(data, contest_name: str):
     }
 )
 def post_question_task(data, contest_name: str, task_name: str):
-    part: Participation = current_participation
+    part = current_participation
     q = Question(
         question_timestamp=datetime.datetime.utcnow(),
         subject=data[KEY_SUBJECT],
@@ -768,56 +1091,145 @@ def post_question_task(data, contest_name: str, task_name: str):
     return {"success": True}
 
 
-def _base64_content(value: str):
+_MAX_NEGOTIATED_DIGESTS = 64
+
+
+def _base64_content(value: str) -> bytes:
     try:
-        base64.b64decode(value, validate=True)
-        return value
+        return base64.b64decode(value, validate=True)
     except ValueError:
         raise vol.Invalid("Not valid base64")
 
 
+_DIGEST_SCHEMA = vol.All(str, vol.Lower, vol.Match(r"^[0-9a-f]{40}$"))
+
+
+@dataclass(frozen=True)
+class _UploadFile:
+    filename: str
+    # None if the file is only referenced by the digest of a stored file
+    content: Optional[bytes]
+    digest: Optional[str] = None
+
+
+def _file_schema():
+    return vol.All(
+        {
+            vol.Required(KEY_FILENAME): str,
+            vol.Exclusive(KEY_CONTENT, "content"): vol.All(str, _base64_content),
+            vol.Exclusive(KEY_DIGEST, "content"): _DIGEST_SCHEMA,
+        },
+        vol.Any(
+            vol.Schema({vol.Required(KEY_CONTENT): object}, extra=vol.ALLOW_EXTRA),
+            vol.Schema({vol.Required(KEY_DIGEST): object}, extra=vol.ALLOW_EXTRA),
+            msg="Either content or digest is required",
+        ),
+    )
+
+
+def _json_upload_file(file: dict) -> _UploadFile:
+    return _UploadFile(
+        filename=file[KEY_FILENAME],
+        content=file.get(KEY_CONTENT),
+        digest=file.get(KEY_DIGEST),
+    )
+
+
 @cmsmirror_bp.route(
-    "/api/cms/contest/<contest_name>/task/<task_name>/submit", methods=["POST"]
+    "/api/cms/contest/<contest_name>/task/<task_name>/missing-digests",
+    methods=["POST"],
 )
 @login_required
 @active_contest_required
 @json_api(
     {
-        vol.Required(KEY_LANGUAGE): str,
-        vol.Required(KEY_FILES): [
-            {
-                vol.Required(KEY_FILENAME): str,
-                vol.Required(KEY_CONTENT): vol.All(str, _base64_content),
-            }
-        ],
+        vol.Required(KEY_DIGESTS): vol.All(
+            [_DIGEST_SCHEMA], vol.Length(max=_MAX_NEGOTIATED_DIGESTS)
+        ),
     }
 )
-def submit(data, contest_name: str, task_name: str):
-    allow_partial = current_task.active_dataset.task_type == "OutputOnly"
-    expected_format = set(current_task.submission_format)
-    set_format = set(x[KEY_FILENAME] for x in data[KEY_FILES])
-    if not allow_partial and (expected_format - set_format):
-        raise AOIBadRequest("At least one file missing.")
-    if set_format - expected_format:
-        raise AOIBadRequest("At least one file doesn't match submission format.")
-    if data[KEY_LANGUAGE] not in current_contest.languages:
-        raise AOIBadRequest("Language not allowed.")
+def get_missing_digests(data, contest_name: str, task_name: str):
+    """First phase of a submit: return which of the digests the client has to
+    upload. Files with the other digests can be submitted by digest only.
+
+    Only digests of files the participation uploaded itself count as known.
+    The frontend negotiates before submissions and user evals alike, so the
+    request has its own rate limit instead of using up the submit limit.
+    """
+    pid = current_participation.id
+    if not ratelimit.hit(ratelimit.LIMIT_MISSING_DIGESTS, pid):
+        raise AOIBadRequest("Too many requests", error_code=ERROR_THROTTLED)
+    return {
+        KEY_MISSING: find_missing_digests(pid, data[KEY_DIGESTS])
+    }
 
-    now = datetime.datetime.utcnow()
-    q = (
-        session.query(Submission)  # type: ignore
-        .filter(Submission.participation_id == current_participation.id)
-        .filter(Submission.timestamp >= now - datetime.timedelta(seconds=10))
+
+def _read_multipart_files() -> (
+    Tuple[Dict[str, str], List[_UploadFile], Optional[_UploadFile]]
+):
+    """Read a multipart submit/eval upload.
+
+    Returns the plain form fields, the parts uploaded as `files` (named by
+    their part filename) and the optional `input` part. Contents already
+    known to the server can be referenced with the `digests` form field (a
+    JSON object filename -> digest) and the `input_digest` form field.
+    """
+    parts = read_multipart_upload(
+        max_file_size=current_app.config["CMS_MAX_FILE_SIZE"],
+        max_total_size=current_app.config["CMS_MAX_UPLOAD_SIZE"],
     )
-    if q.count() >= 4:
-        raise AOIBadRequest("Too many requests", error_code=ERROR_THROTTLED)
+    fields: Dict[str, str] = {}
+    files: List[_UploadFile] = []
+    input_file: Optional[_UploadFile] = None
+    for part in parts:
+        if part.filename is None:
+            try:
+                fields[part.name] = part.content.decode()
+            except UnicodeDecodeError:
+                raise AOIBadRequest(f"Field {part.name} is not valid UTF-8.")
+            continue
+        upload = _UploadFile(
+            filename=part.filename, content=part.content, digest=part.digest
+        )
+        if part.name == KEY_FILES:
+            files.append(upload)
+        elif part.name == KEY_INPUT:
+            input_file = upload
+        else:
+            raise AOIBadRequest(f"Unexpected file field {part.name}.")
+    if KEY_LANGUAGE not in fields:
+        raise AOIBadRequest("Field language is required.")
+    if KEY_DIGESTS in fields:
+        # files the client only references by digest, as {filename: digest}
+        try:
+            digests = vol.Schema({str: _DIGEST_SCHEMA})(
+                json.loads(fields[KEY_DIGESTS])
+            )
+        except (ValueError, vol.Invalid):
+            raise AOIBadRequest(
+                "Field digests is not valid.", error_code=ERROR_VALIDATION_ERROR
+            )
+        for filename, digest in digests.items():
+            files.append(_UploadFile(filename=filename, content=None, digest=digest))
+    if KEY_INPUT_DIGEST in fields:
+        try:
+            digest = _DIGEST_SCHEMA(fields[KEY_INPUT_DIGEST])
+        except vol.Invalid:
+            raise AOIBadRequest(
+                "Field input_digest is not valid.", error_code=ERROR_VALIDATION_ERROR
+            )
+        input_file = _UploadFile(filename=KEY_INPUT, content=None, digest=digest)
+    return fields, files, input_file
 
+
+def _store_submission(language: str, files: List[_UploadFile]) -> Submission:
+    now = datetime.datetime.utcnow()
     sub = Submission(
         uuid=str(uuid4()),
         participation_id=current_participation.id,
         task_id=current_task.id,
         timestamp=now,
-        language=data[KEY_LANGUAGE],
+        language=language,
         official=(
             current_contest.phase(now) == 0
             or (
@@ -828,17 +1240,44 @@ def submit(data, contest_name: str, task_name: str):
         ),
     )
     session.add(sub)  # type: ignore
-    for file in data[KEY_FILES]:
-        fname = file[KEY_FILENAME]
-        content = base64.b64decode(file[KEY_CONTENT])
-        descr = f"Submission file {fname} from {current_participation.user.username} and task {current_task.name}"
+    digests = create_files(
+        [
+            NewFile(
+                content=file.content,
+                description=f"Submission file {file.filename} from {current_participation.username} and task {current_task.name}",
+                digest=file.digest,
+            )
+            for file in files
+        ],
+        participation_id=current_participation.id,
+    )
+    for file, digest in zip(files, digests):
         f = File(
             submission=sub,
-            filename=fname,
-            digest=create_file(content, descr),
+            filename=file.filename,
+            digest=digest,
         )
         session.add(f)  # type: ignore
     session.commit()  # type: ignore
+    return sub
+
+
+def _create_submission(language: str, files: List[_UploadFile]):
+    allow_partial = current_task.task_type == "OutputOnly"
+    expected_format = set(current_task.submission_format)
+    set_format = set(x.filename for x in files)
+    if not allow_partial and (expected_format - set_format):
+        raise AOIBadRequest("At least one file missing.")
+    if set_format - expected_format:
+        raise AOIBadRequest("At least one file doesn't match submission format.")
+    if language not in current_contest.languages:
+        raise AOIBadRequest("Language not allowed.")
+
+    pid = current_participation.id
+    with ratelimit.reserve(ratelimit.LIMIT_SUBMIT, pid) as allowed:
+        if not allowed:
+            raise AOIBadRequest("Too many requests", error_code=ERROR_THROTTLED)
+        sub = _store_submission(language, files)
 
     try:
         send_sub_to_evaluation_service(sub.id)
@@ -855,54 +1294,86 @@ def submit(data, contest_name: str, task_name: str):
 
 
 @cmsmirror_bp.route(
-    "/api/cms/contest/<contest_name>/task/<task_name>/eval", methods=["POST"]
+    "/api/cms/contest/<contest_name>/task/<task_name>/submit", methods=["POST"]
 )
 @login_required
 @active_contest_required
 @json_api(
     {
         vol.Required(KEY_LANGUAGE): str,
-        vol.Required(KEY_FILES): [
-            {
-                vol.Required(KEY_FILENAME): str,
-                vol.Required(KEY_CONTENT): vol.All(str, _base64_content),
-            }
-        ],
-        vol.Required(KEY_INPUT): vol.All(str, _base64_content),
+        vol.Required(KEY_FILES): [_file_schema()],
     }
 )
-def user_eval(data, contest_name: str, task_name: str):
+def submit(data, contest_name: str, task_name: str):
+    return _create_submission(
+        data[KEY_LANGUAGE],
+        [_json_upload_file(file) for file in data[KEY_FILES]],
+    )
+
+
+@cmsmirror_bp.route(
+    "/api/cms/contest/<contest_name>/task/<task_name>/submit-multipart",
+    methods=["POST"],
+)
+@login_required
+@active_contest_required
+@json_api()
+def submit_multipart(contest_name: str, task_name: str):
+    fields, files, _ = _read_multipart_files()
+    return _create_submission(fields[KEY_LANGUAGE], files)
+
+
+def _store_user_eval(
+    language: str, files: List[_UploadFile], input_file: _UploadFile
+) -> UserEval:
     now = datetime.datetime.utcnow()
-    q = (
-        session.query(UserEval)  # type: ignore
-        .filter(UserEval.participation_id == current_participation.id)
-        .filter(UserEval.timestamp >= now - datetime.timedelta(seconds=10))
+    username = current_participation.username
+    input_digest, *digests = create_files(
+        [
+            NewFile(
+                content=input_file.content,
+                description=f"Input for user eval from {username}",
+                digest=input_file.digest,
+            )
+        ]
+        + [
+            NewFile(
+                content=file.content,
+                description=f"User eval file {file.filename} from {username} and task {current_task.name}",
+                digest=file.digest,
+            )
+            for file in files
+        ],
+        participation_id=current_participation.id,
     )
-    if q.count() >= 4:
-        raise AOIBadRequest("Too many requests", error_code=ERROR_THROTTLED)
     ueval = UserEval(
         uuid=str(uuid4()),
         participation_id=current_participation.id,
         task_id=current_task.id,
         timestamp=now,
-        language=data[KEY_LANGUAGE],
-        input=create_file(
-            base64.b64decode(data[KEY_INPUT]),
-            f"Input for user eval from {current_participation.user.username}",
-        ),
+        language=language,
+        input=input_digest,
     )
     session.add(ueval)  # type: ignore
-    for file in data[KEY_FILES]:
-        fname = file[KEY_FILENAME]
-        content = base64.b64decode(file[KEY_CONTENT])
-        descr = f"User eval file {fname} from {current_participation.user.username} and task {current_task.name}"
+    for file, digest in zip(files, digests):
         f = UserEvalFile(
             user_eval=ueval,
-            filename=fname,
-            digest=create_file(content, descr),
+            filename=file.filename,
+            digest=digest,
         )
         session.add(f)  # type: ignore
     session.commit()  # type: ignore
+    return ueval
+
+
+def _create_user_eval(
+    language: str, files: List[_UploadFile], input_file: _UploadFile
+):
+    pid = current_participation.id
+    with ratelimit.reserve(ratelimit.LIMIT_USER_EVAL, pid) as allowed:
+        if not allowed:
+            raise AOIBadRequest("Too many requests", error_code=ERROR_THROTTLED)
+        ueval = _store_user_eval(language, files, input_file)
 
     try:
         send_user_eval_to_evaluation_service(ueval.id)
@@ -917,6 +1388,50 @@ def user_eval(data, contest_name: str, task_name: str):
     }
 
 
+@cmsmirror_bp.route(
+    "/api/cms/contest/<contest_name>/task/<task_name>/eval", methods=["POST"]
+)
+@login_required
+@active_contest_required
+@json_api(
+    {
+        vol.Required(KEY_LANGUAGE): str,
+        vol.Required(KEY_FILES): [_file_schema()],
+        vol.Exclusive(KEY_INPUT, "input"): vol.All(str, _base64_content),
+        vol.Exclusive(KEY_INPUT_DIGEST, "input"): _DIGEST_SCHEMA,
+    }
+)
+def user_eval(data, contest_name: str, task_name: str):
+    if KEY_INPUT not in data and KEY_INPUT_DIGEST not in data:
+        raise AOIBadRequest(
+            "Either input or input_digest is required.",
+            error_code=ERROR_VALIDATION_ERROR,
+        )
+    return _create_user_eval(
+        data[KEY_LANGUAGE],
+        [_json_upload_file(file) for file in data[KEY_FILES]],
+        _UploadFile(
+            filename=KEY_INPUT,
+            content=data.get(KEY_INPUT),
+            digest=data.get(KEY_INPUT_DIGEST),
+        ),
+    )
+
+
+@cmsmirror_bp.route(
+    "/api/cms/contest/<contest_name>/task/<task_name>/eval-multipart",
+    methods=["POST"],
+)
+@login_required
+@active_contest_required
+@json_api()
+def user_eval_multipart(contest_name: str, task_name: str):
+    fields, files, input_file = _read_multipart_files()
+    if input_file is None:
+        raise AOIBadRequest("File input is required.")
+    return _create_user_eval(fields[KEY_LANGUAGE], files, input_file)
+
+
 @cmsmirror_bp.route(
     "/api/cms/contest/<contest_name>/task/<task_name>/user-eval/<user_eval_uuid>"
 )
@@ -1002,6 +1517,7 @@ def _check_dt_isoformat(value):
 )
 @login_required
 @json_api({vol.Optional(KEY_LAST_NOTIFICAITON): _check_dt_isoformat})
+@replica_read
 def check_notifications(data, contest_name: str):
     if KEY_LAST_NOTIFICAITON in data:
         last_notification = as_utc(
@@ -1009,6 +1525,27 @@ def check_notifications(data, contest_name: str):
         )
     else:
         last_notification = as_utc(datetime.datetime.utcfromtimestamp(0))
+    version = (
+        current_participation.id,
+        last_notification.isoformat(),
+        _scalars(
+            session.query(func.max(Announcement.timestamp)).filter(  # type: ignore
+                Announcement.contest_id == current_contest.id
+            ),
+            session.query(func.max(Message.timestamp)).filter(  # type: ignore
+                Message.participation_id == current_participation.id
+            ),
+            session.query(func.max(Question.reply_timestamp)).filter(  # type: ignore
+                Question.participation_id == current_participation.id
+            ),
+        ),
+    )
+    return versioned_json(
+        version, lambda: _render_notifications(last_notification)
+    )
+
+
+def _render_notifications(last_notification: datetime.datetime) -> dict:
     q = (
         session.query(Contest.id, Announcement, Message, Question)  # type: ignore
         .join(Contest.participations)
@@ -0,0 +1,161 @@
+"""Optional compression of responses.
+
+Off by default, usually nginx compresses responses. When enabled, responses
+with a compressible mimetype and at least ``min_size`` bytes are compressed
+with the best encoding the client accepts: zstd and brotli if the
+``zstandard``/``brotli`` packages are installed, and gzip.
+
+Compressed responses get a weak ETag (like nginx does), so conditional
+requests keep working with the validator of the uncompressed body. Bodies of
+responses with a strong ETag are cached per (ETag, encoding), so a file or a
+ranking that many clients download is only compressed once per worker.
+"""
+
+import collections
+import gzip
+import threading
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional, Tuple
+
+from flask import Flask, Response, current_app, request
+
+from aoiportal.metrics import record_cache, register_cache
+
+ENCODING_ZSTD = "zstd"
+ENCODING_BROTLI = "br"
+ENCODING_GZIP = "gzip"
+
+_COMPRESSIBLE_MIMETYPES = {
+    "application/json",
+    "application/x-ndjson",
+    "application/javascript",
+    "application/xml",
+    "image/svg+xml",
+}
+# Files sent with send_file are read into memory to compress them
+_MAX_FILE_SIZE = 8 * 1024 * 1024
+
+Encoder = Callable[[bytes], bytes]
+
+
+def _available_encoders() -> Dict[str, Encoder]:
+    """Encoders in order of preference."""
+    encoders: Dict[str, Encoder] = {}
+    try:
+        import zstandard  # type: ignore
+
+        encoders[ENCODING_ZSTD] = zstandard.ZstdCompressor(level=3).compress
+    except ImportError:
+        pass
+    try:
+        import brotli  # type: ignore
+
+        encoders[ENCODING_BROTLI] = lambda data: brotli.compress(data, quality=5)
+    except ImportError:
+        pass
+    encoders[ENCODING_GZIP] = lambda data: gzip.compress(data, compresslevel=6, mtime=0)
+    return encoders
+
+
+class CompressedCache:
+    """LRU cache of compressed bodies, bounded by their total size."""
+
+    def __init__(self, max_size: int) -> None:
+        self._max_size = max_size
+        self._size = 0
+        self._data: "collections.OrderedDict[Tuple[str, str], bytes]" = (
+            collections.OrderedDict()
+        )
+        self._lock = threading.Lock()
+        register_cache("compressed", self)
+
+    def get(self, key: Tuple[str, str]) -> Optional[bytes]:
+        with self._lock:
+            body = self._data.get(key)
+            if body is not None:
+                self._data.move_to_end(key)
+        record_cache("compressed", body is not None)
+        return body
+
+    def put(self, key: Tuple[str, str], body: bytes) -> None:
+        if len(body) > self._max_size:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+            self._data[key] = body
+            self._size += len(body)
+            while self._size > self._max_size:
+                _, evicted = self._data.popitem(last=False)
+                self._size -= len(evicted)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+
+@dataclass
+class Compressor:
+    encoders: Dict[str, Encoder]
+    min_size: int
+    cache: CompressedCache
+
+    def compress(self, resp: Response) -> Response:
+        if resp.status_code != 200 or "Content-Encoding" in resp.headers:
+            return resp
+        mimetype = resp.mimetype or ""
+        if not (mimetype.startswith("text/") or mimetype in _COMPRESSIBLE_MIMETYPES):
+            return resp
+        if resp.direct_passthrough:
+            # send_file, compress only if the size is known and small enough
+            if resp.content_length is None or resp.content_length > _MAX_FILE_SIZE:
+                return resp
+            resp.direct_passthrough = False
+        elif resp.is_streamed:
+            return resp
+
+        resp.vary.add("Accept-Encoding")
+        data = resp.get_data()
+        if len(data) < self.min_size:
+            return resp
+        encoding = request.accept_encodings.best_match(list(self.encoders))
+        if encoding is None:
+            return resp
+
+        etag, weak = resp.get_etag()
+        key = (etag, encoding) if etag is not None and not weak else None
+        body = self.cache.get(key) if key is not None else None
+        if body is None:
+            body = self.encoders[encoding](data)
+            if key is not None:
+                self.cache.put(key, body)
+        if len(body) >= len(data):
+            return resp
+
+        resp.set_data(body)
+        resp.headers["Content-Encoding"] = encoding
+        # ranges would refer to the uncompressed body
+        resp.headers.pop("Accept-Ranges", None)
+        if etag is not None:
+            resp.set_etag(etag, weak=True)
+        return resp
+
+
+def _after_request(resp: Response) -> Response:
+    compressor: Compressor = current_app.extensions["compression"]
+    return compressor.compress(resp)
+
+
+def init_app(app: Flask) -> None:
+    if not app.config.get("COMPRESSION_ENABLED", False):
+        return
+    app.extensions["compression"] = Compressor(
+        encoders=_available_encoders(),
+        min_size=app.config["COMPRESSION_MIN_SIZE"],
+        cache=CompressedCache(app.config["COMPRESSION_CACHE_SIZE"]),
+    )
+    app.after_request(_after_request)
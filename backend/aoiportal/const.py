@@ -29,6 +29,7 @@ KEY_RANDOM_MANUAL_PASSWORDS = "random_manual_passwords"
 KEY_CMS_USERNAME = "cms_username"
 KEY_URL = "url"
 KEY_UUID = "uuid"
+KEY_UUIDS = "uuids"
 KEY_VERIFICATION_CODE = "verification_code"
 KEY_TOKEN = "token"
 KEY_CODE = "code"
@@ -48,7 +49,12 @@ KEY_FILES = "files"
 KEY_INPUT = "input"
 KEY_TASK = "task"
 KEY_FILENAME = "filename"
+KEY_DIGEST = "digest"
+KEY_DIGESTS = "digests"
+KEY_MISSING = "missing"
+KEY_INPUT_DIGEST = "input_digest"
 KEY_LAST_NOTIFICAITON = "last_notification"
+KEY_VERSION = "version"
 KEY_TASK_ID = "task_id"
 KEY_CONTEST_ID = "contest_id"
 KEY_PARTICIPATION_ID = "participation_id"
@@ -74,3 +80,42 @@ KEY_SESSION_TOKEN_KEY = "session_token_key"
 KEY_DEBUG = "debug"
 KEY_BASE_URL = "base_url"
 KEY_PROXY_AUTH_PUBLIC_KEY = "proxy_auth_public_key"
+KEY_RATE_LIMIT = "rate_limit"
+KEY_BACKEND = "backend"
+KEY_REDIS_URL = "redis_url"
+KEY_LIMITS = "limits"
+KEY_LIMIT = "limit"
+KEY_PERIOD = "period"
+KEY_MAX_FILE_SIZE = "max_file_size"
+KEY_MAX_UPLOAD_SIZE = "max_upload_size"
+KEY_COMPRESSION = "compression"
+KEY_ENABLED = "enabled"
+KEY_MIN_SIZE = "min_size"
+KEY_CACHE_SIZE = "cache_size"
+KEY_JSON = "json"
+KEY_ENCODER = "encoder"
+KEY_METRICS = "metrics"
+KEY_LOCAL_ACCESS = "local_access"
+KEY_MULTIPROCESS_DIR = "multiprocess_dir"
+KEY_SQL_PROFILER = "sql_profiler"
+KEY_N_PLUS_ONE_THRESHOLD = "n_plus_one_threshold"
+KEY_KEEP_REPORTS = "keep_reports"
+KEY_SERVER_TIMING = "server_timing"
+KEY_HEADER = "header"
+KEY_ENDPOINT = "endpoint"
+KEY_MODE = "mode"
+KEY_RATE = "rate"
+KEY_REQUESTS = "requests"
+KEY_FRAMES = "frames"
+KEY_DATABASE_POOL = "database_pool"
+KEY_POOL_SIZE = "pool_size"
+KEY_MAX_OVERFLOW = "max_overflow"
+KEY_POOL_TIMEOUT = "pool_timeout"
+KEY_POOL_RECYCLE = "pool_recycle"
+KEY_PRE_PING = "pre_ping"
+KEY_STATEMENT_TIMEOUT = "statement_timeout"
+KEY_APPLICATION_NAME = "application_name"
+KEY_REPLICA = "replica"
+KEY_MAX_LAG = "max_lag"
+KEY_READ_ONLY = "read_only"
+KEY_AUTOCOMMIT = "autocommit"
@@ -8,7 +8,13 @@ from flask import Blueprint
 from sqlalchemy import and_  # type: ignore
 from sqlalchemy.exc import IntegrityError  # type: ignore
 
-from aoiportal.auth_util import get_current_user, get_proxy_contest, is_proxy_auth, login_required
+from aoiportal.auth_util import (
+    get_current_auth_user,
+    get_current_user,
+    get_proxy_contest,
+    is_proxy_auth,
+    login_required,
+)
 from aoiportal.error import AOIConflict, AOIForbidden, AOINotFound
 from aoiportal.helpers import create_participation
 from aoiportal.models import Contest, Participation, db  # type: ignore
@@ -23,13 +29,14 @@ contests_bp = Blueprint("contests", __name__)
 @json_api()
 def list_contests():
     proxy_contest = get_proxy_contest() if is_proxy_auth() else None
+    auth_user = get_current_auth_user()
     q = (
         db.session.query(Contest, Participation)
         .join(
             Participation,
             and_(
                 Contest.id == Participation.contest_id,
-                Participation.user_id == get_current_user().id,
+                Participation.user_id == auth_user.id,
             ),
             isouter=True,
         )
@@ -43,7 +50,7 @@ def list_contests():
         joined = part is not None
         can_join = False
         if not joined:
-            can_join = contest.open_signup or get_current_user().is_admin
+            can_join = contest.open_signup or auth_user.is_admin
         if not joined and not can_join:
             continue
 
@@ -53,7 +60,7 @@ def list_contests():
             "teaser": contest.teaser,
             "description": contest.description,
             "joined": joined,
-            "open_signup": contest.open_signup or get_current_user().is_admin,
+            "open_signup": contest.open_signup or auth_user.is_admin,
             "quali_round": contest.quali_round,
             "order_priority": contest.order_priority,
             "archived": contest.archived,
@@ -68,7 +75,7 @@ def list_contests():
             value["sso_enabled"] = sso_enabled
             value["cms_name"] = contest.cms_name
             value["allow_frontendv2"] = (
-                contest.cms_allow_frontendv2 or get_current_user().is_admin
+                contest.cms_allow_frontendv2 or auth_user.is_admin
             )
 
         ret.append(value)
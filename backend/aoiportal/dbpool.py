@@ -0,0 +1,91 @@
+"""Connection pool and session settings of the portal and CMS engines.
+
+Both engines are created from a ``database_pool`` config section (top level
+for the portal, in ``cms`` for the CMS database) through `engine_options`.
+The pool settings apply to the QueuePool used for PostgreSQL and MySQL,
+``statement_timeout`` and ``application_name`` are set on every PostgreSQL
+connection (so slow statements are cancelled by the server and the
+connections of each worker can be told apart in ``pg_stat_activity``).
+SQLite databases (development) keep the defaults of the driver.
+
+The pool measures how long each checkout waits for a connection (including
+opening a new one) in ``aoiportal_db_pool_checkout_wait_seconds`` and counts
+checkouts that ran into ``pool_timeout``, so pool exhaustion shows up in the
+metrics before it shows up as slow requests.
+"""
+
+import time
+from typing import Any, Dict, Optional, Type
+
+from sqlalchemy import exc  # type: ignore
+from sqlalchemy.engine import make_url  # type: ignore
+from sqlalchemy.pool import QueuePool  # type: ignore
+
+from aoiportal.const import (
+    KEY_APPLICATION_NAME,
+    KEY_MAX_OVERFLOW,
+    KEY_POOL_RECYCLE,
+    KEY_POOL_SIZE,
+    KEY_POOL_TIMEOUT,
+    KEY_PRE_PING,
+    KEY_STATEMENT_TIMEOUT,
+)
+from aoiportal.metrics import POOL_CHECKOUT_TIMEOUTS, POOL_CHECKOUT_WAIT
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that observes the checkout wait time of the engine `db`."""
+
+    db = ""
+
+    def _do_get(self):
+        labels = (self.db,)
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            POOL_CHECKOUT_TIMEOUTS.inc(labels)
+            raise
+        finally:
+            POOL_CHECKOUT_WAIT.observe(time.perf_counter() - start, labels)
+
+
+def _pool_class(db: str) -> Type[TimedQueuePool]:
+    # a class per engine, the pool recreates itself with its own class
+    return type(f"TimedQueuePool_{db}", (TimedQueuePool,), {"db": db})
+
+
+def _postgres_connect_args(
+    statement_timeout: Optional[float], application_name: Optional[str]
+) -> Dict[str, Any]:
+    connect_args: Dict[str, Any] = {}
+    if statement_timeout is not None:
+        milliseconds = int(statement_timeout * 1000)
+        connect_args["options"] = f"-c statement_timeout={milliseconds}"
+    if application_name is not None:
+        connect_args["application_name"] = application_name
+    return connect_args
+
+
+def engine_options(database_uri: str, conf: dict, db: str) -> Dict[str, Any]:
+    """Keyword arguments for create_engine from a database_pool section."""
+    backend = make_url(database_uri).get_backend_name()
+    if backend == "sqlite":
+        return {}
+    options: Dict[str, Any] = {
+        "poolclass": _pool_class(db),
+        "pool_size": conf[KEY_POOL_SIZE],
+        "max_overflow": conf[KEY_MAX_OVERFLOW],
+        "pool_timeout": conf[KEY_POOL_TIMEOUT],
+        "pool_recycle": (
+            conf[KEY_POOL_RECYCLE] if conf[KEY_POOL_RECYCLE] is not None else -1
+        ),
+        "pool_pre_ping": conf[KEY_PRE_PING],
+    }
+    if backend == "postgresql":
+        connect_args = _postgres_connect_args(
+            conf[KEY_STATEMENT_TIMEOUT], conf[KEY_APPLICATION_NAME]
+        )
+        if connect_args:
+            options["connect_args"] = connect_args
+    return options
@@ -14,6 +14,8 @@ ERROR_NO_LONGER_VALID = "no_longer_valid"
 ERROR_TOO_MANY_ATTEMPTS = "too_many_attempts"
 ERROR_INVALID_VERIFICATION_CODE = "invalid_verification_code"
 ERROR_THROTTLED = "throttled"
+ERROR_FILE_TOO_LARGE = "file_too_large"
+ERROR_UNKNOWN_DIGEST = "unknown_digest"
 
 
 class _AOIHTTPError(Exception):
@@ -69,6 +71,12 @@ class AOIConflict(_AOIHTTPError):
     status_code = 409
 
 
+class AOIRequestEntityTooLarge(_AOIHTTPError):
+    """A 413 Request Entity Too Large HTTP error."""
+
+    status_code = 413
+
+
 class AOITooManyRequests(_AOIHTTPError):
     """A 429 Too Many Requests HTTP error."""
 
@@ -5,30 +5,75 @@ import voluptuous as vol  # type: ignore
 from flask import Flask
 from yaml import safe_load  # type: ignore
 
-from aoiportal import error
+from aoiportal import (
+    compression,
+    dbpool,
+    error,
+    jsonprovider,
+    memprofile,
+    metrics,
+    profiler,
+    ratelimit,
+    sqlprofile,
+    timing,
+)
 from aoiportal.admin import admin_bp
 from aoiportal.auth import auth_bp
 from aoiportal.bot import bot_bp
 from aoiportal.const import (
+    KEY_APPLICATION_NAME,
+    KEY_AUTOCOMMIT,
+    KEY_BACKEND,
     KEY_BASE_URL,
     KEY_BOT_SECRET,
+    KEY_CACHE_SIZE,
     KEY_CLIENT_ID,
     KEY_CLIENT_SECRET,
     KEY_CMS,
+    KEY_COMPRESSION,
+    KEY_DATABASE_POOL,
     KEY_DATABASE_URI,
     KEY_DEBUG,
     KEY_DEFAULT_SENDER,
     KEY_DISCORD_OAUTH,
+    KEY_ENABLED,
+    KEY_ENCODER,
     KEY_EVALUATION_SERVICE,
     KEY_GITHUB_OAUTH,
     KEY_GOOGLE_OAUTH,
+    KEY_HEADER,
     KEY_HOST,
+    KEY_JSON,
+    KEY_KEEP_REPORTS,
+    KEY_LIMIT,
+    KEY_LIMITS,
+    KEY_LOCAL_ACCESS,
     KEY_MAIL,
+    KEY_MAX_FILE_SIZE,
+    KEY_MAX_LAG,
+    KEY_MAX_OVERFLOW,
+    KEY_MAX_UPLOAD_SIZE,
+    KEY_METRICS,
+    KEY_MIN_SIZE,
+    KEY_MULTIPROCESS_DIR,
+    KEY_N_PLUS_ONE_THRESHOLD,
     KEY_PASSWORD,
+    KEY_PERIOD,
+    KEY_POOL_RECYCLE,
+    KEY_POOL_SIZE,
+    KEY_POOL_TIMEOUT,
     KEY_PORT,
+    KEY_PRE_PING,
     KEY_PROXY_AUTH_PUBLIC_KEY,
+    KEY_RATE_LIMIT,
+    KEY_READ_ONLY,
+    KEY_REDIS_URL,
+    KEY_REPLICA,
     KEY_SECRET_KEY,
+    KEY_SERVER_TIMING,
     KEY_SESSION_TOKEN_KEY,
+    KEY_SQL_PROFILER,
+    KEY_STATEMENT_TIMEOUT,
     KEY_USE_TLS,
     KEY_USERNAME,
 )
@@ -38,6 +83,35 @@ from aoiportal.newsletter import newsletter_bp
 from aoiportal.oauth import oauth_bp
 from aoiportal.profile import profile_bp
 
+
+def _validate_rate_limit(value):
+    if value[KEY_BACKEND] == ratelimit.BACKEND_REDIS and value[KEY_REDIS_URL] is None:
+        raise vol.Invalid("redis_url is required for the redis rate limit backend")
+    return value
+
+
+def _database_pool_schema(application_name: str):
+    return vol.Schema(
+        {
+            vol.Optional(KEY_POOL_SIZE, default=5): vol.All(int, vol.Range(min=1)),
+            vol.Optional(KEY_MAX_OVERFLOW, default=10): vol.All(int, vol.Range(min=0)),
+            vol.Optional(KEY_POOL_TIMEOUT, default=30): vol.All(
+                vol.Coerce(float), vol.Range(min=0)
+            ),
+            vol.Optional(KEY_POOL_RECYCLE, default=None): vol.Any(
+                None, vol.All(int, vol.Range(min=1))
+            ),
+            vol.Optional(KEY_PRE_PING, default=False): bool,
+            vol.Optional(KEY_STATEMENT_TIMEOUT, default=None): vol.Any(
+                None, vol.All(vol.Coerce(float), vol.Range(min=0, min_included=False))
+            ),
+            vol.Optional(KEY_APPLICATION_NAME, default=application_name): vol.Any(
+                None, str
+            ),
+        }
+    )
+
+
 CONFIG_SCHEMA = vol.Schema(
     {
         vol.Required(KEY_DATABASE_URI): str,
@@ -45,6 +119,13 @@ CONFIG_SCHEMA = vol.Schema(
         vol.Required(KEY_SESSION_TOKEN_KEY): str,
         vol.Optional(KEY_DEBUG, default=False): bool,
         vol.Optional(KEY_BASE_URL, default=None): vol.Any(None, str),
+        vol.Optional(KEY_DATABASE_POOL, default={}): _database_pool_schema("aoiportal"),
+        vol.Optional(KEY_READ_ONLY, default={}): vol.Schema(
+            {
+                vol.Optional(KEY_ENABLED, default=False): bool,
+                vol.Optional(KEY_AUTOCOMMIT, default=False): bool,
+            }
+        ),
         vol.Optional(KEY_MAIL): vol.Schema(
             {
                 vol.Optional(KEY_HOST, default="localhost"): str,
@@ -77,15 +158,100 @@ CONFIG_SCHEMA = vol.Schema(
         vol.Optional(KEY_CMS): vol.Schema(
             {
                 vol.Required(KEY_DATABASE_URI): str,
+                vol.Optional(KEY_DATABASE_POOL, default={}): _database_pool_schema(
+                    "aoiportal-cms"
+                ),
+                vol.Optional(KEY_REPLICA): vol.Schema(
+                    {
+                        vol.Required(KEY_DATABASE_URI): str,
+                        vol.Optional(KEY_MAX_LAG, default=5): vol.All(
+                            vol.Coerce(float), vol.Range(min=0)
+                        ),
+                        vol.Optional(
+                            KEY_DATABASE_POOL, default={}
+                        ): _database_pool_schema("aoiportal-cms-replica"),
+                    }
+                ),
                 vol.Optional(KEY_EVALUATION_SERVICE, default={}): vol.Schema(
                     {
                         vol.Optional(KEY_HOST, default="localhost"): str,
                         vol.Optional(KEY_PORT, default=25000): int,
                     }
                 ),
+                vol.Optional(KEY_MAX_FILE_SIZE, default=10 * 1024 * 1024): int,
+                vol.Optional(KEY_MAX_UPLOAD_SIZE, default=32 * 1024 * 1024): int,
             }
         ),
         vol.Optional(KEY_PROXY_AUTH_PUBLIC_KEY): str,
+        vol.Optional(KEY_RATE_LIMIT, default={}): vol.All(
+            vol.Schema(
+                {
+                    vol.Optional(KEY_BACKEND, default=ratelimit.BACKEND_MEMORY): vol.In(
+                        [ratelimit.BACKEND_MEMORY, ratelimit.BACKEND_REDIS]
+                    ),
+                    vol.Optional(KEY_REDIS_URL, default=None): vol.Any(None, str),
+                    vol.Optional(KEY_LIMITS, default={}): {
+                        vol.In(list(ratelimit.DEFAULT_LIMITS)): vol.Schema(
+                            {
+                                vol.Required(KEY_LIMIT): vol.All(int, vol.Range(min=1)),
+                                vol.Required(KEY_PERIOD): vol.All(
+                                    vol.Coerce(float), vol.Range(min=0)
+                                ),
+                            }
+                        )
+                    },
+                }
+            ),
+            _validate_rate_limit,
+        ),
+        vol.Optional(KEY_COMPRESSION, default={}): vol.Schema(
+            {
+                vol.Optional(KEY_ENABLED, default=False): bool,
+                vol.Optional(KEY_MIN_SIZE, default=1024): vol.All(
+                    int, vol.Range(min=0)
+                ),
+                vol.Optional(KEY_CACHE_SIZE, default=16 * 1024 * 1024): vol.All(
+                    int, vol.Range(min=0)
+                ),
+            }
+        ),
+        vol.Optional(KEY_JSON, default={}): vol.Schema(
+            {
+                vol.Optional(KEY_ENCODER, default=jsonprovider.ENCODER_AUTO): vol.In(
+                    [
+                        jsonprovider.ENCODER_AUTO,
+                        jsonprovider.ENCODER_ORJSON,
+                        jsonprovider.ENCODER_STDLIB,
+                    ]
+                ),
+            }
+        ),
+        vol.Optional(KEY_METRICS, default={}): vol.Schema(
+            {
+                vol.Optional(KEY_ENABLED, default=False): bool,
+                vol.Optional(KEY_LOCAL_ACCESS, default=False): bool,
+                vol.Optional(KEY_MULTIPROCESS_DIR, default=None): vol.Any(None, str),
+            }
+        ),
+        vol.Optional(KEY_SQL_PROFILER, default={}): vol.Schema(
+            {
+                vol.Optional(KEY_ENABLED, default=False): bool,
+                vol.Optional(KEY_N_PLUS_ONE_THRESHOLD, default=5): vol.All(
+                    int, vol.Range(min=2)
+                ),
+                vol.Optional(KEY_KEEP_REPORTS, default=200): vol.All(
+                    int, vol.Range(min=1)
+                ),
+            }
+        ),
+        vol.Optional(KEY_SERVER_TIMING, default={}): vol.Schema(
+            {
+                vol.Optional(KEY_ENABLED, default=False): bool,
+                vol.Optional(KEY_HEADER, default=timing.HEADER_ADMINS): vol.In(
+                    [timing.HEADER_ADMINS, timing.HEADER_ALL]
+                ),
+            }
+        ),
     }
 )
 
@@ -109,6 +275,11 @@ def create_app(config_file: Union[Path, str]):
     app.config["BASE_URL"] = conf[KEY_BASE_URL]
     app.config["SQLALCHEMY_DATABASE_URI"] = conf[KEY_DATABASE_URI]
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = dbpool.engine_options(
+        conf[KEY_DATABASE_URI], conf[KEY_DATABASE_POOL], metrics.DB_PORTAL
+    )
+    app.config["READ_ONLY_ENABLED"] = conf[KEY_READ_ONLY][KEY_ENABLED]
+    app.config["READ_ONLY_AUTOCOMMIT"] = conf[KEY_READ_ONLY][KEY_AUTOCOMMIT]
 
     if KEY_MAIL in conf:
         app.config["MAIL_SERVER"] = conf[KEY_MAIL][KEY_HOST]
@@ -142,14 +313,57 @@ def create_app(config_file: Union[Path, str]):
 
     if KEY_CMS in conf:
         app.config["CMS_DATABASE_URI"] = conf[KEY_CMS][KEY_DATABASE_URI]
+        app.config["CMS_ENGINE_OPTIONS"] = dbpool.engine_options(
+            conf[KEY_CMS][KEY_DATABASE_URI],
+            conf[KEY_CMS][KEY_DATABASE_POOL],
+            metrics.DB_CMS,
+        )
+        if KEY_REPLICA in conf[KEY_CMS]:
+            replica = conf[KEY_CMS][KEY_REPLICA]
+            app.config["CMS_REPLICA_DATABASE_URI"] = replica[KEY_DATABASE_URI]
+            app.config["CMS_REPLICA_ENGINE_OPTIONS"] = dbpool.engine_options(
+                replica[KEY_DATABASE_URI],
+                replica[KEY_DATABASE_POOL],
+                metrics.DB_CMS_REPLICA,
+            )
+            app.config["CMS_REPLICA_MAX_LAG"] = replica[KEY_MAX_LAG]
         app.config["CMS_EVALUATION_SERVICE_HOST"] = conf[KEY_CMS][
             KEY_EVALUATION_SERVICE
         ][KEY_HOST]
         app.config["CMS_EVALUATION_SERVICE_PORT"] = conf[KEY_CMS][
             KEY_EVALUATION_SERVICE
         ][KEY_PORT]
+        app.config["CMS_MAX_FILE_SIZE"] = conf[KEY_CMS][KEY_MAX_FILE_SIZE]
+        app.config["CMS_MAX_UPLOAD_SIZE"] = conf[KEY_CMS][KEY_MAX_UPLOAD_SIZE]
+
+    app.config["RATE_LIMIT_BACKEND"] = conf[KEY_RATE_LIMIT][KEY_BACKEND]
+    app.config["RATE_LIMIT_REDIS_URL"] = conf[KEY_RATE_LIMIT][KEY_REDIS_URL]
+    app.config["RATE_LIMITS"] = {
+        name: ratelimit.RateLimit(limit=lim[KEY_LIMIT], period=lim[KEY_PERIOD])
+        for name, lim in conf[KEY_RATE_LIMIT][KEY_LIMITS].items()
+    }
+    app.config["COMPRESSION_ENABLED"] = conf[KEY_COMPRESSION][KEY_ENABLED]
+    app.config["COMPRESSION_MIN_SIZE"] = conf[KEY_COMPRESSION][KEY_MIN_SIZE]
+    app.config["COMPRESSION_CACHE_SIZE"] = conf[KEY_COMPRESSION][KEY_CACHE_SIZE]
+    app.config["JSON_ENCODER"] = conf[KEY_JSON][KEY_ENCODER]
+    app.config["METRICS_ENABLED"] = conf[KEY_METRICS][KEY_ENABLED]
+    app.config["METRICS_LOCAL_ACCESS"] = conf[KEY_METRICS][KEY_LOCAL_ACCESS]
+    app.config["METRICS_MULTIPROCESS_DIR"] = conf[KEY_METRICS][KEY_MULTIPROCESS_DIR]
+    app.config["SQL_PROFILER_ENABLED"] = conf[KEY_SQL_PROFILER][KEY_ENABLED]
+    app.config["SQL_PROFILER_N_PLUS_ONE_THRESHOLD"] = conf[KEY_SQL_PROFILER][
+        KEY_N_PLUS_ONE_THRESHOLD
+    ]
+    app.config["SQL_PROFILER_KEEP_REPORTS"] = conf[KEY_SQL_PROFILER][KEY_KEEP_REPORTS]
+    app.config["SERVER_TIMING_ENABLED"] = conf[KEY_SERVER_TIMING][KEY_ENABLED]
+    app.config["SERVER_TIMING_HEADER"] = conf[KEY_SERVER_TIMING][KEY_HEADER]
+
+    jsonprovider.init_app(app)
 
     db.init_app(app)
+    ratelimit.init_app(app)
+    compression.init_app(app)
+    profiler.init_app(app)
+    memprofile.init_app(app)
     app.register_blueprint(auth_bp)
     app.register_blueprint(profile_bp)
     app.register_blueprint(admin_bp)
@@ -168,4 +382,9 @@ def create_app(config_file: Union[Path, str]):
         app.register_blueprint(cmsmirror_bp)
         app.register_blueprint(cmsadmin_bp)
 
+    # after the CMS engine is created
+    metrics.init_app(app)
+    sqlprofile.init_app(app)
+    timing.init_app(app)
+
     return app
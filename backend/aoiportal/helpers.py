@@ -1,7 +1,8 @@
 import secrets
 from typing import Optional, cast
 
-from aoiportal import cms_bridge
+from aoiportal import cms_bridge, readonly
+from aoiportal.auth_util import invalidate_user_sessions
 from aoiportal.models import Contest, Participation, User, db  # type: ignore
 
 
@@ -14,6 +15,8 @@ def create_cms_user(user: User) -> int:
     user.cms_id = res.cms_id
     user.cms_username = res.cms_username
     db.session.commit()
+    # cached sessions still have cms_id None
+    invalidate_user_sessions(user.id)
     return user.cms_id
 
 
@@ -25,6 +28,8 @@ def create_participation(
     hidden: bool = False,
     unrestricted: bool = False,
 ) -> Participation:
+    # also called on the first (GET) request with proxy auth
+    readonly.writable()
     if user.cms_id is None:
         create_cms_user(user)
 
@@ -0,0 +1,93 @@
+"""JSON encoding of responses.
+
+`jsonify`, `json_api` and the streamed lists all encode with ``app.json``.
+With the ``orjson`` package installed it is an orjson based provider, which
+encodes the large admin lists and rankings several times faster; otherwise
+(or with ``json.encoder: stdlib``) Flask's provider on top of the stdlib
+``json`` module is used.
+
+Both providers encode the same way:
+
+- datetimes as ISO 8601 in UTC (naive datetimes are UTC, see `as_utc`),
+  instead of Flask's HTTP date format, and dates as ``YYYY-MM-DD``
+- keys are not sorted, the order of the dicts is kept
+"""
+
+import datetime
+from importlib.util import find_spec
+from typing import Any, Callable, Type, cast
+
+from flask import Flask, Response
+from flask.json.provider import DefaultJSONProvider, JSONProvider
+
+from aoiportal import timing
+from aoiportal.utils import as_utc
+
+ENCODER_AUTO = "auto"
+ENCODER_ORJSON = "orjson"
+ENCODER_STDLIB = "stdlib"
+
+
+def _default(o: Any) -> Any:
+    if isinstance(o, datetime.datetime):
+        return as_utc(o).isoformat()
+    if isinstance(o, datetime.date):
+        return o.isoformat()
+    return DefaultJSONProvider.default(o)
+
+
+class StdlibJSONProvider(DefaultJSONProvider):
+    default: Callable[[Any], Any] = staticmethod(_default)  # type: ignore
+    sort_keys = False
+
+    def response(self, *args: Any, **kwargs: Any) -> Response:
+        with timing.phase(timing.PHASE_JSON):
+            return cast(Response, super().response(*args, **kwargs))
+
+
+class OrjsonJSONProvider(JSONProvider):
+    """Provider using orjson, ``dumps`` falls back to the stdlib for options
+    orjson does not have."""
+
+    def __init__(self, app: Flask) -> None:
+        import orjson  # type: ignore
+
+        super().__init__(app)
+        self._orjson = orjson
+        # datetimes go through _default as well, so both providers agree
+        self._option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        self._fallback = StdlibJSONProvider(app)
+
+    def _dumpb(self, obj: Any, indent: bool = False) -> bytes:
+        option = self._option
+        if indent:
+            option |= self._orjson.OPT_INDENT_2
+        return self._orjson.dumps(obj, default=_default, option=option)
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        if kwargs:
+            return self._fallback.dumps(obj, **kwargs)
+        return self._dumpb(obj).decode()
+
+    def loads(self, s: Any, **kwargs: Any) -> Any:
+        if kwargs:
+            return self._fallback.loads(s, **kwargs)
+        return self._orjson.loads(s)
+
+    def response(self, *args: Any, **kwargs: Any) -> Response:
+        obj = self._prepare_response_obj(args, kwargs)
+        # pretty print in debug mode, like Flask does
+        with timing.phase(timing.PHASE_JSON):
+            body = self._dumpb(obj, indent=self._app.debug)
+        response_class = cast(Type[Response], self._app.response_class)
+        return response_class(body + b"\n", mimetype=self._fallback.mimetype)
+
+
+def init_app(app: Flask) -> None:
+    encoder: str = app.config.get("JSON_ENCODER", ENCODER_AUTO)
+    if encoder == ENCODER_AUTO:
+        encoder = ENCODER_ORJSON if find_spec("orjson") is not None else ENCODER_STDLIB
+    if encoder == ENCODER_ORJSON:
+        app.json = OrjsonJSONProvider(app)
+    else:
+        app.json = StdlibJSONProvider(app)
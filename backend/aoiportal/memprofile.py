@@ -0,0 +1,231 @@
+"""Memory report of a worker, to size the memory limits of the workers.
+
+``GET /api/admin/memory`` reports the resident size of the worker, the
+number of entries and the deep size in bytes of every registered in-process
+cache (see `metrics.register_cache`), and with ``?orm=1`` the number of
+live SQLAlchemy instances per class (leaked identity maps show up there).
+
+Allocation sites are traced with tracemalloc, which slows the worker down
+and is therefore started and stopped explicitly:
+
+- ``POST /api/admin/memory/tracemalloc`` starts tracing (``frames`` per
+  traceback), ``DELETE`` stops it and drops the snapshots
+- ``POST /api/admin/memory/snapshots`` takes a snapshot and returns its top
+  allocation sites
+- ``GET /api/admin/memory/snapshots/<id>`` returns the top sites again,
+  ``.../diff/<base_id>`` the sites that grew the most since base_id
+
+``limit`` and ``group_by`` (lineno, filename or traceback) query arguments
+select the statistics. All of this is per worker process.
+"""
+
+import collections
+import gc
+import os
+import resource
+import sys
+import tracemalloc
+import types
+from typing import Counter, Dict, List, Optional
+
+import voluptuous as vol  # type: ignore
+from flask import Blueprint, Flask, request
+
+from aoiportal.auth_util import admin_required
+from aoiportal.const import KEY_FRAMES
+from aoiportal.error import AOIBadRequest, AOINotFound
+from aoiportal.metrics import CACHES
+from aoiportal.web_utils import json_api
+
+# Snapshots kept per worker, the oldest one is dropped first
+MAX_SNAPSHOTS = 8
+DEFAULT_LIMIT = 25
+_GROUP_BY = ("lineno", "filename", "traceback")
+# Not followed when measuring caches, they are shared with everything else
+_SHARED_TYPES = (type, types.ModuleType, types.FunctionType, types.MethodType)
+
+_snapshots: Dict[int, tracemalloc.Snapshot] = collections.OrderedDict()
+_next_snapshot_id = 1
+
+
+def deep_sizeof(obj: object) -> int:
+    """Bytes of obj and everything it references (once), except classes,
+    modules and functions."""
+    seen = set()
+    total = 0
+    stack = [obj]
+    while stack:
+        o = stack.pop()
+        if id(o) in seen or isinstance(o, _SHARED_TYPES):
+            continue
+        seen.add(id(o))
+        total += sys.getsizeof(o)
+        stack.extend(gc.get_referents(o))
+    return total
+
+
+def _rss() -> Optional[int]:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _orm_instances() -> Dict[str, int]:
+    counts: Counter[str] = collections.Counter()
+    for obj in gc.get_objects():
+        if hasattr(type(obj), "_sa_class_manager"):
+            counts[type(obj).__name__] += 1
+    return dict(counts.most_common())
+
+
+memprofile_bp = Blueprint("memprofile", __name__)
+
+
+@memprofile_bp.route("/api/admin/memory")
+@admin_required
+@json_api()
+def get_memory():
+    traced = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else None
+    ret = {
+        "pid": os.getpid(),
+        "rss": _rss(),
+        # kilobytes on Linux
+        "max_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        "tracing": tracemalloc.is_tracing(),
+        "traced": (
+            {"current": traced[0], "peak": traced[1]} if traced is not None else None
+        ),
+        "snapshots": list(_snapshots),
+        "caches": {
+            name: {
+                "entries": len(cache) if hasattr(cache, "__len__") else None,
+                "bytes": deep_sizeof(cache),
+            }
+            for name, cache in sorted(CACHES.items())
+        },
+    }
+    if request.args.get("orm") == "1":
+        ret["orm_instances"] = _orm_instances()
+    return ret
+
+
+@memprofile_bp.route("/api/admin/memory/tracemalloc", methods=["POST"])
+@admin_required
+@json_api(
+    {
+        vol.Optional(KEY_FRAMES, default=1): vol.All(int, vol.Range(min=1, max=64)),
+    }
+)
+def start_tracemalloc(data):
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+    tracemalloc.start(data[KEY_FRAMES])
+    return {"success": True}
+
+
+@memprofile_bp.route("/api/admin/memory/tracemalloc", methods=["DELETE"])
+@admin_required
+@json_api()
+def stop_tracemalloc():
+    tracemalloc.stop()
+    _snapshots.clear()
+    return {"success": True}
+
+
+def _stats_args():
+    try:
+        limit = int(request.args.get("limit", DEFAULT_LIMIT))
+    except ValueError:
+        raise AOIBadRequest("limit must be an integer")
+    group_by = request.args.get("group_by", "lineno")
+    if group_by not in _GROUP_BY:
+        raise AOIBadRequest(f"group_by must be one of {', '.join(_GROUP_BY)}")
+    return limit, group_by
+
+
+def _dump_traceback(traceback: tracemalloc.Traceback) -> List[str]:
+    return [f"{frame.filename}:{frame.lineno}" for frame in traceback]
+
+
+def _dump_stat(stat: tracemalloc.Statistic) -> dict:
+    return {
+        "traceback": _dump_traceback(stat.traceback),
+        "size": stat.size,
+        "count": stat.count,
+    }
+
+
+def _dump_stat_diff(stat: tracemalloc.StatisticDiff) -> dict:
+    return {
+        "traceback": _dump_traceback(stat.traceback),
+        "size": stat.size,
+        "size_diff": stat.size_diff,
+        "count": stat.count,
+        "count_diff": stat.count_diff,
+    }
+
+
+def _get_snapshot(snapshot_id: int) -> tracemalloc.Snapshot:
+    snapshot = _snapshots.get(snapshot_id)
+    if snapshot is None:
+        raise AOINotFound("Snapshot not found")
+    return snapshot
+
+
+def _snapshot_json(snapshot_id: int) -> dict:
+    limit, group_by = _stats_args()
+    snapshot = _get_snapshot(snapshot_id)
+    stats = snapshot.statistics(group_by)
+    return {
+        "id": snapshot_id,
+        "total": sum(stat.size for stat in stats),
+        "top": [_dump_stat(stat) for stat in stats[:limit]],
+    }
+
+
+@memprofile_bp.route("/api/admin/memory/snapshots", methods=["POST"])
+@admin_required
+@json_api()
+def take_snapshot():
+    global _next_snapshot_id
+    if not tracemalloc.is_tracing():
+        raise AOIBadRequest("tracemalloc is not running")
+    snapshot = tracemalloc.take_snapshot().filter_traces(
+        [
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ]
+    )
+    snapshot_id = _next_snapshot_id
+    _next_snapshot_id += 1
+    _snapshots[snapshot_id] = snapshot
+    while len(_snapshots) > MAX_SNAPSHOTS:
+        _snapshots.pop(next(iter(_snapshots)))
+    return _snapshot_json(snapshot_id)
+
+
+@memprofile_bp.route("/api/admin/memory/snapshots/<int:snapshot_id>")
+@admin_required
+@json_api()
+def get_snapshot(snapshot_id: int):
+    return _snapshot_json(snapshot_id)
+
+
+@memprofile_bp.route("/api/admin/memory/snapshots/<int:snapshot_id>/diff/<int:base_id>")
+@admin_required
+@json_api()
+def get_snapshot_diff(snapshot_id: int, base_id: int):
+    limit, group_by = _stats_args()
+    stats = _get_snapshot(snapshot_id).compare_to(_get_snapshot(base_id), group_by)
+    return {
+        "id": snapshot_id,
+        "base_id": base_id,
+        "size_diff": sum(stat.size_diff for stat in stats),
+        "top": [_dump_stat_diff(stat) for stat in stats[:limit]],
+    }
+
+
+def init_app(app: Flask) -> None:
+    app.register_blueprint(memprofile_bp)
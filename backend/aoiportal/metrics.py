@@ -0,0 +1,428 @@
+"""Request, database and cache metrics in the Prometheus text format.
+
+When enabled, every request is counted and timed per blueprint and route,
+and the queries of the portal and CMS engines are counted and timed with
+SQLAlchemy engine events, as are the connections checked out of their
+pools. The checkout wait, large object reads and cache lookups are counted
+by the code doing them (see dbpool.py, `LO_READ_BYTES` and `record_cache`).
+
+The metrics are kept in process memory and every sample has a ``worker``
+label with the pid of its process (aggregate with ``sum without (worker)``).
+With several gunicorn workers a scrape of ``/api/metrics`` only reaches one
+of them, so configure ``multiprocess_dir``: each worker then writes its
+samples to ``<pid>.json`` there every `DUMP_INTERVAL` seconds and the
+endpoint returns the samples of all live workers.
+
+The endpoint needs an admin login, or with ``local_access`` a request from
+the loopback interface that did not come through a proxy (no
+``X-Forwarded-For``/``X-Real-IP`` header).
+"""
+
+import bisect
+import ipaddress
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from flask import Blueprint, Flask, Response, current_app, g, request
+from sqlalchemy import event  # type: ignore
+from sqlalchemy.engine import Engine  # type: ignore
+
+from aoiportal.error import ERROR_ADMIN_REQUIRED, AOIForbidden
+
+Labels = Tuple[str, ...]
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Seconds between two writes of the samples to the multiprocess directory
+DUMP_INTERVAL = 1.0
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+
+    def _format_labels(self, labels: Labels, extra: str = "") -> str:
+        parts = [
+            f'{name}="{_escape(value)}"'
+            for name, value in zip(self.label_names, labels)
+        ]
+        if extra:
+            parts.append(extra)
+        parts.append(f'worker="{os.getpid()}"')
+        return "{" + ",".join(parts) + "}"
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, label_names: Sequence[str] = ()):
+        super().__init__(name, help, label_names)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, labels: Labels = (), amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [
+            f"{self.name}{self._format_labels(labels)} {value}"
+            for labels, value in values
+        ]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, labels: Labels = (), amount: float = 1) -> None:
+        self.inc(labels, -amount)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        label_names: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, help, label_names)
+        self.buckets = tuple(buckets)
+        # per label set: counts per bucket (the last one is +Inf), sum
+        self._values: Dict[Labels, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, labels: Labels = ()) -> None:
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = ([0] * (len(self.buckets) + 1), [0.0])
+            entry[0][idx] += 1
+            entry[1][0] += value
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = [
+                (labels, list(counts), total[0])
+                for labels, (counts, total) in self._values.items()
+            ]
+        lines = []
+        for labels, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                bucket_labels = self._format_labels(labels, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{self._format_labels(labels)} {total}")
+            lines.append(f"{self.name}_count{self._format_labels(labels)} {cumulative}")
+        return lines
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+HTTP_REQUESTS = Counter(
+    "aoiportal_http_requests_total",
+    "Finished requests.",
+    ["blueprint", "route", "method", "status"],
+)
+HTTP_REQUEST_DURATION = Histogram(
+    "aoiportal_http_request_duration_seconds",
+    "Time until the response (or its first chunk for streamed responses).",
+    ["blueprint", "route", "method"],
+)
+HTTP_IN_FLIGHT = Gauge(
+    "aoiportal_http_requests_in_flight", "Requests currently being handled."
+)
+DB_QUERIES = Counter("aoiportal_db_queries_total", "Executed SQL statements.", ["db"])
+DB_QUERY_SECONDS = Counter(
+    "aoiportal_db_query_seconds_total", "Time spent executing SQL statements.", ["db"]
+)
+LO_READ_BYTES = Counter(
+    "aoiportal_lo_read_bytes_total", "Bytes read from CMS large objects."
+)
+PHASE_DURATION = Histogram(
+    "aoiportal_phase_duration_seconds",
+    "Time spent in the phases timed for Server-Timing, per call.",
+    ["phase"],
+)
+CACHE_REQUESTS = Counter(
+    "aoiportal_cache_requests_total",
+    "Cache lookups by result (hit or miss).",
+    ["cache", "result"],
+)
+POOL_CHECKOUT_WAIT = Histogram(
+    "aoiportal_db_pool_checkout_wait_seconds",
+    "Time waited for a pooled connection, including connecting.",
+    ["db"],
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30),
+)
+POOL_CHECKOUT_TIMEOUTS = Counter(
+    "aoiportal_db_pool_checkout_timeouts_total",
+    "Checkouts that gave up after pool_timeout.",
+    ["db"],
+)
+POOL_CHECKED_OUT = Gauge(
+    "aoiportal_db_pool_checked_out", "Connections currently checked out.", ["db"]
+)
+CMS_SESSIONS = Counter(
+    "aoiportal_cms_sessions_total",
+    "Requests using the CMS database with a replica configured, by database.",
+    ["target"],
+)
+
+REGISTRY: List[_Metric] = [
+    HTTP_REQUESTS,
+    HTTP_REQUEST_DURATION,
+    HTTP_IN_FLIGHT,
+    DB_QUERIES,
+    DB_QUERY_SECONDS,
+    LO_READ_BYTES,
+    PHASE_DURATION,
+    CACHE_REQUESTS,
+    POOL_CHECKOUT_WAIT,
+    POOL_CHECKOUT_TIMEOUTS,
+    POOL_CHECKED_OUT,
+    CMS_SESSIONS,
+]
+
+DB_PORTAL = "portal"
+DB_CMS = "cms"
+DB_CMS_REPLICA = "cms_replica"
+
+_HIT = ("hit",)
+_MISS = ("miss",)
+
+# In-process caches by name, for the memory report (see memprofile.py)
+CACHES: Dict[str, object] = {}
+
+
+def register_cache(name: str, cache: object) -> None:
+    CACHES[name] = cache
+
+
+def record_cache(cache: str, hit: bool) -> None:
+    CACHE_REQUESTS.inc((cache,) + (_HIT if hit else _MISS))
+
+
+def _collect() -> Dict[str, List[str]]:
+    return {metric.name: metric.samples() for metric in REGISTRY}
+
+
+def _dump(directory: Path) -> None:
+    path = directory / f"{os.getpid()}.json"
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(_collect()))
+    # readers never see a partially written file
+    os.replace(tmp, path)
+
+
+def _dump_loop(directory: Path) -> None:
+    while True:
+        time.sleep(DUMP_INTERVAL)
+        _dump(directory)
+
+
+def _is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _load_other_workers(directory: Path) -> List[Dict[str, List[str]]]:
+    workers = []
+    for path in directory.glob("*.json"):
+        if not path.stem.isdigit():
+            continue
+        pid = int(path.stem)
+        if pid == os.getpid():
+            continue
+        if not _is_alive(pid):
+            # exited or restarted worker
+            path.unlink(missing_ok=True)
+            continue
+        try:
+            workers.append(json.loads(path.read_text()))
+        except (OSError, ValueError):
+            continue
+    return workers
+
+
+def render(directory: Optional[Path] = None) -> str:
+    """The metrics of this worker, and of all workers that write to
+    `directory` if given."""
+    workers = [_collect()]
+    if directory is not None:
+        workers.extend(_load_other_workers(directory))
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.header())
+        for samples in workers:
+            lines.extend(samples.get(metric.name, []))
+    return "\n".join(lines) + "\n"
+
+
+def app_engines(app: Flask) -> Dict[str, Engine]:
+    """The engines of the app by name (the CMS ones only if configured)."""
+    from aoiportal.models import db  # type: ignore
+
+    with app.app_context():
+        engines = {DB_PORTAL: db.engine}
+    if "cms" in app.extensions:
+        cms = app.extensions["cms"]
+        engines[DB_CMS] = cms.engine
+        if cms.replica is not None:
+            engines[DB_CMS_REPLICA] = cms.replica.engine
+    return engines
+
+
+def instrument_engine(engine: Engine, db: str) -> None:
+    labels = (db,)
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, many):
+        conn.info.setdefault("aoi_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, many):
+        start = conn.info["aoi_query_start"].pop()
+        DB_QUERIES.inc(labels)
+        DB_QUERY_SECONDS.inc(labels, time.perf_counter() - start)
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(context):
+        if context.connection is None:
+            return
+        stack = context.connection.info.get("aoi_query_start")
+        if stack:
+            stack.pop()
+            DB_QUERIES.inc(labels)
+
+    @event.listens_for(engine, "checkout")
+    def checkout(dbapi_connection, connection_record, connection_proxy):
+        POOL_CHECKED_OUT.inc(labels)
+
+    @event.listens_for(engine, "checkin")
+    def checkin(dbapi_connection, connection_record):
+        POOL_CHECKED_OUT.dec(labels)
+
+
+_KEY_START = "_metrics_start"
+_KEY_IN_FLIGHT = "_metrics_in_flight"
+
+# pid of the process that runs the dump thread; the app may be created
+# before gunicorn forks the workers, so it is started on the first request
+_dumper_pid: Optional[int] = None
+_dumper_lock = threading.Lock()
+
+
+def _start_dumper() -> None:
+    global _dumper_pid
+    directory = current_app.config["METRICS_MULTIPROCESS_DIR"]
+    if directory is None or _dumper_pid == os.getpid():
+        return
+    with _dumper_lock:
+        if _dumper_pid == os.getpid():
+            return
+        _dumper_pid = os.getpid()
+        threading.Thread(
+            target=_dump_loop, args=(Path(directory),), daemon=True
+        ).start()
+
+
+def _before_request() -> None:
+    _start_dumper()
+    setattr(g, _KEY_START, time.perf_counter())
+    setattr(g, _KEY_IN_FLIGHT, True)
+    HTTP_IN_FLIGHT.inc()
+
+
+def _labels() -> Labels:
+    rule = request.url_rule
+    return (request.blueprint or "", rule.rule if rule else "", request.method)
+
+
+def _after_request(resp: Response) -> Response:
+    start = g.pop(_KEY_START, None)
+    if start is not None:
+        labels = _labels()
+        HTTP_REQUEST_DURATION.observe(time.perf_counter() - start, labels)
+        HTTP_REQUESTS.inc(labels + (str(resp.status_code),))
+    return resp
+
+
+def _teardown_request(exc) -> None:
+    if g.pop(_KEY_IN_FLIGHT, False):
+        HTTP_IN_FLIGHT.dec()
+    # after_request does not run for unhandled exceptions
+    start = g.pop(_KEY_START, None)
+    if start is not None:
+        labels = _labels()
+        HTTP_REQUEST_DURATION.observe(time.perf_counter() - start, labels)
+        HTTP_REQUESTS.inc(labels + ("500",))
+
+
+def _is_local_request() -> bool:
+    if "X-Forwarded-For" in request.headers or "X-Real-IP" in request.headers:
+        return False
+    try:
+        return ipaddress.ip_address(request.remote_addr or "").is_loopback
+    except ValueError:
+        return False
+
+
+metrics_bp = Blueprint("metrics", __name__)
+
+
+@metrics_bp.route("/api/metrics")
+def get_metrics():
+    from aoiportal.auth_util import get_current_auth_user
+
+    if not (current_app.config["METRICS_LOCAL_ACCESS"] and _is_local_request()):
+        user = get_current_auth_user()
+        if user is None or not user.is_admin:
+            raise AOIForbidden(
+                "This API needs admin access.", error_code=ERROR_ADMIN_REQUIRED
+            )
+    directory = current_app.config["METRICS_MULTIPROCESS_DIR"]
+    return Response(
+        render(Path(directory) if directory is not None else None),
+        mimetype="text/plain; version=0.0.4",
+    )
+
+
+def init_app(app: Flask) -> None:
+    if not app.config.get("METRICS_ENABLED", False):
+        return
+    directory = app.config.get("METRICS_MULTIPROCESS_DIR")
+    if directory is not None:
+        Path(directory).mkdir(parents=True, exist_ok=True)
+    for name, engine in app_engines(app).items():
+        instrument_engine(engine, name)
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+    app.register_blueprint(metrics_bp)
@@ -1,5 +1,6 @@
 # type: ignore
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session as FSASession
 from sqlalchemy import (
     Boolean,
     Column,
@@ -12,12 +13,28 @@ from sqlalchemy import (
     String,
     Table,
 )
+from sqlalchemy.engine import Engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 
+from aoiportal import readonly
+
 Base = declarative_base()
-db = SQLAlchemy(model_class=Base)
+
+
+class Session(FSASession):
+    """Runs the statements of read-only requests in read-only transactions,
+    see aoiportal.readonly."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        engine = super().get_bind(mapper, clause, bind, **kwargs)
+        if isinstance(engine, Engine):
+            return readonly.route(engine)
+        return engine
+
+
+db = SQLAlchemy(model_class=Base, session_options={"class_": Session})
 
 GroupsUsers = Table(
     "groups_users",
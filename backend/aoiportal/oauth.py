@@ -6,7 +6,7 @@ import requests
 import voluptuous as vol  # type: ignore
 from flask import Blueprint, current_app
 
-from aoiportal.auth_util import create_session, get_current_user
+from aoiportal.auth_util import create_session, get_current_auth_user
 from aoiportal.const import KEY_CODE, KEY_REDIRECT_URI
 from aoiportal.error import AOIBadRequest, AOIConflict, AOIUnauthorized
 from aoiportal.models import (  # type: ignore
@@ -48,7 +48,7 @@ def github_authorize_url():
     }
 )
 def github_auth(data):
-    if get_current_user() is not None:
+    if get_current_auth_user() is not None:
         raise AOIConflict("Already logged in")
     access_token_url = "https://github.com/login/oauth/access_token"
     payload = {
@@ -175,7 +175,7 @@ def discord_authorize_url():
 @oauth_bp.route("/api/oauth/discord/auth", methods=["POST"])
 @json_api({vol.Required(KEY_CODE): str, vol.Required(KEY_REDIRECT_URI): str})
 def discord_auth(data):
-    if get_current_user() is None:
+    if get_current_auth_user() is None:
         raise AOIUnauthorized("You are not logged in.")
 
     access_token_url = "https://discord.com/api/oauth2/token"
@@ -203,7 +203,7 @@ def discord_auth(data):
         # User already has oauth linked, do nothing
         data = json.loads(obj.extra_data)
 
-        if obj.user_id != get_current_user().id:
+        if obj.user_id != get_current_auth_user().id:
             raise AOIConflict("Discord username already linked to another account")
 
         return {
@@ -223,7 +223,7 @@ def discord_auth(data):
 
     oauth = UserDiscordOAuth(
         discord_id=user_info["id"],
-        user_id=get_current_user().id,
+        user_id=get_current_auth_user().id,
         created_at=utcnow(),
         access_token=access_token,
         token_type=js["token_type"],
@@ -273,7 +273,7 @@ def google_authorize_url():
     }
 )
 def google_auth(data):
-    if get_current_user() is not None:
+    if get_current_auth_user() is not None:
         raise AOIConflict("Already logged in")
     access_token_url = "https://oauth2.googleapis.com/token"
     payload = {
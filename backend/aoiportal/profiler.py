@@ -0,0 +1,298 @@
+"""Admin controlled sampling profiler for production requests.
+
+An admin starts a profiling session with ``POST /api/admin/profiler``,
+optionally restricted to one endpoint (e.g. ``cmsmirror.get_task``), to the
+next N requests and/or to a fraction of the requests. Sampled requests are
+profiled either with cProfile or with a statistical stack sampler (a thread
+that records the stack of the request thread every few milliseconds), and
+the results are aggregated per endpoint:
+
+- ``GET /api/admin/profiler`` shows the session and the profiled endpoints
+- ``GET /api/admin/profiler/<endpoint>/pstats`` downloads the cProfile
+  stats, load them with ``pstats.Stats(filename)`` or snakeviz
+- ``GET /api/admin/profiler/<endpoint>/collapsed`` downloads the sampled
+  stacks in the collapsed format of flamegraph.pl and speedscope
+- ``DELETE /api/admin/profiler`` stops the session and drops the results
+
+Sessions and results are per worker process, the responses include the
+pid of the worker that answered.
+"""
+
+import collections
+import cProfile
+import io
+import marshal
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Counter, Dict, Optional
+
+import voluptuous as vol  # type: ignore
+from flask import Blueprint, Flask, Response, g, request
+
+from aoiportal.auth_util import admin_required
+from aoiportal.const import KEY_ENDPOINT, KEY_MODE, KEY_RATE, KEY_REQUESTS
+from aoiportal.error import AOINotFound
+from aoiportal.web_utils import json_api
+
+MODE_CPROFILE = "cprofile"
+MODE_SAMPLE = "sample"
+
+# Interval of the stack sampler
+SAMPLE_INTERVAL = 0.005
+
+
+@dataclass
+class ProfilingSession:
+    mode: str
+    # None for all endpoints
+    endpoint: Optional[str]
+    rate: float
+    # None for no limit
+    remaining: Optional[int]
+    started: float = field(default_factory=time.time)
+
+
+@dataclass
+class EndpointProfile:
+    requests: int = 0
+    duration: float = 0.0
+    stats: Optional[pstats.Stats] = None
+    stacks: Counter[str] = field(default_factory=collections.Counter)
+
+    def to_json(self) -> dict:
+        return {
+            "requests": self.requests,
+            "duration_ms": round(self.duration * 1000, 3),
+            "pstats": self.stats is not None,
+            "samples": sum(self.stacks.values()),
+        }
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return (
+        f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    )
+
+
+class _StackSampler:
+    """Records the stacks of one thread from a background thread."""
+
+    def __init__(self, thread_id: int) -> None:
+        self._thread_id = thread_id
+        self._stop = threading.Event()
+        self.stacks: Counter[str] = collections.Counter()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> Counter[str]:
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+
+    def _run(self) -> None:
+        while not self._stop.wait(SAMPLE_INTERVAL):
+            frame = sys._current_frames().get(self._thread_id)
+            names = []
+            while frame is not None:
+                names.append(_frame_name(frame))
+                frame = frame.f_back
+            if names:
+                self.stacks[";".join(reversed(names))] += 1
+
+
+_lock = threading.Lock()
+_session: Optional[ProfilingSession] = None
+_results: Dict[str, EndpointProfile] = {}
+
+_KEY_PROFILER = "_profiler"
+_KEY_START = "_profiler_start"
+
+
+def _sample_mode(endpoint: str) -> Optional[str]:
+    """The mode to profile this request with, None to not profile it."""
+    global _session
+    with _lock:
+        session = _session
+        if session is None:
+            return None
+        if session.endpoint is not None and session.endpoint != endpoint:
+            return None
+        if session.rate < 1 and random.random() >= session.rate:
+            return None
+        if session.remaining is not None:
+            session.remaining -= 1
+            if session.remaining <= 0:
+                _session = None
+        return session.mode
+
+
+def _before_request() -> None:
+    # cheap check first, most requests are not profiled
+    if _session is None or request.endpoint is None:
+        return
+    mode = _sample_mode(request.endpoint)
+    if mode is None:
+        return
+    profiler: object
+    if mode == MODE_CPROFILE:
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # another profiler is active in this process
+            return
+    else:
+        profiler = _StackSampler(threading.get_ident())
+        profiler.start()
+    setattr(g, _KEY_PROFILER, profiler)
+    setattr(g, _KEY_START, time.perf_counter())
+
+
+def _teardown_request(exc) -> None:
+    profiler = g.pop(_KEY_PROFILER, None)
+    if profiler is None:
+        return
+    duration = time.perf_counter() - g.pop(_KEY_START)
+    stacks: Optional[Counter[str]] = None
+    if isinstance(profiler, cProfile.Profile):
+        profiler.disable()
+        profiler.create_stats()
+    else:
+        stacks = profiler.stop()
+    assert request.endpoint is not None
+    with _lock:
+        result = _results.setdefault(request.endpoint, EndpointProfile())
+        result.requests += 1
+        result.duration += duration
+        if stacks is not None:
+            result.stacks.update(stacks)
+        elif result.stats is None:
+            result.stats = pstats.Stats(profiler)
+        else:
+            result.stats.add(profiler)
+
+
+profiler_bp = Blueprint("profiler", __name__)
+
+
+def _status() -> dict:
+    with _lock:
+        session = _session
+        return {
+            "pid": os.getpid(),
+            "session": (
+                {
+                    "mode": session.mode,
+                    "endpoint": session.endpoint,
+                    "rate": session.rate,
+                    "remaining": session.remaining,
+                    "started": session.started,
+                }
+                if session is not None
+                else None
+            ),
+            "endpoints": {name: res.to_json() for name, res in _results.items()},
+        }
+
+
+@profiler_bp.route("/api/admin/profiler")
+@admin_required
+@json_api()
+def get_profiler():
+    return _status()
+
+
+@profiler_bp.route("/api/admin/profiler", methods=["POST"])
+@admin_required
+@json_api(
+    {
+        vol.Optional(KEY_MODE, default=MODE_CPROFILE): vol.In(
+            [MODE_CPROFILE, MODE_SAMPLE]
+        ),
+        vol.Optional(KEY_ENDPOINT, default=None): vol.Any(None, str),
+        vol.Optional(KEY_RATE, default=1.0): vol.All(
+            vol.Coerce(float), vol.Range(min=0, max=1, min_included=False)
+        ),
+        vol.Optional(KEY_REQUESTS, default=None): vol.Any(
+            None, vol.All(int, vol.Range(min=1))
+        ),
+    }
+)
+def start_profiler(data):
+    global _session
+    with _lock:
+        _session = ProfilingSession(
+            mode=data[KEY_MODE],
+            endpoint=data[KEY_ENDPOINT],
+            rate=data[KEY_RATE],
+            remaining=data[KEY_REQUESTS],
+        )
+    return _status()
+
+
+@profiler_bp.route("/api/admin/profiler", methods=["DELETE"])
+@admin_required
+@json_api()
+def stop_profiler():
+    global _session
+    with _lock:
+        _session = None
+        _results.clear()
+    return _status()
+
+
+def _get_result(endpoint: str) -> EndpointProfile:
+    with _lock:
+        result = _results.get(endpoint)
+    if result is None:
+        raise AOINotFound("Endpoint not profiled")
+    return result
+
+
+@profiler_bp.route("/api/admin/profiler/<endpoint>/pstats")
+@admin_required
+def get_profiler_pstats(endpoint: str):
+    result = _get_result(endpoint)
+    if result.stats is None:
+        raise AOINotFound("No cProfile stats for this endpoint")
+    with _lock:
+        # the format of pstats.Stats.dump_stats
+        data = marshal.dumps(result.stats.stats)  # type: ignore
+    return Response(
+        data,
+        mimetype="application/octet-stream",
+        headers={
+            "Content-Disposition": f"attachment; filename={endpoint}.pstats",
+        },
+    )
+
+
+@profiler_bp.route("/api/admin/profiler/<endpoint>/collapsed")
+@admin_required
+def get_profiler_collapsed(endpoint: str):
+    result = _get_result(endpoint)
+    out = io.StringIO()
+    with _lock:
+        for stack, count in result.stacks.most_common():
+            out.write(f"{stack} {count}\n")
+    return Response(
+        out.getvalue(),
+        mimetype="text/plain",
+        headers={
+            "Content-Disposition": f"attachment; filename={endpoint}.collapsed",
+        },
+    )
+
+
+def init_app(app: Flask) -> None:
+    app.before_request(_before_request)
+    app.teardown_request(_teardown_request)
+    app.register_blueprint(profiler_bp)
@@ -0,0 +1,212 @@
+"""Rate limiting for write endpoints.
+
+Limits are sliding windows ("at most `limit` hits in the last `period`
+seconds") identified by a limit name (see the ``LIMIT_*`` constants) and a
+key, for example the participation id.
+
+The default backend keeps the windows in process memory, so with several
+gunicorn workers each worker enforces the limit on its own. Configure the
+``redis`` backend to share the windows between all workers.
+
+The register, password reset and email change limits only take their limit
+and period from here, they are counted from the request rows in the database
+(see `get_limit`), so they hold across workers and restarts with any backend.
+"""
+
+import collections
+import contextlib
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Deque, Dict, Iterator
+
+from flask import Flask, current_app
+
+from aoiportal.metrics import register_cache
+
+LIMIT_SUBMIT = "submit"
+LIMIT_USER_EVAL = "user_eval"
+LIMIT_MISSING_DIGESTS = "missing_digests"
+LIMIT_REGISTER = "register"
+LIMIT_PASSWORD_RESET = "password_reset"
+LIMIT_EMAIL_CHANGE = "email_change"
+
+BACKEND_MEMORY = "memory"
+BACKEND_REDIS = "redis"
+
+
+@dataclass(frozen=True)
+class RateLimit:
+    limit: int
+    period: float
+
+
+DEFAULT_LIMITS: Dict[str, RateLimit] = {
+    LIMIT_SUBMIT: RateLimit(limit=4, period=10),
+    LIMIT_USER_EVAL: RateLimit(limit=4, period=10),
+    # one negotiation before each submission or user eval
+    LIMIT_MISSING_DIGESTS: RateLimit(limit=8, period=10),
+    LIMIT_REGISTER: RateLimit(limit=3, period=12 * 60 * 60),
+    LIMIT_PASSWORD_RESET: RateLimit(limit=3, period=12 * 60 * 60),
+    LIMIT_EMAIL_CHANGE: RateLimit(limit=3, period=12 * 60 * 60),
+}
+
+
+class RateLimitBackend:
+    def hit(self, key: str, limit: RateLimit) -> bool:
+        """Record a hit for key and return whether it is within the limit.
+
+        Rejected hits are not recorded.
+        """
+        raise NotImplementedError
+
+    def release(self, key: str) -> None:
+        """Take back the most recent hit for key."""
+        raise NotImplementedError
+
+    def reset(self, key: str) -> None:
+        raise NotImplementedError
+
+
+class MemoryBackend(RateLimitBackend):
+    # Prune empty windows every this many hits so the dict does not grow
+    # with every key that was ever seen.
+    _PRUNE_INTERVAL = 1024
+
+    def __init__(self) -> None:
+        self._windows: Dict[str, Deque[float]] = {}
+        self._lock = threading.Lock()
+        self._hits_since_prune = 0
+        self._max_period = 0.0
+
+    def hit(self, key: str, limit: RateLimit) -> bool:
+        now = time.monotonic()
+        cutoff = now - limit.period
+        with self._lock:
+            self._max_period = max(self._max_period, limit.period)
+            self._hits_since_prune += 1
+            if self._hits_since_prune >= self._PRUNE_INTERVAL:
+                self._prune(now)
+            window = self._windows.setdefault(key, collections.deque())
+            while window and window[0] <= cutoff:
+                window.popleft()
+            if len(window) >= limit.limit:
+                return False
+            window.append(now)
+            return True
+
+    def release(self, key: str) -> None:
+        with self._lock:
+            window = self._windows.get(key)
+            if window:
+                window.pop()
+
+    def reset(self, key: str) -> None:
+        with self._lock:
+            self._windows.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._windows)
+
+    def _prune(self, now: float) -> None:
+        self._hits_since_prune = 0
+        stale = [
+            key
+            for key, window in self._windows.items()
+            if not window or window[-1] <= now - self._max_period
+        ]
+        for key in stale:
+            del self._windows[key]
+
+
+class RedisBackend(RateLimitBackend):
+    def __init__(self, url: str) -> None:
+        import redis  # type: ignore
+
+        self._client = redis.Redis.from_url(url)
+
+    def hit(self, key: str, limit: RateLimit) -> bool:
+        now = time.time()
+        member = f"{now}:{uuid.uuid4().hex}"
+        rkey = f"aoiportal:ratelimit:{key}"
+        pipe = self._client.pipeline(transaction=True)
+        pipe.zremrangebyscore(rkey, 0, now - limit.period)
+        pipe.zadd(rkey, {member: now})
+        pipe.zcard(rkey)
+        pipe.expire(rkey, int(limit.period) + 1)
+        _, _, count, _ = pipe.execute()
+        if count > limit.limit:
+            self._client.zrem(rkey, member)
+            return False
+        return True
+
+    def release(self, key: str) -> None:
+        self._client.zpopmax(f"aoiportal:ratelimit:{key}")
+
+    def reset(self, key: str) -> None:
+        self._client.delete(f"aoiportal:ratelimit:{key}")
+
+
+@dataclass
+class RateLimiter:
+    backend: RateLimitBackend
+    limits: Dict[str, RateLimit]
+
+    def hit(self, name: str, key: object) -> bool:
+        limit = self.limits.get(name)
+        if limit is None:
+            return True
+        return self.backend.hit(f"{name}:{key}", limit)
+
+    def release(self, name: str, key: object) -> None:
+        if name in self.limits:
+            self.backend.release(f"{name}:{key}")
+
+
+def init_app(app: Flask) -> None:
+    backend_name = app.config.get("RATE_LIMIT_BACKEND", BACKEND_MEMORY)
+    backend: RateLimitBackend
+    if backend_name == BACKEND_REDIS:
+        backend = RedisBackend(app.config["RATE_LIMIT_REDIS_URL"])
+    else:
+        backend = MemoryBackend()
+        register_cache("rate_limit", backend)
+    limits = dict(DEFAULT_LIMITS)
+    limits.update(app.config.get("RATE_LIMITS", {}))
+    app.extensions["ratelimit"] = RateLimiter(backend=backend, limits=limits)
+
+
+def hit(name: str, key: object) -> bool:
+    """Record a hit on the limit `name` for `key`.
+
+    Returns False if the limit is exceeded, in which case the caller should
+    reject the request with its usual throttling error.
+    """
+    limiter: RateLimiter = current_app.extensions["ratelimit"]
+    return limiter.hit(name, key)
+
+
+@contextlib.contextmanager
+def reserve(name: str, key: object) -> Iterator[bool]:
+    """Record a hit on the limit `name` for `key` and take it back if the
+    block raises.
+
+    For endpoints that should only use up the limit when they succeed. The
+    slot is taken before the work, so concurrent requests cannot all pass
+    the limit; yields False (and records nothing) if the limit is exceeded.
+    """
+    limiter: RateLimiter = current_app.extensions["ratelimit"]
+    allowed = limiter.hit(name, key)
+    try:
+        yield allowed
+    except BaseException:
+        if allowed:
+            limiter.release(name, key)
+        raise
+
+
+def get_limit(name: str) -> RateLimit:
+    """The configured limit `name`, for limits the caller counts itself."""
+    limiter: RateLimiter = current_app.extensions["ratelimit"]
+    return limiter.limits[name]
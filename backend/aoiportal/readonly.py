@@ -0,0 +1,90 @@
+"""Read-only transactions for requests that do not write.
+
+When enabled (``read_only`` in the config, off by default), GET, HEAD and
+OPTIONS requests, and views marked with `read_only_view`, run their portal
+and CMS statements on a read-only variant of the engine (see `route`, used
+by the ``get_bind`` of both sessions). On PostgreSQL the transactions are
+started with ``BEGIN READ ONLY``, which needs no extra round trip and makes
+PostgreSQL refuse accidental writes; with ``autocommit`` the connections run
+in autocommit mode instead, which saves the BEGIN and ROLLBACK round trips,
+but the statements of a request no longer share one snapshot. Other
+databases (SQLite in development) are not affected.
+
+Code that writes in a request that may be read-only (e.g. the participation
+created on the first proxy auth request) calls `writable` first, the
+following statements of the request then use the normal engine. That is a
+different bind for the session, so the request holds a second pooled
+connection from then on.
+"""
+
+from typing import Any, Dict
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy.engine import Engine  # type: ignore
+
+SAFE_METHODS = frozenset(["GET", "HEAD", "OPTIONS"])
+
+_KEY_READ_ONLY = "_readonly_request"
+_KEY_WRITABLE = "_readonly_writable"
+_engines: Dict[Engine, Engine] = {}
+
+
+def read_only_view(fn):
+    """Mark a view that does not write as read-only, for views that are
+    not GET requests."""
+    fn.read_only = True
+    return fn
+
+
+def _is_read_only_request() -> bool:
+    if not current_app.config.get("READ_ONLY_ENABLED", False):
+        return False
+    if request.method in SAFE_METHODS:
+        return True
+    if request.endpoint is None:
+        return False
+    view = current_app.view_functions.get(request.endpoint)
+    return getattr(view, "read_only", False)
+
+
+def is_read_only() -> bool:
+    if not has_request_context() or g.get(_KEY_WRITABLE, False):
+        return False
+    read_only = g.get(_KEY_READ_ONLY)
+    if read_only is None:
+        read_only = _is_read_only_request()
+        setattr(g, _KEY_READ_ONLY, read_only)
+    return read_only
+
+
+def writable() -> None:
+    """Use read-write transactions (and the primary CMS database) for the
+    rest of the request."""
+    if has_request_context():
+        setattr(g, _KEY_WRITABLE, True)
+
+
+def is_writable() -> bool:
+    return has_request_context() and g.get(_KEY_WRITABLE, False)
+
+
+def read_only_engine(engine: Engine) -> Engine:
+    if engine.dialect.name != "postgresql":
+        return engine
+    ro_engine = _engines.get(engine)
+    if ro_engine is None:
+        options: Dict[str, Any]
+        if current_app.config["READ_ONLY_AUTOCOMMIT"]:
+            options = {"isolation_level": "AUTOCOMMIT"}
+        else:
+            options = {"postgresql_readonly": True}
+        # shares the pool and the event listeners of engine
+        ro_engine = _engines[engine] = engine.execution_options(**options)
+    return ro_engine
+
+
+def route(engine: Engine) -> Engine:
+    """The engine to run a statement of the current request on."""
+    if not is_read_only():
+        return engine
+    return read_only_engine(engine)
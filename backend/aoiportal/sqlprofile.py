@@ -0,0 +1,308 @@
+"""Per-request SQL profiling, to find N+1 query patterns.
+
+When enabled (``sql_profiler`` in the config, meant for staging or a short
+time in production), every statement executed on the portal and CMS
+engines during a request is recorded. Statements are grouped by their
+normalized text (parameters, literals and IN lists replaced), and a group
+executed at least ``n_plus_one_threshold`` times in one request is reported
+as an N+1 pattern, with the code location of its first execution.
+
+Responses get a ``Server-Timing`` header with the query count and time per
+database (only for admins, unless ``server_timing.header`` is ``all``), and
+the last requests are kept (per worker) for the admin report on
+``/api/admin/sql-profile``.
+
+`query_budget` counts statements independently of the profiler, to assert
+the number of queries of an endpoint in tests and scripts.
+"""
+
+import collections
+import contextlib
+import datetime
+import functools
+import logging
+import re
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+
+from flask import Blueprint, Flask, Response, current_app, g, has_app_context, request
+from sqlalchemy import event  # type: ignore
+from sqlalchemy.engine import Engine  # type: ignore
+
+from aoiportal import timing
+from aoiportal.auth_util import admin_required
+from aoiportal.metrics import app_engines
+from aoiportal.web_utils import json_api
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r"\s+")
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_PARAM = re.compile(r"%\(\w+\)s|%s|(?<!:):\w+|\?")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_LIST = re.compile(r"\(\?(?:, \?)+\)")
+
+
+@functools.lru_cache(maxsize=1024)
+def normalize_statement(statement: str) -> str:
+    """Statement text with all values replaced by ``?``, so executions with
+    different parameters (and IN lists of different length) group together."""
+    statement = _WHITESPACE.sub(" ", statement.strip())
+    statement = _STRING.sub("?", statement)
+    statement = _PARAM.sub("?", statement)
+    statement = _NUMBER.sub("?", statement)
+    return _LIST.sub("(?, ...)", statement)
+
+
+def _origin() -> str:
+    """The innermost portal frame that is not this module."""
+    frame = sys._getframe(1)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if "aoiportal" in filename and not filename.endswith("sqlprofile.py"):
+            path = filename[filename.rindex("aoiportal") :]
+            return f"{path}:{frame.f_lineno} ({frame.f_code.co_name})"
+        frame = frame.f_back  # type: ignore
+    return ""
+
+
+@dataclass
+class StatementGroup:
+    db: str
+    statement: str
+    count: int = 0
+    duration: float = 0.0
+    origin: str = ""
+
+    def to_json(self) -> dict:
+        return {
+            "db": self.db,
+            "statement": self.statement,
+            "count": self.count,
+            "duration_ms": round(self.duration * 1000, 3),
+            "origin": self.origin,
+        }
+
+
+@dataclass
+class QueryLog:
+    groups: Dict[Tuple[str, str], StatementGroup] = field(default_factory=dict)
+
+    def add(self, db: str, statement: str, duration: float) -> None:
+        key = (db, normalize_statement(statement))
+        group = self.groups.get(key)
+        if group is None:
+            group = self.groups[key] = StatementGroup(*key, origin=_origin())
+        group.count += 1
+        group.duration += duration
+
+    @property
+    def count(self) -> int:
+        return sum(group.count for group in self.groups.values())
+
+    def totals(self) -> Dict[str, Tuple[int, float]]:
+        """(count, duration) per database."""
+        totals: Dict[str, Tuple[int, float]] = {}
+        for group in self.groups.values():
+            count, duration = totals.get(group.db, (0, 0.0))
+            totals[group.db] = (count + group.count, duration + group.duration)
+        return totals
+
+    def repeated(self, threshold: int) -> List[StatementGroup]:
+        return sorted(
+            (group for group in self.groups.values() if group.count >= threshold),
+            key=lambda group: -group.count,
+        )
+
+
+@dataclass
+class RequestProfile(QueryLog):
+    method: str = ""
+    path: str = ""
+    endpoint: str = ""
+    timestamp: str = ""
+    status: int = 0
+
+    def to_json(self, threshold: int) -> dict:
+        return {
+            "method": self.method,
+            "path": self.path,
+            "endpoint": self.endpoint,
+            "timestamp": self.timestamp,
+            "status": self.status,
+            "totals": {
+                db: {"count": count, "duration_ms": round(duration * 1000, 3)}
+                for db, (count, duration) in self.totals().items()
+            },
+            "n_plus_one": [group.to_json() for group in self.repeated(threshold)],
+            "statements": [
+                group.to_json()
+                for group in sorted(
+                    self.groups.values(), key=lambda group: -group.duration
+                )
+            ],
+        }
+
+
+def _instrument(
+    engine: Engine, db: str, get_log: Callable[[], Optional[QueryLog]]
+) -> Callable[[], None]:
+    """Record the statements of engine in get_log(), returns a function that
+    removes the listeners again."""
+    # own start time stack, several loggers can listen to the same engine
+    key = object()
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, many):
+        conn.info.setdefault(key, []).append(time.perf_counter())
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, many):
+        start = conn.info[key].pop()
+        log = get_log()
+        if log is not None:
+            log.add(db, statement, time.perf_counter() - start)
+
+    def handle_error(context):
+        if context.connection is not None and context.connection.info.get(key):
+            context.connection.info[key].pop()
+
+    listeners: List[Tuple[str, Callable[..., Any]]] = [
+        ("before_cursor_execute", before_cursor_execute),
+        ("after_cursor_execute", after_cursor_execute),
+        ("handle_error", handle_error),
+    ]
+    for name, fn in listeners:
+        event.listen(engine, name, fn)
+
+    def remove() -> None:
+        for name, fn in listeners:
+            event.remove(engine, name, fn)
+
+    return remove
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+@contextlib.contextmanager
+def query_budget(
+    app: Flask, max_queries: int, db: Optional[str] = None
+) -> Iterator[QueryLog]:
+    """Fail if the block executes more than max_queries statements (on the
+    engine named db, or on all of them)::
+
+        with query_budget(app, 3):
+            client.get("/api/admin/contests")
+    """
+    log = QueryLog()
+    removers = [
+        _instrument(engine, name, lambda: log)
+        for name, engine in app_engines(app).items()
+        if db is None or name == db
+    ]
+    try:
+        yield log
+    finally:
+        for remove in removers:
+            remove()
+    if log.count > max_queries:
+        details = "\n".join(
+            f"  {group.count}x {group.statement} ({group.origin})"
+            for group in sorted(log.groups.values(), key=lambda group: -group.count)
+        )
+        raise QueryBudgetExceeded(
+            f"{log.count} queries, expected at most {max_queries}:\n{details}"
+        )
+
+
+_KEY_PROFILE = "_sqlprofile"
+
+
+def _current_profile() -> Optional[QueryLog]:
+    if not has_app_context():
+        return None
+    return g.get(_KEY_PROFILE)
+
+
+def _before_request() -> None:
+    setattr(
+        g,
+        _KEY_PROFILE,
+        RequestProfile(
+            method=request.method,
+            path=request.full_path.rstrip("?"),
+            endpoint=request.endpoint or "",
+            timestamp=datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        ),
+    )
+
+
+def _after_request(resp: Response) -> Response:
+    profile: Optional[RequestProfile] = g.pop(_KEY_PROFILE, None)
+    if profile is None:
+        return resp
+    profile.status = resp.status_code
+    threshold = current_app.config["SQL_PROFILER_N_PLUS_ONE_THRESHOLD"]
+
+    timings = [
+        f'sql-{db};dur={duration * 1000:.1f};desc="{count} queries"'
+        for db, (count, duration) in profile.totals().items()
+    ]
+    repeated = profile.repeated(threshold)
+    if repeated:
+        timings.append(f'sql-n-plus-one;desc="{len(repeated)} repeated statements"')
+        for group in repeated:
+            logger.warning(
+                "N+1 in %s %s: %dx %s (%s)",
+                profile.method,
+                profile.path,
+                group.count,
+                group.statement,
+                group.origin,
+            )
+    if timings and timing.show_header():
+        resp.headers.add("Server-Timing", ", ".join(timings))
+    _REPORTS.append(profile)
+    return resp
+
+
+_REPORTS: Deque[RequestProfile] = collections.deque(maxlen=200)
+
+sqlprofile_bp = Blueprint("sqlprofile", __name__)
+
+
+@sqlprofile_bp.route("/api/admin/sql-profile")
+@admin_required
+@json_api()
+def get_sql_profile():
+    """The last profiled requests of this worker, newest first. With
+    ``?n_plus_one=1`` only the requests with N+1 patterns."""
+    threshold = current_app.config["SQL_PROFILER_N_PLUS_ONE_THRESHOLD"]
+    only_repeated = request.args.get("n_plus_one") == "1"
+    return [
+        profile.to_json(threshold)
+        for profile in reversed(_REPORTS)
+        if not only_repeated or profile.repeated(threshold)
+    ]
+
+
+@sqlprofile_bp.route("/api/admin/sql-profile", methods=["DELETE"])
+@admin_required
+@json_api()
+def clear_sql_profile():
+    _REPORTS.clear()
+    return {"success": True}
+
+
+def init_app(app: Flask) -> None:
+    if not app.config.get("SQL_PROFILER_ENABLED", False):
+        return
+    global _REPORTS
+    _REPORTS = collections.deque(maxlen=app.config["SQL_PROFILER_KEEP_REPORTS"])
+    for name, engine in app_engines(app).items():
+        _instrument(engine, name, _current_profile)
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.register_blueprint(sqlprofile_bp)
@@ -0,0 +1,138 @@
+"""Timers around the phases of the hot paths, reported as Server-Timing.
+
+Code wraps a phase with ``with timing.phase("auth"):``. When enabled
+(``server_timing`` in the config), the time of each phase is summed per
+request and sent in a ``Server-Timing`` header (by default to admins only,
+browsers show it in the network tab), together with the query time per
+database and the total time. Every phase is also observed in the
+``aoiportal_phase_duration_seconds`` metric (per call), including phases
+that run after the response started (large object reads of streamed
+files).
+
+When disabled `phase` returns a shared no-op context manager.
+"""
+
+import contextlib
+import time
+from typing import ContextManager, Dict, List
+
+from flask import Flask, Response, current_app, g, has_request_context
+from sqlalchemy import event  # type: ignore
+from sqlalchemy.engine import Engine  # type: ignore
+
+from aoiportal.metrics import PHASE_DURATION, app_engines
+
+PHASE_AUTH = "auth"
+PHASE_PARTICIPATION = "participation"
+PHASE_SUBMISSIONS = "submissions"
+PHASE_SCORE = "score"
+PHASE_JSON = "json"
+PHASE_LO_READ = "lo-read"
+
+HEADER_ADMINS = "admins"
+HEADER_ALL = "all"
+
+_enabled = False
+_NOOP = contextlib.nullcontext()
+_KEY_TIMINGS = "_timing_phases"
+_KEY_START = "_timing_start"
+
+
+def _add(name: str, duration: float) -> None:
+    if not has_request_context():
+        return
+    timings: Dict[str, List[float]] = g.get(_KEY_TIMINGS)
+    if timings is None:
+        return
+    entry = timings.get(name)
+    if entry is None:
+        timings[name] = [duration, 1]
+    else:
+        entry[0] += duration
+        entry[1] += 1
+
+
+def _record(name: str, duration: float) -> None:
+    PHASE_DURATION.observe(duration, (name,))
+    _add(name, duration)
+
+
+class _Phase:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def __enter__(self) -> None:
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc) -> None:
+        _record(self.name, time.perf_counter() - self.start)
+
+
+def phase(name: str) -> ContextManager:
+    if not _enabled:
+        return _NOOP
+    return _Phase(name)
+
+
+def _instrument_engine(engine: Engine, db: str) -> None:
+    name = f"db-{db}"
+    key = object()
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, many):
+        conn.info.setdefault(key, []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, many):
+        # queries are already in the metrics, only the header needs them
+        _add(name, time.perf_counter() - conn.info[key].pop())
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(context):
+        if context.connection is not None and context.connection.info.get(key):
+            context.connection.info[key].pop()
+
+
+def _before_request() -> None:
+    setattr(g, _KEY_START, time.perf_counter())
+    setattr(g, _KEY_TIMINGS, {})
+
+
+def show_header() -> bool:
+    """Whether the current request gets Server-Timing headers."""
+    if current_app.config["SERVER_TIMING_HEADER"] == HEADER_ALL:
+        return True
+    from aoiportal.auth_util import get_current_auth_user
+
+    # usually cached in g already
+    user = get_current_auth_user()
+    return user is not None and user.is_admin
+
+
+def _after_request(resp: Response) -> Response:
+    timings: Dict[str, List[float]] = g.pop(_KEY_TIMINGS, None)
+    start = g.pop(_KEY_START, None)
+    if timings is None or start is None:
+        return resp
+    total = time.perf_counter() - start
+    if show_header():
+        entries = [
+            f'{name};dur={duration * 1000:.1f};desc="{count:.0f}x"'
+            for name, (duration, count) in timings.items()
+        ]
+        entries.append(f"total;dur={total * 1000:.1f}")
+        resp.headers.add("Server-Timing", ", ".join(entries))
+    return resp
+
+
+def init_app(app: Flask) -> None:
+    global _enabled
+    if not app.config.get("SERVER_TIMING_ENABLED", False):
+        return
+    _enabled = True
+    for name, engine in app_engines(app).items():
+        _instrument_engine(engine, name)
+    app.before_request(_before_request)
+    app.after_request(_after_request)
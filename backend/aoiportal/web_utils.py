@@ -1,13 +1,33 @@
 import functools
-from typing import Optional, Union
+import hashlib
+import io
+from dataclasses import dataclass
+from typing import Callable, Iterable, Iterator, List, Optional, TypeVar, Union, cast
 
 import voluptuous as vol  # type: ignore
-from flask import Response, jsonify, request
+from flask import Response, current_app, jsonify, request, stream_with_context
+from sqlalchemy.orm import Query  # type: ignore
 from voluptuous.humanize import humanize_error  # type: ignore
-
-from aoiportal.error import ERROR_VALIDATION_ERROR, AOIBadRequest
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import (
+    Data,
+    Epilogue,
+    Field,
+    File,
+    MultipartDecoder,
+    NeedData,
+)
+
+from aoiportal.error import (
+    ERROR_FILE_TOO_LARGE,
+    ERROR_VALIDATION_ERROR,
+    AOIBadRequest,
+    AOIRequestEntityTooLarge,
+)
 
 SchemaType = Union[vol.Schema, list, dict]
+T = TypeVar("T")
 
 
 def json_api(schema: Optional[SchemaType] = None):
@@ -56,4 +76,171 @@ def _json_response():
     return decorator
 
 
+@dataclass(frozen=True)
+class UploadedPart:
+    name: str
+    # None for plain form fields
+    filename: Optional[str]
+    content: bytes
+    # sha1 hex digest of content, computed while receiving
+    digest: str
+
+
+_READ_CHUNK_SIZE = 64 * 1024
+_MAX_FORM_FIELD_SIZE = 64 * 1024
+_MAX_PARTS = 128
+
+
+def read_multipart_upload(
+    *, max_file_size: int, max_total_size: int
+) -> List[UploadedPart]:
+    """Read a multipart/form-data request body part by part.
+
+    Unlike `request.files` this never buffers more than the size limits
+    allow: every chunk is counted against the per-file and total limits
+    before it is kept, and the sha1 digest is computed incrementally.
+    """
+    mimetype, options = parse_options_header(request.headers.get("Content-Type"))
+    boundary = options.get("boundary")
+    if mimetype != "multipart/form-data" or not boundary:
+        raise AOIBadRequest("Expected multipart/form-data body.")
+    if request.content_length is not None and request.content_length > (
+        max_total_size + _MAX_FORM_FIELD_SIZE
+    ):
+        raise AOIRequestEntityTooLarge(
+            "Upload too large.", error_code=ERROR_FILE_TOO_LARGE
+        )
+
+    decoder = MultipartDecoder(
+        boundary.encode(),
+        max_form_memory_size=_MAX_FORM_FIELD_SIZE,
+        max_parts=_MAX_PARTS,
+    )
+    stream = request.stream
+    parts: List[UploadedPart] = []
+    total = 0
+    name: Optional[str] = None
+    filename: Optional[str] = None
+    buf = io.BytesIO()
+    hasher = hashlib.sha1()
+    try:
+        while True:
+            event = decoder.next_event()
+            if isinstance(event, NeedData):
+                chunk = stream.read(_READ_CHUNK_SIZE)
+                decoder.receive_data(chunk or None)
+            elif isinstance(event, (Field, File)):
+                name = event.name
+                filename = event.filename if isinstance(event, File) else None
+                buf = io.BytesIO()
+                hasher = hashlib.sha1()
+            elif isinstance(event, Data):
+                if filename is not None:
+                    total += len(event.data)
+                    if buf.tell() + len(event.data) > max_file_size:
+                        raise AOIRequestEntityTooLarge(
+                            f"File {filename} too large.",
+                            error_code=ERROR_FILE_TOO_LARGE,
+                        )
+                    if total > max_total_size:
+                        raise AOIRequestEntityTooLarge(
+                            "Upload too large.", error_code=ERROR_FILE_TOO_LARGE
+                        )
+                hasher.update(event.data)
+                buf.write(event.data)
+                if not event.more_data:
+                    assert name is not None
+                    parts.append(
+                        UploadedPart(
+                            name=name,
+                            filename=filename,
+                            content=buf.getvalue(),
+                            digest=hasher.hexdigest(),
+                        )
+                    )
+            elif isinstance(event, Epilogue):
+                break
+    except RequestEntityTooLarge:
+        raise AOIRequestEntityTooLarge(
+            "Form field too large.", error_code=ERROR_FILE_TOO_LARGE
+        )
+    except ValueError:
+        raise AOIBadRequest("Malformed multipart body.")
+    return parts
+
+
+def versioned_json(version: object, render: Callable[[], object]) -> Response:
+    """Respond with `render()` as JSON, or with 304 if the client has it.
+
+    `version` is a cheap marker (e.g. a tuple of max ids and counts) that
+    changes whenever the output of `render` would. It is hashed into the
+    ETag before rendering, so render only runs when the client is stale.
+    """
+    etag = hashlib.sha1(repr(version).encode()).hexdigest()
+    if request.if_none_match.contains_weak(etag):
+        resp = Response(status=304)
+    else:
+        resp = jsonify(render())
+    resp.set_etag(etag)
+    # per user data, always revalidate
+    resp.cache_control.private = True
+    resp.cache_control.no_cache = True
+    return resp
+
+
+_STREAM_BATCH_SIZE = 500
+_STREAM_CHUNK_SIZE = 64 * 1024
+_MIMETYPE_JSON = "application/json"
+_MIMETYPE_NDJSON = "application/x-ndjson"
+_END = object()
+
+
+def stream_json_list(rows: Iterable[T], dump: Callable[[T], object]) -> Response:
+    """Respond with `[dump(row) for row in rows]` without building the list.
+
+    Queries are iterated with yield_per, so only one batch of rows is in
+    memory at a time. Clients that accept application/x-ndjson (and prefer
+    it over application/json) get one JSON document per line instead.
+    """
+    if isinstance(rows, Query):
+        rows = rows.yield_per(_STREAM_BATCH_SIZE)
+    ndjson = (
+        request.accept_mimetypes.best_match([_MIMETYPE_JSON, _MIMETYPE_NDJSON])
+        == _MIMETYPE_NDJSON
+    )
+    dumps = current_app.json.dumps
+    it = iter(rows)
+    # Run the query before the response starts, so errors still become a
+    # proper error response
+    first = next(it, _END)
+
+    def generate() -> Iterator[str]:
+        if first is _END:
+            if not ndjson:
+                yield "[]"
+            return
+        sep = "\n" if ndjson else ","
+        head = dumps(dump(cast(T, first)))
+        buf = [head] if ndjson else ["[", head]
+        size = 0
+        for row in it:
+            part = dumps(dump(row))
+            buf.append(sep)
+            buf.append(part)
+            size += len(part)
+            if size >= _STREAM_CHUNK_SIZE:
+                yield "".join(buf)
+                buf = []
+                size = 0
+        buf.append("\n" if ndjson else "]")
+        yield "".join(buf)
+
+    resp = Response(
+        stream_with_context(generate()),
+        mimetype=_MIMETYPE_NDJSON if ndjson else _MIMETYPE_JSON,
+    )
+    resp.vary.add("Accept")
+    return resp
+
+
 # TODO: error responses in json
@@ -0,0 +1,191 @@
+"""Per-row cost of the admin submission and user eval list serializers.
+
+Compares the ORM path (hydrate Submission/UserEval objects with load_only and
+dump them with dump_submission/dump_user_eval) with the column tuple path the
+list endpoints use, on the newest submissions and user evals of an existing
+CMS database. Both paths must produce the same JSON.
+
+    python bench_admin_lists.py -c config/development.yaml --rows 1000
+"""
+
+import argparse
+import json
+import statistics
+import time
+from typing import Callable, List
+
+from sqlalchemy.orm import Load, contains_eager  # type: ignore
+
+from aoiportal.cmsmirror import admin
+from aoiportal.cmsmirror.db import (  # type: ignore
+    Contest,
+    Participation,
+    Task,
+    User,
+    UserEval,
+    UserEvalResult,
+    session,
+)
+from aoiportal.cmsmirror.db.submission import (  # type: ignore
+    Meme,
+    Submission,
+    SubmissionResult,
+)
+from aoiportal.factory import create_app
+
+parser = argparse.ArgumentParser("bench_admin_lists")
+parser.add_argument("-c", "--config", type=str, required=True)
+parser.add_argument("--rows", type=int, default=1000)
+parser.add_argument("--repeat", type=int, default=5)
+
+
+def _shared_options(task_rel, part_rel):
+    return (
+        contains_eager(task_rel).load_only(
+            Task.id,
+            Task.contest_id,
+            Task.name,
+            Task.title,
+            Task.score_precision,
+        ),
+        contains_eager(part_rel).load_only(
+            Participation.id,
+            Participation.user_id,
+            Participation.contest_id,
+            Participation.hidden,
+        ),
+        contains_eager(part_rel)
+        .contains_eager(Participation.contest)
+        .load_only(Contest.id, Contest.name, Contest.description),
+        contains_eager(part_rel)
+        .contains_eager(Participation.user)
+        .load_only(User.id, User.first_name, User.last_name, User.username),
+    )
+
+
+def orm_submissions(rows: int) -> list:
+    items = (
+        session.query(Submission, SubmissionResult)  # type: ignore
+        .join(Submission.task)
+        .join(Submission.participation)
+        .outerjoin(
+            Submission.results.and_(
+                SubmissionResult.dataset_id == Task.active_dataset_id
+            )
+        )
+        .outerjoin(SubmissionResult.meme)
+        .join(Participation.user)
+        .join(Participation.contest)
+        .filter(Task.active_dataset_id.isnot(None))
+        .options(
+            Load(Submission).load_only(
+                Submission.id,
+                Submission.uuid,
+                Submission.timestamp,
+                Submission.language,
+                Submission.official,
+                Submission.comment,
+            ),
+            Load(SubmissionResult).load_only(
+                SubmissionResult.submission_id,
+                SubmissionResult.dataset_id,
+                SubmissionResult.compilation_outcome,
+                SubmissionResult.evaluation_outcome,
+                SubmissionResult.score,
+                SubmissionResult.score_details,
+            ),
+            contains_eager(SubmissionResult.meme).load_only(Meme.id, Meme.digest),
+            *_shared_options(Submission.task, Submission.participation),
+        )
+        .order_by(Submission.timestamp.desc(), Submission.id.desc())
+        .limit(rows)
+        .all()
+    )
+    max_scores = admin.dataset_max_scores(
+        res.dataset_id for _, res in items if res is not None
+    )
+    return [
+        admin.dump_submission(sub, res, max_scores=max_scores) for sub, res in items
+    ]
+
+
+# The column paths take the page size from the request
+def column_submissions(rows: int) -> list:
+    return admin._get_submissions()["items"]
+
+
+def orm_user_evals(rows: int) -> list:
+    items = (
+        session.query(UserEval, UserEvalResult)  # type: ignore
+        .join(UserEval.task)
+        .join(UserEval.participation)
+        .join(Participation.contest)
+        .join(Participation.user)
+        .outerjoin(
+            UserEval.results.and_(UserEvalResult.dataset_id == Task.active_dataset_id)
+        )
+        .options(
+            Load(UserEval).load_only(
+                UserEval.id,
+                UserEval.uuid,
+                UserEval.timestamp,
+                UserEval.language,
+            ),
+            Load(UserEvalResult).load_only(
+                UserEvalResult.user_eval_id,
+                UserEvalResult.dataset_id,
+                UserEvalResult.compilation_outcome,
+                UserEvalResult.evaluation_outcome,
+            ),
+            *_shared_options(UserEval.task, UserEval.participation),
+        )
+        .order_by(UserEval.timestamp.desc(), UserEval.id.desc())
+        .limit(rows)
+        .all()
+    )
+    return [admin.dump_user_eval(eva, res) for eva, res in items]
+
+
+def column_user_evals(rows: int) -> list:
+    return admin._get_user_evals()["items"]
+
+
+def _run(fn: Callable[[int], list], rows: int, repeat: int) -> List[float]:
+    times = []
+    for _ in range(repeat):
+        # empty identity map, like a fresh request
+        session.expunge_all()  # type: ignore
+        start = time.perf_counter()
+        fn(rows)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def _canonical(items: list) -> str:
+    return json.dumps(items, sort_keys=True)
+
+
+def main() -> None:
+    args = parser.parse_args()
+    app = create_app(args.config)
+    with app.test_request_context(f"/?per_page={args.rows}"):
+        for name, orm_fn, column_fn in [
+            ("submissions", orm_submissions, column_submissions),
+            ("user evals", orm_user_evals, column_user_evals),
+        ]:
+            orm_items = orm_fn(args.rows)
+            column_items = column_fn(args.rows)
+            if _canonical(orm_items) != _canonical(column_items):
+                raise SystemExit(f"{name}: ORM and column output differ")
+            n = max(len(orm_items), 1)
+            print(f"{name} ({len(orm_items)} rows, best of {args.repeat}):")
+            for label, fn in [("ORM", orm_fn), ("columns", column_fn)]:
+                times = _run(fn, args.rows, args.repeat)
+                print(
+                    f"  {label:8} {min(times) / n * 1e6:8.1f} us/row"
+                    f"  (median {statistics.median(times) * 1e3:.1f} ms)"
+                )
+
+
+if __name__ == "__main__":
+    main()
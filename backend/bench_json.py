@@ -0,0 +1,173 @@
+"""Encoding time of the JSON providers on the shapes of the large responses.
+
+Builds synthetic payloads shaped like the contest ranking, a page of the
+admin submission list and the newsletter subscriber list (raw datetimes),
+checks that all providers produce the same JSON and prints the time per
+response.
+
+    python bench_json.py --participants 300 --tasks 8 --rows 1000
+"""
+
+import argparse
+import datetime
+import random
+import statistics
+import time
+import uuid
+from importlib.util import find_spec
+from typing import Callable, Dict, List
+
+from flask import Flask
+
+from aoiportal.cmsmirror import admin
+from aoiportal.jsonprovider import OrjsonJSONProvider, StdlibJSONProvider
+
+parser = argparse.ArgumentParser("bench_json")
+parser.add_argument("--participants", type=int, default=300)
+parser.add_argument("--tasks", type=int, default=8)
+parser.add_argument("--rows", type=int, default=1000)
+parser.add_argument("--repeat", type=int, default=20)
+
+
+def ranking(participants: int, tasks: int) -> dict:
+    subtasks = [random.randint(2, 6) for _ in range(tasks)]
+    return {
+        "tasks": [
+            {
+                "id": tid,
+                "name": f"task{tid}",
+                "title": f"Task {tid}",
+                "max_score": 100.0,
+                "subtask_max_scores": [100 / n] * n,
+                "score_precision": 0,
+            }
+            for tid, n in enumerate(subtasks)
+        ],
+        "score_precision": 0,
+        "results": [
+            {
+                "id": pid,
+                "hidden": False,
+                "score": random.random() * 100 * tasks,
+                "task_scores": [
+                    {
+                        "id": tid,
+                        "score": random.random() * 100,
+                        "subtask_scores": [random.random() * 100 / n] * n,
+                        "num_submissions": random.randint(0, 50),
+                    }
+                    for tid, n in enumerate(subtasks)
+                ],
+                "rank": pid + 1,
+            }
+            for pid in range(participants)
+        ],
+    }
+
+
+def submissions(rows: int) -> dict:
+    now = datetime.datetime.utcnow()
+    details = [{"max_score": 25.0, "score_fraction": 1.0}] * 4
+    items = [
+        # a _SUBMISSION_ROW_COLUMNS row
+        admin._dump_submission_row(
+            (
+                i,
+                str(uuid.uuid4()),
+                now - datetime.timedelta(seconds=i),
+                "C++17 / g++",
+                True,
+                "",
+                i % 300,
+                False,
+                i % 300,
+                "Max",
+                "Mustermann",
+                f"user{i % 300}",
+                1,
+                "contest",
+                "Contest",
+                i % 8,
+                f"task{i % 8}",
+                f"Task {i % 8}",
+                0,
+                i % 8,
+                "ok",
+                "ok",
+                random.random() * 100,
+                details,
+                None,
+            ),
+            {i % 8: 100.0},
+        )
+        for i in range(rows)
+    ]
+    return {
+        "page": 1,
+        "per_page": rows,
+        "total": rows,
+        "first_cursor": None,
+        "last_cursor": None,
+        "has_more": False,
+        "items": items,
+    }
+
+
+def subscribers(rows: int) -> List[dict]:
+    now = datetime.datetime.utcnow()
+    return [
+        {
+            "email": f"user{i}@example.com",
+            "created_at": now - datetime.timedelta(hours=i),
+        }
+        for i in range(rows)
+    ]
+
+
+def _time(fn: Callable[[], object], repeat: int) -> List[float]:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def main() -> None:
+    args = parser.parse_args()
+    app = Flask(__name__)
+    providers: Dict[str, object] = {"stdlib": StdlibJSONProvider(app)}
+    if find_spec("orjson") is not None:
+        providers["orjson"] = OrjsonJSONProvider(app)
+    else:
+        print("orjson is not installed, only timing the stdlib provider")
+
+    payloads = {
+        "ranking": ranking(args.participants, args.tasks),
+        "submissions": submissions(args.rows),
+        "subscribers": subscribers(args.rows),
+    }
+    with app.app_context():
+        for name, payload in payloads.items():
+            outputs = {
+                label: provider.response(payload).get_data()  # type: ignore
+                for label, provider in providers.items()
+            }
+            decoded = [app.json.loads(out) for out in outputs.values()]
+            if any(d != decoded[0] for d in decoded):
+                raise SystemExit(f"{name}: providers produce different JSON")
+            size = len(outputs["stdlib"])
+            print(f"{name} ({size / 1024:.0f} KiB, best of {args.repeat}):")
+            for label, provider in providers.items():
+                times = _time(
+                    lambda: provider.response(payload),  # type: ignore
+                    args.repeat,
+                )
+                print(
+                    f"  {label:8} {min(times) * 1e3:8.2f} ms"
+                    f"  (median {statistics.median(times) * 1e3:.2f} ms)"
+                )
+
+
+if __name__ == "__main__":
+    main()
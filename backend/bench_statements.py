@@ -0,0 +1,217 @@
+"""Per-call cost of the hot lookups as Query objects and as lambda statements.
+
+Runs the session lookup of the bearer token, the participation and task
+lookups of identity.py and the submission lookup by UUID once as the
+``session.query(...)`` chain they used to be and once as the cached lambda
+statement they are now, on existing rows of the configured databases (the
+CMS lookups only if ``cms`` is configured). Both forms must return the same
+rows. The difference per call is the statement construction and cache key
+generation that lambda statements skip, the SQL string is cached by
+SQLAlchemy in both cases. That part alone is also measured without a
+database (``build``).
+
+    python bench_statements.py -c config/development.yaml --repeat 2000
+"""
+
+import argparse
+import statistics
+import time
+from typing import Callable, List
+
+from sqlalchemy.orm import Query, joinedload  # type: ignore
+
+from aoiportal.auth_util import session_by_token_stmt
+from aoiportal.factory import create_app
+from aoiportal.models import UserSession, db  # type: ignore
+
+parser = argparse.ArgumentParser("bench_statements")
+parser.add_argument("-c", "--config", type=str, required=True)
+parser.add_argument("--repeat", type=int, default=2000)
+
+
+def _run(fn: Callable[[], object], repeat: int, expunge: Callable[[], None]):
+    times: List[float] = []
+    for _ in range(repeat):
+        # empty identity map, like a fresh request
+        expunge()
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def _compare(name: str, query_fn, stmt_fn, repeat: int, expunge) -> None:
+    if query_fn() != stmt_fn():
+        raise SystemExit(f"{name}: Query and lambda statement results differ")
+    print(f"{name} (best of {repeat}):")
+    for label, fn in [("query", query_fn), ("lambda", stmt_fn)]:
+        times = _run(fn, repeat, expunge)
+        print(
+            f"  {label:7} {min(times) * 1e6:8.1f} us/call"
+            f"  (median {statistics.median(times) * 1e6:.1f} us)"
+        )
+
+
+def bench_build(repeat: int) -> None:
+    """Statement construction and cache key generation of the submission
+    lookup, which SQLAlchemy does for every execution."""
+    from aoiportal.cmsmirror import identity, views
+    from aoiportal.cmsmirror.db import Submission, SubmissionResult  # type: ignore
+
+    task = identity.TaskInfo(
+        id=1,
+        name="task",
+        contest_id=1,
+        active_dataset_id=1,
+        task_type=None,
+        score_mode="max",
+        score_precision=0,
+        submission_format=(),
+        statement_html_digest=None,
+        default_input_digest=None,
+        files_version="",
+    )
+
+    def query_fn():
+        query = (
+            Query([Submission, SubmissionResult])
+            .filter(Submission.task_id == task.id)
+            .filter(Submission.uuid == "uuid")
+            .filter(Submission.participation_id == 1)
+            .outerjoin(
+                Submission.results.and_(
+                    SubmissionResult.dataset_id == task.active_dataset_id
+                )
+            )
+            .options(joinedload(Submission.files))
+            .options(joinedload(SubmissionResult.meme))
+            .limit(1)
+        )
+        return query._statement_20()._generate_cache_key()
+
+    def stmt_fn():
+        stmt = views.submission_stmt(task, 1, "uuid", detailed=True)
+        return stmt._generate_cache_key()
+
+    print(f"build submission lookup (best of {repeat}):")
+    for label, fn in [("query", query_fn), ("lambda", stmt_fn)]:
+        times = _run(fn, repeat, lambda: None)
+        print(f"  {label:7} {min(times) * 1e6:8.1f} us/call")
+
+
+def bench_portal(repeat: int) -> None:
+    sess = db.session.query(UserSession).order_by(UserSession.id.desc()).first()
+    if sess is None:
+        print("no user sessions, skipping the session lookup")
+        return
+    token = sess.token
+
+    def query_fn():
+        return (
+            db.session.query(UserSession)
+            .filter(UserSession.token == token)
+            .options(joinedload(UserSession.user))
+            .first()
+        )
+
+    def stmt_fn():
+        return db.session.execute(session_by_token_stmt(token)).scalars().first()
+
+    _compare("session by token", query_fn, stmt_fn, repeat, db.session.expunge_all)
+
+
+def bench_cms(repeat: int) -> None:
+    from aoiportal.cmsmirror import identity, views
+    from aoiportal.cmsmirror.db import (  # type: ignore
+        Contest,
+        Participation,
+        Submission,
+        SubmissionResult,
+        Task,
+        session,
+    )
+
+    expunge = session.expunge_all  # type: ignore
+    sub = (
+        session.query(Submission)  # type: ignore
+        .join(Submission.task)
+        .filter(Task.active_dataset_id.isnot(None))
+        .order_by(Submission.id.desc())
+        .first()
+    )
+    if sub is None:
+        print("no submissions, skipping the CMS lookups")
+        return
+    contest_name = sub.participation.contest.name
+    user_id = sub.participation.user_id
+    contest_id = sub.task.contest_id
+    task_name = sub.task.name
+    task = identity.TaskInfo.from_task(sub.task)
+    participation_id = sub.participation_id
+    uuid = sub.uuid
+
+    def participation_query():
+        return (
+            session.query(Participation)  # type: ignore
+            .join(Participation.contest)
+            .filter(Contest.name == contest_name)
+            .filter(Participation.user_id == user_id)
+            .options(joinedload(Participation.contest))
+            .options(joinedload(Participation.user))
+            .first()
+        )
+
+    def participation_stmt():
+        stmt = identity.participation_stmt(contest_name, user_id)
+        return session.execute(stmt).scalars().first()  # type: ignore
+
+    def task_query():
+        return (
+            session.query(Task)  # type: ignore
+            .filter(Task.contest_id == contest_id)
+            .filter(Task.name == task_name)
+            .options(joinedload(Task.active_dataset))
+            .first()
+        )
+
+    def task_stmt():
+        stmt = identity.task_stmt(contest_id, task_name)
+        return session.execute(stmt).scalars().first()  # type: ignore
+
+    def submission_query():
+        return tuple(
+            session.query(Submission, SubmissionResult)  # type: ignore
+            .filter(Submission.task_id == task.id)
+            .filter(Submission.uuid == uuid)
+            .filter(Submission.participation_id == participation_id)
+            .outerjoin(
+                Submission.results.and_(
+                    SubmissionResult.dataset_id == task.active_dataset_id
+                )
+            )
+            .options(joinedload(Submission.files))
+            .options(joinedload(SubmissionResult.meme))
+            .first()
+        )
+
+    def submission_stmt():
+        stmt = views.submission_stmt(task, participation_id, uuid, detailed=True)
+        return tuple(session.execute(stmt).unique().first())  # type: ignore
+
+    _compare("participation", participation_query, participation_stmt, repeat, expunge)
+    _compare("task", task_query, task_stmt, repeat, expunge)
+    _compare("submission by uuid", submission_query, submission_stmt, repeat, expunge)
+
+
+def main() -> None:
+    args = parser.parse_args()
+    app = create_app(args.config)
+    with app.test_request_context():
+        bench_build(args.repeat)
+        bench_portal(args.repeat)
+        if "cms" in app.extensions:
+            bench_cms(args.repeat)
+
+
+if __name__ == "__main__":
+    main()
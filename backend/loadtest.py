@@ -0,0 +1,420 @@
+"""Submission throughput load test.
+
+Boots the portal from a config file, replaces the CMS EvaluationService with a
+local fake that scores every submission after a fixed delay and drives
+simulated contestants through submit -> poll status -> scores.
+
+The config must point at a disposable portal DB and a disposable CMS DB
+containing the contest and task to test against. Run once with --setup to
+create the simulated contestants:
+
+    python loadtest.py -c config/loadtest.yaml --contest test --task sum \\
+        --contestants 50 --setup
+    python loadtest.py -c config/loadtest.yaml --contest test --task sum \\
+        --contestants 50 --duration 60
+"""
+
+import argparse
+import base64
+import collections
+import json
+import logging
+import random
+import socketserver
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+import requests
+from sqlalchemy.orm import sessionmaker  # type: ignore
+from werkzeug.serving import make_server
+
+from aoiportal.auth_util import create_session
+from aoiportal.cmsmirror.db import Contest as CMSContest  # type: ignore
+from aoiportal.cmsmirror.db import Dataset
+from aoiportal.cmsmirror.db import Participation as CMSParticipation
+from aoiportal.cmsmirror.db import Submission, SubmissionResult, SubtaskScore, Task
+from aoiportal.cmsmirror.db import User as CMSUser
+from aoiportal.factory import create_app
+from aoiportal.models import User, db  # type: ignore
+
+_LOGGER = logging.getLogger("loadtest")
+
+parser = argparse.ArgumentParser("loadtest")
+parser.add_argument("-c", "--config", type=str, required=True)
+parser.add_argument("--contest", type=str, required=True, help="CMS contest name")
+parser.add_argument(
+    "--task", type=str, action="append", required=True, help="CMS task name"
+)
+parser.add_argument("--language", type=str, default="C++17 / g++")
+parser.add_argument("--contestants", type=int, default=20)
+parser.add_argument("--duration", type=float, default=60.0, help="seconds")
+parser.add_argument(
+    "--think-time", type=float, default=5.0, help="mean seconds between submissions"
+)
+parser.add_argument(
+    "--eval-delay", type=float, default=2.0, help="fake evaluation time in seconds"
+)
+parser.add_argument("--poll-interval", type=float, default=1.0)
+parser.add_argument("--host", type=str, default="127.0.0.1")
+parser.add_argument("--port", type=int, default=5055)
+parser.add_argument(
+    "--setup", action="store_true", help="create the simulated contestants and exit"
+)
+
+
+class FakeEvaluationService:
+    """Stand-in for the CMS EvaluationService.
+
+    Accepts the JSON-line RPC sent by `_send_rpc_evaluation_service` and
+    writes a scored SubmissionResult (and SubtaskScores) for every
+    submission after `delay` seconds.
+    """
+
+    def __init__(self, app, delay: float):
+        self._delay = delay
+        self._session_factory = sessionmaker(bind=app.extensions["cms"].engine)
+        host = app.config.get("CMS_EVALUATION_SERVICE_HOST", "127.0.0.1")
+        port = int(app.config.get("CMS_EVALUATION_SERVICE_PORT", 25000))
+        service = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    if not line.strip():
+                        continue
+                    service.dispatch(json.loads(line))
+
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self._server = socketserver.ThreadingTCPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self.scored = 0
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def dispatch(self, msg: dict) -> None:
+        if msg.get("__method") != "new_submission":
+            return
+        subid = msg["__data"]["submission_id"]
+        timer = threading.Timer(self._delay, self._score, args=(subid,))
+        timer.daemon = True
+        timer.start()
+
+    def _score(self, subid: int) -> None:
+        sess = self._session_factory()
+        try:
+            sub: Submission = (
+                sess.query(Submission).filter(Submission.id == subid).one()
+            )
+            ds: Dataset = (
+                sess.query(Dataset)
+                .join(Task, Task.active_dataset_id == Dataset.id)
+                .filter(Task.id == sub.task_id)
+                .one()
+            )
+            res = SubmissionResult(
+                submission_id=sub.id,
+                dataset_id=ds.id,
+                compilation_outcome="ok",
+                compilation_text=["OK"],
+                compilation_tries=1,
+                evaluation_outcome="ok",
+                evaluation_tries=1,
+                ranking_score_details=[],
+            )
+            if ds.score_type == "Sum":
+                testcases = [
+                    {
+                        "idx": tc.codename,
+                        "outcome": (
+                            "Correct" if random.random() < 0.7 else "Not correct"
+                        ),
+                        "text": ["Output is correct"],
+                        "time": 0.01,
+                        "memory": 1 << 20,
+                    }
+                    for tc in ds.testcases.values()
+                ]
+                res.score = ds.score_type_parameters * sum(
+                    1 for tc in testcases if tc["outcome"] == "Correct"
+                )
+                res.score_details = testcases
+            else:
+                subtasks = []
+                for idx, (max_score, _) in enumerate(ds.score_type_parameters, 1):
+                    fraction = random.choice([0.0, 1.0])
+                    subtasks.append(
+                        {
+                            "idx": idx,
+                            "max_score": max_score,
+                            "score_fraction": fraction,
+                            "testcases": [],
+                        }
+                    )
+                    res.subtask_scores.append(
+                        SubtaskScore(
+                            submission_id=sub.id,
+                            dataset_id=ds.id,
+                            subtask_idx=idx,
+                            score=fraction * max_score,
+                        )
+                    )
+                res.score = sum(
+                    st["max_score"] * st["score_fraction"] for st in subtasks
+                )
+                res.score_details = subtasks
+            res.public_score = res.score
+            res.public_score_details = res.score_details
+            sess.add(res)
+            sess.commit()
+            with self._lock:
+                self.scored += 1
+        except Exception:
+            _LOGGER.exception("Fake evaluation of submission %s failed", subid)
+            sess.rollback()
+        finally:
+            sess.close()
+
+
+@dataclass
+class Stats:
+    latencies: Dict[str, List[float]] = field(
+        default_factory=lambda: collections.defaultdict(list)
+    )
+    errors: Dict[str, int] = field(default_factory=lambda: collections.defaultdict(int))
+    throttled: int = 0
+    accepted: int = 0
+    scored_latencies: List[float] = field(default_factory=list)
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def record(self, endpoint: str, elapsed: float, ok: bool) -> None:
+        with self.lock:
+            self.latencies[endpoint].append(elapsed)
+            if not ok:
+                self.errors[endpoint] += 1
+
+
+class Contestant:
+    def __init__(self, args, base_url: str, token: str, stats: Stats):
+        self._args = args
+        self._base = f"{base_url}/api/cms/contest/{args.contest}"
+        self._stats = stats
+        self._http = requests.Session()
+        self._http.headers["Authorization"] = f"Bearer {token}"
+
+    def _request(self, endpoint: str, method: str, url: str, **kwargs):
+        start = time.perf_counter()
+        try:
+            resp = self._http.request(method, url, timeout=30, **kwargs)
+        except requests.RequestException:
+            self._stats.record(endpoint, time.perf_counter() - start, False)
+            return None
+        self._stats.record(endpoint, time.perf_counter() - start, resp.ok)
+        return resp
+
+    def run(self, stop_at: float) -> None:
+        tasks = {}
+        for task_name in self._args.task:
+            resp = self._request("get_task", "GET", f"{self._base}/task/{task_name}")
+            if resp is None or not resp.ok:
+                return
+            tasks[task_name] = resp.json()
+
+        while time.monotonic() < stop_at:
+            time.sleep(random.expovariate(1 / self._args.think_time))
+            task_name = random.choice(self._args.task)
+            uuid = self._submit(task_name, tasks[task_name])
+            if uuid is None:
+                continue
+            submitted = time.monotonic()
+            if self._wait_scored(uuid, stop_at):
+                with self._stats.lock:
+                    self._stats.scored_latencies.append(time.monotonic() - submitted)
+            self._request("get_contest_scores", "GET", f"{self._base}/scores")
+
+    def _submit(self, task_name: str, task: dict) -> Optional[str]:
+        files = [
+            {
+                "filename": fname,
+                "content": base64.b64encode(
+                    f"// {random.random()}\nint main() {{ return 0; }}\n".encode()
+                ).decode(),
+            }
+            for fname in task["submission_format"]
+        ]
+        resp = self._request(
+            "submit",
+            "POST",
+            f"{self._base}/task/{task_name}/submit",
+            json={"language": self._args.language, "files": files},
+        )
+        if resp is None:
+            return None
+        if resp.status_code == 400 and resp.json().get("error_code") == "throttled":
+            with self._stats.lock:
+                self._stats.throttled += 1
+            return None
+        if not resp.ok:
+            return None
+        with self._stats.lock:
+            self._stats.accepted += 1
+        return resp.json()["uuid"]
+
+    def _wait_scored(self, uuid: str, stop_at: float) -> bool:
+        version = None
+        while time.monotonic() < stop_at:
+            time.sleep(self._args.poll_interval)
+            body: dict = {"uuids": [uuid]}
+            if version is not None:
+                body["version"] = version
+            resp = self._request(
+                "get_submissions_status",
+                "POST",
+                f"{self._base}/submissions/status",
+                json=body,
+            )
+            if resp is None or not resp.ok:
+                continue
+            data = resp.json()
+            version = data["version"]
+            for sub in data.get("submissions", []):
+                if sub["result"]["status"] in ("scored", "compilation_failed"):
+                    return True
+        return False
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    idx = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[idx]
+
+
+def _print_report(stats: Stats, elapsed: float, fake_es: FakeEvaluationService):
+    print(f"Duration: {elapsed:.1f}s")
+    print(
+        f"Submissions accepted: {stats.accepted} ({stats.accepted / elapsed:.2f}/s), "
+        f"throttled: {stats.throttled}, scored: {fake_es.scored}"
+    )
+    header = f"{'endpoint':<24} {'count':>7} {'err':>5} {'req/s':>8} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8}"
+    print(header)
+    print("-" * len(header))
+    for endpoint, lats in sorted(stats.latencies.items()):
+        print(
+            f"{endpoint:<24} {len(lats):>7} {stats.errors[endpoint]:>5} "
+            f"{len(lats) / elapsed:>8.2f} "
+            f"{_percentile(lats, 50) * 1000:>7.1f}ms {_percentile(lats, 90) * 1000:>7.1f}ms "
+            f"{_percentile(lats, 99) * 1000:>7.1f}ms {max(lats) * 1000:>7.1f}ms"
+        )
+    lats = stats.scored_latencies
+    if lats:
+        print(
+            f"submit -> scored: p50 {_percentile(lats, 50):.2f}s "
+            f"p90 {_percentile(lats, 90):.2f}s p99 {_percentile(lats, 99):.2f}s"
+        )
+
+
+def cmd_setup(app, args) -> None:
+    from aoiportal.cmsmirror.db import session as cms_session
+
+    with app.app_context():
+        contest: CMSContest = (
+            cms_session.query(CMSContest).filter(CMSContest.name == args.contest).one()
+        )
+        for i in range(args.contestants):
+            username = f"loadtest{i}"
+            cms_user = (
+                cms_session.query(CMSUser).filter(CMSUser.username == username).first()
+            )
+            if cms_user is None:
+                cms_user = CMSUser(
+                    first_name="Load",
+                    last_name=f"Test {i}",
+                    username=username,
+                    password="",
+                )
+                cms_session.add(cms_user)
+                cms_session.flush()
+            part = (
+                cms_session.query(CMSParticipation)
+                .filter(CMSParticipation.contest_id == contest.id)
+                .filter(CMSParticipation.user_id == cms_user.id)
+                .first()
+            )
+            if part is None:
+                cms_session.add(
+                    CMSParticipation(
+                        contest_id=contest.id, user_id=cms_user.id, hidden=True
+                    )
+                )
+            cms_session.commit()
+
+            user = User.query.filter_by(cms_username=username).first()
+            if user is None:
+                user = User(
+                    first_name="Load",
+                    last_name=f"Test {i}",
+                    email=f"{username}@loadtest.invalid",
+                    cms_id=cms_user.id,
+                    cms_username=username,
+                )
+                db.session.add(user)
+                db.session.commit()
+    print(f"Created {args.contestants} contestants")
+
+
+def cmd_run(app, args) -> None:
+    with app.app_context():
+        users = (
+            User.query.filter(User.cms_username.like("loadtest%"))
+            .order_by(User.id.asc())
+            .limit(args.contestants)
+            .all()
+        )
+        if len(users) < args.contestants:
+            sys.exit(f"Only {len(users)} contestants exist, run with --setup first")
+        tokens = [create_session(u)[1] for u in users]
+
+    fake_es = FakeEvaluationService(app, args.eval_delay)
+    fake_es.start()
+    server = make_server(args.host, args.port, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    stats = Stats()
+    base_url = f"http://{args.host}:{args.port}"
+    start = time.monotonic()
+    stop_at = start + args.duration
+    threads = [
+        threading.Thread(
+            target=Contestant(args, base_url, token, stats).run, args=(stop_at,)
+        )
+        for token in tokens
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.monotonic() - start
+
+    server.shutdown()
+    fake_es.stop()
+    _print_report(stats, elapsed, fake_es)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    args = parser.parse_args()
+    app = create_app(args.config)
+    if args.setup:
+        cmd_setup(app, args)
+    else:
+        cmd_run(app, args)
@@ -0,0 +1,158 @@
+"""Fixtures for the tests that need a CMS database.
+
+CMS uses PostgreSQL only types, so these tests run against the database in
+``AOI_TEST_CMS_DATABASE_URI`` and are skipped without it. The database
+should be empty: the CMS tables are created for the test session and
+dropped afterwards. The portal database is a temporary SQLite file.
+
+    AOI_TEST_CMS_DATABASE_URI=postgresql+psycopg2://postgres@localhost/aoi_test pytest
+"""
+
+import base64
+import datetime
+import os
+import uuid
+from dataclasses import dataclass
+
+import pytest
+import yaml
+
+from aoiportal.auth_util import create_session
+from aoiportal.cmsmirror.db import (  # type: ignore
+    Base,
+    Contest,
+    Dataset,
+    Participation,
+    Submission,
+    SubmissionResult,
+    Task,
+    User,
+    UserEval,
+    UserEvalResult,
+)
+from aoiportal.cmsmirror.db import session as cms_session
+from aoiportal.factory import create_app
+from aoiportal.models import User as PortalUser  # type: ignore
+from aoiportal.models import db  # type: ignore
+
+# Participations seeded by cms_data, each with one submission and one user
+# eval per task
+NUM_PARTICIPATIONS = 5
+NUM_TASKS = 2
+
+
+@dataclass(frozen=True)
+class CMSData:
+    contest_id: int
+    num_submissions: int
+    num_user_evals: int
+
+
+@pytest.fixture(scope="session")
+def app(tmp_path_factory):
+    cms_uri = os.environ.get("AOI_TEST_CMS_DATABASE_URI")
+    if not cms_uri:
+        pytest.skip("AOI_TEST_CMS_DATABASE_URI is not set")
+    tmp = tmp_path_factory.mktemp("aoiportal")
+    config = tmp / "config.yaml"
+    config.write_text(
+        yaml.safe_dump(
+            {
+                "database_uri": f"sqlite:///{tmp / 'portal.db'}",
+                "secret_key": "test",
+                "session_token_key": base64.b64encode(os.urandom(32)).decode(),
+                "cms": {"database_uri": cms_uri},
+            }
+        )
+    )
+    app = create_app(str(config))
+    cms_engine = app.extensions["cms"].engine
+    with app.app_context():
+        db.create_all()
+    Base.metadata.create_all(cms_engine)
+    try:
+        yield app
+    finally:
+        Base.metadata.drop_all(cms_engine)
+
+
+@pytest.fixture(scope="session")
+def cms_data(app) -> CMSData:
+    now = datetime.datetime.utcnow()
+    with app.app_context():
+        contest = Contest(name="contest", description="Contest")
+        cms_session.add(contest)  # type: ignore
+        tasks = []
+        for i in range(NUM_TASKS):
+            task = Task(contest=contest, num=i, name=f"task{i}", title=f"Task {i}")
+            dataset = Dataset(
+                task=task,
+                description="default",
+                task_type="Batch",
+                task_type_parameters=["alone", ["", ""], "diff"],
+                score_type="Sum",
+                score_type_parameters=10,
+            )
+            task.active_dataset = dataset
+            tasks.append(task)
+        cms_session.add_all(tasks)  # type: ignore
+        for i in range(NUM_PARTICIPATIONS):
+            user = User(
+                first_name=f"First{i}",
+                last_name=f"Last{i}",
+                username=f"user{i}",
+                password="",
+            )
+            part = Participation(contest=contest, user=user)
+            cms_session.add(part)  # type: ignore
+            for task in tasks:
+                sub = Submission(
+                    uuid=str(uuid.uuid4()),
+                    participation=part,
+                    task=task,
+                    timestamp=now,
+                    language="C++17 / g++",
+                )
+                cms_session.add(sub)  # type: ignore
+                cms_session.add(  # type: ignore
+                    SubmissionResult(submission=sub, dataset=task.active_dataset)
+                )
+                ueval = UserEval(
+                    uuid=str(uuid.uuid4()),
+                    participation=part,
+                    task=task,
+                    timestamp=now,
+                    language="C++17 / g++",
+                    input="0" * 40,
+                )
+                cms_session.add(ueval)  # type: ignore
+                cms_session.add(  # type: ignore
+                    UserEvalResult(user_eval=ueval, dataset=task.active_dataset)
+                )
+        cms_session.commit()  # type: ignore
+        contest_id = contest.id
+    return CMSData(
+        contest_id=contest_id,
+        num_submissions=NUM_PARTICIPATIONS * NUM_TASKS,
+        num_user_evals=NUM_PARTICIPATIONS * NUM_TASKS,
+    )
+
+
+@pytest.fixture(scope="session")
+def admin_headers(app):
+    with app.app_context():
+        admin = PortalUser(
+            first_name="Admin",
+            last_name="Admin",
+            email="admin@example.com",
+            is_admin=True,
+        )
+        db.session.add(admin)
+        db.session.commit()
+        _, token = create_session(admin)
+    return {"Authorization": f"Bearer {token}"}
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
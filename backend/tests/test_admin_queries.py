@@ -0,0 +1,68 @@
+"""Query counts of the admin list endpoints.
+
+The lists are requested with a page of one row and a page with all rows,
+both must stay within the same budget, so per-row lazy loads (N+1 queries)
+fail instead of only slowing down the page.
+"""
+
+import pytest
+
+from aoiportal.metrics import DB_CMS
+from aoiportal.sqlprofile import query_budget
+
+# CMS statements per request, independent of the number of rows
+SUBMISSIONS_BUDGET = 3  # page, total count, max scores of the datasets
+USER_EVALS_BUDGET = 2  # page, total count
+USERS_BUDGET = 2  # users, participations with their contests
+PARTICIPATIONS_BUDGET = 2  # contest, participations with their users
+
+
+def _get(app, client, headers, url: str, budget: int):
+    with query_budget(app, budget, db=DB_CMS):
+        resp = client.get(url, headers=headers)
+        # streamed lists run their queries while the body is read
+        body = resp.get_json()
+    assert resp.status_code == 200, body
+    return body
+
+
+@pytest.mark.parametrize("per_page", [1, 200])
+def test_submissions(app, client, admin_headers, cms_data, per_page):
+    body = _get(
+        app,
+        client,
+        admin_headers,
+        f"/api/cms/admin/submissions?per_page={per_page}",
+        SUBMISSIONS_BUDGET,
+    )
+    assert len(body["items"]) == min(per_page, cms_data.num_submissions)
+    assert body["total"] == cms_data.num_submissions
+
+
+@pytest.mark.parametrize("per_page", [1, 200])
+def test_user_evals(app, client, admin_headers, cms_data, per_page):
+    body = _get(
+        app,
+        client,
+        admin_headers,
+        f"/api/cms/admin/user-evals?per_page={per_page}",
+        USER_EVALS_BUDGET,
+    )
+    assert len(body["items"]) == min(per_page, cms_data.num_user_evals)
+    assert body["total"] == cms_data.num_user_evals
+
+
+def test_users(app, client, admin_headers, cms_data):
+    body = _get(app, client, admin_headers, "/api/cms/admin/users", USERS_BUDGET)
+    assert all(len(user["participations"]) == 1 for user in body)
+
+
+def test_participations(app, client, admin_headers, cms_data):
+    body = _get(
+        app,
+        client,
+        admin_headers,
+        f"/api/cms/admin/contest/{cms_data.contest_id}/participations",
+        PARTICIPATIONS_BUDGET,
+    )
+    assert len(body) == len({part["user"]["id"] for part in body})
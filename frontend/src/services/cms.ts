@@ -7,14 +7,82 @@ import {
   QuestionParams,
   Submission,
   SubmissionShort,
+  SubmissionsStatusParams,
+  SubmissionsStatusResult,
   SubmitParams,
   SubmitResult,
+  SubmitUploadParams,
   Task,
   UserEval,
   UserEvalSubmitParams,
   UserEvalSubmitResult,
+  UserEvalSubmitUploadParams,
 } from "@/types/cms";
 
+// ETag of the last check-notifications response per contest. The server
+// answers 304 while nothing changed since then.
+const notificationsETags = new Map<string, string>();
+
+async function sha1Hex(blob: Blob): Promise<string | null> {
+  // crypto.subtle is only available in secure contexts
+  if (!window.crypto?.subtle) return null;
+  const hash = await crypto.subtle.digest("SHA-1", await blob.arrayBuffer());
+  return Array.from(new Uint8Array(hash))
+    .map((b) => b.toString(16).padStart(2, "0"))
+    .join("");
+}
+
+// Below this total size the files are uploaded right away, asking the
+// server which of them it already has would cost more than the upload.
+const NEGOTIATE_MIN_SIZE = 64 * 1024;
+
+// Raw files are sent as multipart parts instead of base64 inside JSON.
+// Larger uploads only reference contents the participation uploaded before
+// by their digest.
+async function uploadFormData(
+  contestName: string,
+  taskName: string,
+  language: string,
+  files: { filename: string; content: Blob }[],
+  input?: Blob,
+): Promise<FormData> {
+  const parts = files.map((f) => ({ field: "files", ...f }));
+  if (input !== undefined) {
+    parts.push({ field: "input", filename: "input", content: input });
+  }
+  const size = parts.reduce((sum, p) => sum + p.content.size, 0);
+  let digests: (string | null)[] = parts.map(() => null);
+  if (size >= NEGOTIATE_MIN_SIZE) {
+    digests = await Promise.all(parts.map((p) => sha1Hex(p.content)));
+  }
+  let missing = new Set<string>();
+  if (digests.length > 0 && !digests.includes(null)) {
+    const resp = await http.post(
+      `/api/cms/contest/${encodeURIComponent(
+        contestName,
+      )}/task/${encodeURIComponent(taskName)}/missing-digests`,
+      { digests },
+    );
+    missing = new Set(resp.data.missing);
+  }
+  const form = new FormData();
+  form.append("language", language);
+  const known: Record<string, string> = {};
+  parts.forEach((part, i) => {
+    const digest = digests[i];
+    if (digest !== null && !missing.has(digest)) {
+      if (part.field === "input") form.append("input_digest", digest);
+      else known[part.filename] = digest;
+    } else {
+      form.append(part.field, part.content, part.filename);
+    }
+  });
+  if (Object.keys(known).length > 0) {
+    form.append("digests", JSON.stringify(known));
+  }
+  return form;
+}
+
 class CMSService {
   async getContest(contestName: string): Promise<Contest> {
     const resp = await http.get(
@@ -58,6 +126,16 @@ class CMSService {
     );
     return resp.data;
   }
+  async getSubmissionsStatus(
+    contestName: string,
+    data: SubmissionsStatusParams,
+  ): Promise<SubmissionsStatusResult> {
+    const resp = await http.post(
+      `/api/cms/contest/${encodeURIComponent(contestName)}/submissions/status`,
+      data,
+    );
+    return resp.data;
+  }
   async getStatement(
     contestName: string,
     taskName: string,
@@ -231,6 +309,19 @@ class CMSService {
     );
     return resp.data;
   }
+  async submitUpload(
+    contestName: string,
+    taskName: string,
+    data: SubmitUploadParams,
+  ): Promise<SubmitResult> {
+    const resp = await http.post(
+      `/api/cms/contest/${encodeURIComponent(
+        contestName,
+      )}/task/${encodeURIComponent(taskName)}/submit-multipart`,
+      await uploadFormData(contestName, taskName, data.language, data.files),
+    );
+    return resp.data;
+  }
   async userEval(
     contestName: string,
     taskName: string,
@@ -244,6 +335,26 @@ class CMSService {
     );
     return resp.data;
   }
+  async userEvalUpload(
+    contestName: string,
+    taskName: string,
+    data: UserEvalSubmitUploadParams,
+  ): Promise<UserEvalSubmitResult> {
+    const form = await uploadFormData(
+      contestName,
+      taskName,
+      data.language,
+      data.files,
+      data.input,
+    );
+    const resp = await http.post(
+      `/api/cms/contest/${encodeURIComponent(
+        contestName,
+      )}/task/${encodeURIComponent(taskName)}/eval-multipart`,
+      form,
+    );
+    return resp.data;
+  }
   async getUserEval(
     contestName: string,
     taskName: string,
@@ -262,10 +373,22 @@ class CMSService {
     contestName: string,
     data: CheckNotificationsParams,
   ): Promise<CheckNotificationsResult> {
+    const etag = notificationsETags.get(contestName);
     const resp = await http.post(
       `/api/cms/contest/${encodeURIComponent(contestName)}/check-notifications`,
       data,
+      {
+        headers: etag ? { "If-None-Match": etag } : {},
+        validateStatus: (status) =>
+          (status >= 200 && status < 300) || status === 304,
+      },
     );
+    if (resp.status === 304) {
+      return { new_announcements: [], new_messages: [], new_replies: [] };
+    }
+    if (resp.headers.etag) {
+      notificationsETags.set(contestName, resp.headers.etag);
+    }
     return resp.data;
   }
   async getContestScores(contestName: string): Promise<ContestTaskScores> {
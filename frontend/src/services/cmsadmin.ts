@@ -127,6 +127,8 @@ class CMSAdminService {
     userId?: number;
     perPage?: number;
     page?: number;
+    before?: string;
+    after?: string;
   }): Promise<AdminSubmissionsPaginated> {
     const resp = await http.get("/api/cms/admin/submissions", {
       params: {
@@ -135,6 +137,8 @@ class CMSAdminService {
         user_id: args?.userId,
         per_page: args?.perPage,
         page: args?.page,
+        before: args?.before,
+        after: args?.after,
       },
     });
     return resp.data;
@@ -145,6 +149,8 @@ class CMSAdminService {
     userId?: number;
     perPage?: number;
     page?: number;
+    before?: string;
+    after?: string;
   }): Promise<AdminUserEvalsPaginated> {
     const resp = await http.get("/api/cms/admin/user-evals", {
       params: {
@@ -153,6 +159,8 @@ class CMSAdminService {
         user_id: args?.userId,
         per_page: args?.perPage,
         page: args?.page,
+        before: args?.before,
+        after: args?.after,
       },
     });
     return resp.data;
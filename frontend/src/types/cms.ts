@@ -245,6 +245,16 @@ export interface SubmitResult {
   submission: SubmissionShort;
 }
 
+export interface SubmissionsStatusParams {
+  uuids: string[];
+  version?: string;
+}
+export interface SubmissionsStatusResult {
+  version: string;
+  changed: boolean;
+  submissions?: SubmissionShort[];
+}
+
 export interface UserEvalSubmitParams {
   language: string;
   files: {
@@ -253,6 +263,16 @@ export interface UserEvalSubmitParams {
   }[];
   input: string;
 }
+export interface SubmitUploadParams {
+  language: string;
+  files: {
+    filename: string;
+    content: Blob;
+  }[];
+}
+export interface UserEvalSubmitUploadParams extends SubmitUploadParams {
+  input: Blob;
+}
 export interface UserEvalSubmitResult {
   uuid: string;
 }
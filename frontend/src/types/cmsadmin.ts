@@ -227,8 +227,13 @@ export interface AdminSubmissionDetailed extends AdminSubmissionBase {
 export interface PaginatedResult<T> {
   page: number;
   per_page: number;
+  // may lag behind items by a few seconds
   total: number;
   items: T[];
+  // pass as before/after to load the items older/newer than these
+  first_cursor: string | null;
+  last_cursor: string | null;
+  has_more: boolean;
 }
 
 export type AdminSubmissionsPaginated = PaginatedResult<AdminSubmissionShort>;